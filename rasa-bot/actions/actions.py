@@ -9,6 +9,7 @@ from rasa_sdk.events import SlotSet
 import os
 import re, time, requests
 from .utils import get_persona_defaults, natural_search
+from . import prefetch
 API_BASE = os.getenv("REA_API_BASE", "http://localhost:8008/api/v2")
 
 VALID_TYPES = {"căn hộ","nhà ở","nhà mặt tiền","studio","nhà vùng ven"}
@@ -198,6 +199,13 @@ class ValidatePropertySearchForm(FormValidationAction):
     def name(self) -> Text:
         return "validate_property_search_form"
 
+    async def run(self, dispatcher, tracker, domain):
+        events = await super().run(dispatcher, tracker, domain)
+        # start searching before the form is complete (see prefetch.py)
+        slots = dict(tracker.current_slot_values())
+        slots.update({e["name"]: e["value"] for e in events if e.get("event") == "slot"})
+        prefetch.maybe_prefetch(tracker.sender_id, slots)
+        return events
 
     async def extract_budget(self, dispatcher, tracker, domain):
     # Try to parse a number from the last user message
@@ -236,8 +244,25 @@ class ActionSearchProperties(Action):
         filters = {k: v for k, v in filters.items() if v not in (None, "")}
 
 
+        # "xem thêm": page through the previous result list instead of searching again
+        cursor = None
+        if tracker.latest_message.get("intent", {}).get("name") == "show_more":
+            cursor = tracker.get_slot("search_cursor")
+            if not cursor:
+                # nothing left to page through: do not search for the words "xem thêm"
+                dispatcher.utter_message(text="That's all the properties I found for this search.")
+                return []
+
         try:
-            results = natural_search(query=query, filters=filters, top_k=5)
+            if prefetch.is_page(cursor):
+                # "xem thêm" after a prefetched answer; expired: search the narrowed filters again
+                results = prefetch.page(tracker.sender_id, top_k=5)
+                cursor = None
+                query = f"{filters.get('property_type', '')} {filters.get('location', '')}".strip()
+            else:
+                results = None if cursor else prefetch.take(tracker.sender_id, filters, top_k=5)
+            if results is None:
+                results = natural_search(query=query, filters=filters, top_k=5, cursor=cursor)
         except Exception as e:
             dispatcher.utter_message(text=f"I had trouble searching right now. {e}")
             return []
@@ -245,7 +270,7 @@ class ActionSearchProperties(Action):
         items = results.get("items", [])
         if not items:
             dispatcher.utter_message(response="utter_no_results")
-            return []
+            return [SlotSet("search_cursor", None)]
 
 
         # Render top results
@@ -255,7 +280,7 @@ class ActionSearchProperties(Action):
             title = meta.get("title") or f"{meta.get('property_type','Property')} in {meta.get('location','?')}"
             price = meta.get("price")
             br = meta.get("bedrooms")
-            desc = (meta.get("description") or "").strip()
+            desc = (meta.get("description") or it.get("page_content") or "").strip()
             desc = (desc[:180] + "…") if len(desc) > 180 else desc
             lines.append(f"• {title} — {br} BR — ${price}\n {desc}")
 
@@ -263,4 +288,4 @@ class ActionSearchProperties(Action):
           # Rephrase last user message
         print("Rephrasing user message...".join(lines))
         dispatcher.utter_message(text="Here are some properties I found:\n" + "\n".join(lines))
-        return []
\ No newline at end of file
+        return [SlotSet("search_cursor", results.get("next_cursor"))]
\ No newline at end of file
@@ -0,0 +1,127 @@
+# rasa-bot/actions/prefetch.py
+# Speculative search while property_search_form is still filling slots: as soon as
+# location + property_type are known, a broad search runs in the background and the
+# result is kept per sender_id. ActionSearchProperties then only narrows it locally
+# with the late constraints (budget, bedrooms) instead of a new round trip.
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import natural_search
+
+PREFETCH_TOP_K = int(os.getenv("REA_PREFETCH_TOP_K", "30"))
+PREFETCH_TTL_S = float(os.getenv("REA_PREFETCH_TTL_S", "300"))
+PREFETCH_WAIT_S = float(os.getenv("REA_PREFETCH_WAIT_S", "3"))
+PREFETCH_MAX_PAGES = int(os.getenv("REA_PREFETCH_MAX_PAGES", "3"))  # API pages per "xem thêm" after the prefetch
+PAGE_PREFIX = "prefetch:"
+
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search-prefetch")
+_lock = threading.Lock()
+_cache = {}  # sender_id -> {"key": (location, type), "query": str, "future": Future, "ts": float}
+_pages = {}  # sender_id -> paging state of a prefetched answer, see take()
+
+
+def _key(slots):
+    loc = str(slots.get("location") or "").strip().lower()
+    ptype = str(slots.get("property_type") or "").strip().lower()
+    return (loc, ptype) if loc and ptype else None
+
+
+def maybe_prefetch(sender_id, slots):
+    key = _key(slots)
+    if key is None:
+        return
+    now = time.time()
+    with _lock:
+        entry = _cache.get(sender_id)
+        if entry and entry["key"] == key and now - entry["ts"] < PREFETCH_TTL_S:
+            return
+        # drop stale entries of other conversations while we are here
+        for sid in [s for s, e in _cache.items() if now - e["ts"] >= PREFETCH_TTL_S]:
+            del _cache[sid]
+        for sid in [s for s, e in _pages.items() if now - e["ts"] >= PREFETCH_TTL_S]:
+            del _pages[sid]
+        query = f"{slots.get('property_type')} {slots.get('location')}"
+        future = _pool.submit(
+            natural_search,
+            query=query,
+            filters={"location": slots.get("location"), "property_type": slots.get("property_type")},
+            top_k=PREFETCH_TOP_K,
+        )
+        _cache[sender_id] = {"key": key, "query": query, "future": future, "ts": now}
+
+
+def _narrow(meta, filters):
+    # same semantics as the API post-filter
+    try:
+        if filters.get("bedrooms") is not None and float(meta.get("bedrooms") or 0) < float(filters["bedrooms"]) - 1e-6:
+            return False
+        if filters.get("budget_max") is not None and float(meta.get("price") or 1e12) > float(filters["budget_max"]) + 1e-6:
+            return False
+    except (TypeError, ValueError):
+        pass
+    return True
+
+
+def take(sender_id, filters, top_k):
+    """
+    First top_k prefetched items narrowed to filters as {"items", "next_cursor"}, else
+    None (ask the API). The rest stays here for "xem thêm": next_cursor is then a
+    PAGE_PREFIX marker for page(), not an API cursor (that one would page unnarrowed hits).
+    """
+    with _lock:
+        entry = _cache.pop(sender_id, None)
+    if entry is None or entry["key"] != _key(filters) or time.time() - entry["ts"] >= PREFETCH_TTL_S:
+        return None
+    try:
+        results = entry["future"].result(timeout=PREFETCH_WAIT_S)
+    except Exception:
+        return None
+    items = [it for it in results.get("items", []) if _narrow(it.get("metadata", {}), filters)]
+    if not items and results.get("next_cursor"):
+        return None  # nothing of the broad list survives: a narrowed search is cheaper
+    state = {
+        "query": entry["query"], "filters": filters, "ts": time.time(),
+        "rest": items[top_k:], "served": {it.get("id") for it in items[:top_k]},
+        # the broad list was cut off: a narrowed API search continues after the rest
+        "more": bool(results.get("next_cursor")), "cursor": None,
+    }
+    return {"items": items[:top_k], "next_cursor": _remember(sender_id, state)}
+
+
+def _remember(sender_id, state):
+    if not state["rest"] and not state["more"] and not state["cursor"]:
+        with _lock:
+            _pages.pop(sender_id, None)
+        return None
+    with _lock:
+        _pages[sender_id] = state
+    return PAGE_PREFIX + sender_id
+
+
+def is_page(cursor):
+    return bool(cursor) and cursor.startswith(PAGE_PREFIX)
+
+
+def page(sender_id, top_k):
+    """Next top_k items after take(), as {"items", "next_cursor"}; None when the state expired."""
+    with _lock:
+        state = _pages.get(sender_id)
+    if state is None or time.time() - state["ts"] >= PREFETCH_TTL_S:
+        return None
+    out = state["rest"][:top_k]
+    state["rest"] = state["rest"][top_k:]
+    # past the prefetched list: open a cursor with the narrowed filters, skipping what was shown
+    for _ in range(PREFETCH_MAX_PAGES):
+        if len(out) >= top_k or not (state["more"] or state["cursor"]):
+            break
+        results = natural_search(query=state["query"], filters=state["filters"], top_k=top_k,
+                                 cursor=state["cursor"])
+        state["more"], state["cursor"] = False, results.get("next_cursor")
+        fresh = [it for it in results.get("items", []) if it.get("id") not in state["served"]]
+        state["rest"] = fresh[top_k - len(out):] + state["rest"]
+        out += fresh[:top_k - len(out)]
+    state["served"].update(it.get("id") for it in out)
+    state["ts"] = time.time()
+    return {"items": out, "next_cursor": _remember(sender_id, state)}
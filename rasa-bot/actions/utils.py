@@ -24,8 +24,21 @@ def get_persona_defaults():
     }
 
 
-def natural_search(query: str, filters: dict | None = None, top_k: int = 5):
-    payload = {"query": query, "filters": filters or {}, "top_k": top_k}
+# only what the search renderer (and prefetch narrowing) reads
+SEARCH_FIELDS = [
+    "id", "score", "page_content",
+    "metadata.property_id", "metadata.title", "metadata.property_type", "metadata.location",
+    "metadata.price", "metadata.bedrooms", "metadata.description",
+]
+SNIPPET_CHARS = 180
+
+
+def natural_search(query: str, filters: dict | None = None, top_k: int = 5, cursor: str | None = None):
+    payload = {"query": query, "filters": filters or {}, "top_k": top_k,
+               "fields": SEARCH_FIELDS, "snippet_chars": SNIPPET_CHARS}
+    if cursor:
+        # next page of a previous search; the server keeps query + filters
+        payload["cursor"] = cursor
     r = requests.post(f"{API_BASE}/property/search/natural", json=payload, timeout=15)
     r.raise_for_status()
     return r.json()
\ No newline at end of file
@@ -1,9 +1,11 @@
 from __future__ import annotations
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List
 from langchain.schema import Document
 import re
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import json
+
+from . import geo
 # Các key KHÔNG đưa vào text (đi khắp JSON theo path)
 NOISE_KEYS = {
     "misc.created_at", "misc.updated_at",
@@ -41,6 +43,15 @@ MIN_VALUE_CHARS = 4           # bỏ các mẩu quá ngắn (vd: "ok", "N/A")
 MAX_VALUE_CHARS = 600         # cắt bớt giá trị quá dài  (per value)
 MAX_LIST_ITEMS_PER_SECTION = 50  # list quá dài thì cắt bớt
 
+# Đóng gói section nhỏ (tính theo token): các section <= PACK_MAX_SECTION_TOKENS của cùng
+# property được ghép chung 1 chunk section="packed", metadata "sections" giữ danh sách gốc
+PACK_MAX_SECTION_TOKENS = 48
+PACKED_SECTION = "packed"
+CHUNK_OVERLAP_TOKENS = 16     # ~ 120/800 ký tự như trước, với budget 126 token của MiniLM
+# Section thường giống hệt nhau giữa các căn cùng dự án: không đóng gói, để chunk của
+# chúng trùng text giữa các căn và được lưu 1 lần (xem shared_chunks.py)
+SHARED_SECTIONS = ("living_experience", "equipment_and_handover_materials", "property_groups")
+
 # Regex để bỏ chuỗi có ít ngữ nghĩa
 RE_MOSTLY_NUMERIC = re.compile(r"^[\d\W_]+$")  # toàn số/ký tự không chữ
 RE_UUID_LIKE = re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[1-5][0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}\b", re.I)
@@ -133,6 +144,10 @@ def json_to_documents(property_json: Dict[str, Any]) -> List[Document]:
         },
     }
 
+    location = _first_non_empty(property_json, ["design_and_layout.location","physical_features.location"])
+    # canonical city/district/ward ids + lat/lon (geo.py), property-level like the rest
+    place = geo.locate(property_json, location)
+
     docs: List[Document] = []
     for section, content in buckets.items():
         parts = _flatten(content, prefix=section, section=section)  # <-- truyền section
@@ -148,10 +163,11 @@ def json_to_documents(property_json: Dict[str, Any]) -> List[Document]:
             "property_id": pid,
             "section": section,
             "unitId": property_json.get("unitId"),
-            "location": _first_non_empty(property_json, ["design_and_layout.location","physical_features.location"]),
+            "location": location,
             "property_type": _first_non_empty(property_json, ["design_and_layout.type","design_and_layout.property_type"]),
             "bedrooms": _safe_float(_first_non_empty(property_json, ["design_and_layout.bedrooms"])),
             "price": _safe_float(_first_non_empty(property_json, ["design_and_layout.price"])),
+            **place,
         }
 
         # 🔧 1) ép kiểu về primitive và bỏ None
@@ -160,10 +176,10 @@ def json_to_documents(property_json: Dict[str, Any]) -> List[Document]:
             if v is None:
                 continue
             # chuẩn hoá string
-            if k in ("location", "property_type", "unitId", "section", "property_id"):
+            if k in ("location", "property_type", "unitId", "section", "property_id", "city_id", "district_id", "ward_id"):
                 cleaned[k] = str(v)
             # numeric giữ float
-            elif k in ("bedrooms", "price"):
+            elif k in ("bedrooms", "price", "lat", "lon"):
                 try:
                     cleaned[k] = float(v)
                 except Exception:
@@ -175,24 +191,65 @@ def json_to_documents(property_json: Dict[str, Any]) -> List[Document]:
         metadata = cleaned
         docs.append(Document(page_content=text_block, metadata=metadata))   
     return docs
+def _token_counter(tokenizer: Any) -> Callable[[str], int]:
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+def _pack(group: List[Document]) -> Document:
+    if len(group) == 1:
+        return group[0]
+    meta = dict(group[0].metadata or {})
+    meta["section"] = PACKED_SECTION
+    meta["sections"] = ",".join(d.metadata.get("section") or "misc" for d in group)
+    return Document(page_content="\n".join(d.page_content for d in group), metadata=meta)
+
 def chunk_documents(
     docs: List[Document],
     chunk_size: int = 800,
-    chunk_overlap: int = 120
+    chunk_overlap: int = 120,
+    tokenizer: Any = None,
 ) -> List[Document]:
+    """
+    Không có tokenizer: cắt theo ký tự như cũ.
+    Có tokenizer (của model embedding): chunk_size/chunk_overlap tính theo token, nên
+    chunk_size = max_seq_length của model thì không chunk nào bị model cắt cụt; các
+    section nhỏ của cùng property được ghép lại để giảm số embedding.
+    """
+    length = _token_counter(tokenizer) if tokenizer is not None else len
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
+        length_function=length,
         add_start_index=True,
         separators=["\n\n","\n",". "," ",""],
     )
+    units: List[Document] = []
+    if tokenizer is None:
+        units = docs
+    else:
+        # gom section nhỏ theo property, giữ thứ tự
+        pending: Dict[str, tuple[List[Document], int]] = {}
+        for d in docs:
+            pid = d.metadata.get("property_id")
+            n = length(d.page_content)
+            if n > PACK_MAX_SECTION_TOKENS or d.metadata.get("section") in SHARED_SECTIONS:
+                units.append(d)
+                continue
+            group, total = pending.get(pid, ([], 0))
+            if group and total + n + 1 > chunk_size:
+                units.append(_pack(group))
+                group, total = [], 0
+            pending[pid] = (group + [d], total + n + 1)
+        units.extend(_pack(group) for group, _ in pending.values())
+
     out: List[Document] = []
-    for d in docs:
-        chs = splitter.split_documents([d])
-        for i, c in enumerate(chs):
+    counters: Dict[tuple, int] = {}
+    for d in units:
+        for c in splitter.split_documents([d]):
             c.metadata = dict(c.metadata or {})
-            c.metadata["chunk_index"] = i
-        out.extend(chs)
+            key = (c.metadata.get("property_id"), c.metadata.get("section"))
+            c.metadata["chunk_index"] = counters.get(key, 0)
+            counters[key] = c.metadata["chunk_index"] + 1
+            out.append(c)
     return out
 
 def _is_noise_key(path: str, section: str | None = None) -> bool:
@@ -0,0 +1,83 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+
+from .vectorstore_langchain import PERSIST_DIR, _chroma, compact_batch, drop_retired, rebuild_index
+
+# Background removal of tombstoned properties (see tombstones.py). Chunks are
+# deleted in batches off the request path; once the share of deleted HNSW nodes
+# since the last rebuild passes REBUILD_FRAGMENTATION the collection is rebuilt.
+COMPACT_INTERVAL_S = float(os.getenv("COMPACT_INTERVAL_S", "30"))
+COMPACT_BATCH = int(os.getenv("COMPACT_BATCH", "50"))
+REBUILD_FRAGMENTATION = float(os.getenv("REBUILD_FRAGMENTATION", "0.2"))
+_STATE_FILE = os.path.join(PERSIST_DIR, "compaction.json")
+
+log = logging.getLogger(__name__)
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def _load_state() -> dict:
+    try:
+        with open(_STATE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"deleted_since_rebuild": {}}
+
+
+def _save_state(state: dict) -> None:
+    tmp = _STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, _STATE_FILE)
+
+
+def run_once() -> int:
+    """Drain tombstones in batches, then rebuild every partition whose fragmentation is over the threshold."""
+    state = _load_state()
+    deleted = state["deleted_since_rebuild"]
+    removed = 0
+    while not _stop.is_set():
+        n_props, per_coll = compact_batch(COMPACT_BATCH)
+        if not n_props:
+            break
+        for name, n in per_coll.items():
+            deleted[name] = deleted.get(name, 0) + n
+            removed += n
+    if removed:
+        _save_state(state)
+        log.info("[compactor] removed %d tombstoned chunks", removed)
+
+    for name, n_deleted in list(deleted.items()):
+        if not n_deleted:
+            continue
+        live = _chroma(name)._collection.count()
+        if n_deleted / max(live + n_deleted, 1) >= REBUILD_FRAGMENTATION:
+            copied = rebuild_index(name)
+            deleted[name] = 0
+            _save_state(state)
+            log.info("[compactor] rebuilt %s with %d chunks (%d deletes)", name, copied, n_deleted)
+    drop_retired()
+    return removed
+
+
+def _loop() -> None:
+    while not _stop.wait(COMPACT_INTERVAL_S):
+        try:
+            run_once()
+        except Exception:
+            log.exception("[compactor] pass failed")
+
+
+def start() -> None:
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _stop.clear()
+        _thread = threading.Thread(target=_loop, name="tombstone-compactor", daemon=True)
+        _thread.start()
+
+
+def stop() -> None:
+    _stop.set()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+import base64
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+# Server-side candidate lists behind the opaque cursors returned by the search
+# endpoints. A list keeps the query embedding and the already post-filtered hits,
+# so following pages are slices and only an exhausted list goes back to the store.
+CURSOR_TTL_S = int(os.getenv("CURSOR_TTL_S", "600"))
+CURSOR_MAX_LISTS = int(os.getenv("CURSOR_MAX_LISTS", "1000"))
+
+_lock = threading.Lock()
+_lists: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+class CursorExpired(KeyError):
+    pass
+
+
+def _evict(now: float) -> None:
+    while _lists:
+        token, entry = next(iter(_lists.items()))
+        if entry["expires"] > now and len(_lists) <= CURSOR_MAX_LISTS:
+            break
+        _lists.popitem(last=False)
+
+
+def open_list(query: str, filters: Dict[str, Any], embedding: List[float]) -> Tuple[str, Dict[str, Any]]:
+    entry = {
+        "query": query,
+        "filters": dict(filters),
+        "embedding": embedding,
+        "items": [],        # post-filtered hits, in score order
+        "seen": set(),      # ids in items
+        "fetched": 0,       # raw store results consumed so far
+        "exhausted": False,
+        "lock": threading.Lock(),
+        "expires": time.time() + CURSOR_TTL_S,
+    }
+    token = secrets.token_urlsafe(12)
+    with _lock:
+        _lists[token] = entry
+        _evict(time.time())
+    return token, entry
+
+
+def get_list(token: str) -> Dict[str, Any]:
+    now = time.time()
+    with _lock:
+        _evict(now)
+        entry = _lists.get(token)
+        if entry is None:
+            raise CursorExpired(token)
+        # sliding TTL: a list stays alive while someone is paging through it
+        entry["expires"] = now + CURSOR_TTL_S
+        _lists.move_to_end(token)
+        return entry
+
+
+def encode(token: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{token}:{offset}".encode()).decode().rstrip("=")
+
+
+def decode(cursor: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        token, offset = raw.rsplit(":", 1)
+        return token, int(offset)
+    except Exception:
+        raise CursorExpired(cursor)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+# One process-wide instance per embedding model. Both vector stores and every CLI
+# go through here, so a model is loaded once, on first use (or by warm_up() at
+# startup) and never at import time: importing a module that only needs the
+# gazetteer or the SQL tables does not pull in torch.
+log = logging.getLogger(__name__)
+
+PROPERTY_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+MESSAGE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_lock = threading.Lock()
+_models: Dict[str, Any] = {}
+load_seconds: Dict[str, float] = {}
+
+
+def embeddings(name: str):
+    """langchain HuggingFaceEmbeddings for `name`, created once."""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        if name not in _models:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            t = time.perf_counter()
+            _models[name] = HuggingFaceEmbeddings(model_name=name)
+            load_seconds[name] = round(time.perf_counter() - t, 3)
+            log.info("[encoders] loaded %s in %.2fs", name, load_seconds[name])
+        return _models[name]
+
+
+def sentence_model(name: str):
+    """The SentenceTransformer behind embeddings(name) (same instance, not a second copy)."""
+    return embeddings(name).client
+
+
+def loaded() -> Dict[str, float]:
+    return dict(load_seconds)
+
+
+def warm_up(*names: str) -> Dict[str, float]:
+    """Load the models and run one encode each, so the first request does not pay for kernels/allocations."""
+    out: Dict[str, float] = {}
+    for name in names or (PROPERTY_MODEL, MESSAGE_MODEL):
+        t = time.perf_counter()
+        embeddings(name).embed_query("khởi động warm up")
+        out[name] = round(time.perf_counter() - t, 3)
+    return out
+
+
+class LazyEmbeddings:
+    """Stands in for embeddings(name) until an attribute is first used."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(embeddings(self._name), attr)
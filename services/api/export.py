@@ -0,0 +1,90 @@
+from __future__ import annotations
+import argparse
+import base64
+import json
+import struct
+import sys
+from typing import Any, Dict, Iterator, List
+
+from . import shared_chunks, tombstones
+from .vectorstore import _msg_collection
+from .vectorstore_langchain import COLL_SHARED, _all_collections, _chroma
+
+# Streaming NDJSON dump of a vector collection, one record per line:
+#   {"c": collection, "id", "doc", "meta"[, "vec": base64 little-endian float16]}
+# Deduplicated chunks (c = property_shared_chunks) also carry "owners": [property_id].
+# The store is read in pages of `batch` rows, so memory stays bounded by one page
+# whatever the collection size. Offset paging is not a point-in-time view: rows
+# written during the export may be missed or seen twice (use snapshot.py for that).
+TARGETS = ("properties", "messages")
+DEFAULT_BATCH = 500
+
+
+def _vec_to_f16(vec) -> str:
+    return base64.b64encode(struct.pack(f"<{len(vec)}e", *vec)).decode("ascii")
+
+
+def f16_to_vec(s: str) -> List[float]:
+    raw = base64.b64decode(s)
+    return list(struct.unpack(f"<{len(raw) // 2}e", raw))
+
+
+def _collections(target: str) -> List[Any]:
+    if target == "properties":
+        return [(name, _chroma(name)._collection) for name in _all_collections() + [COLL_SHARED]]
+    if target == "messages":
+        return [(_msg_collection().name, _msg_collection())]
+    raise ValueError(f"unknown export target {target!r}, expected one of {TARGETS}")
+
+
+def iter_records(target: str, embeddings: bool = False, batch: int = DEFAULT_BATCH,
+                 where: Dict[str, Any] | None = None) -> Iterator[Dict[str, Any]]:
+    include = ["documents", "metadatas"] + (["embeddings"] if embeddings else [])
+    for name, coll in _collections(target):
+        offset = 0
+        while True:
+            page = coll.get(where=where, limit=batch, offset=offset, include=include)
+            ids = page["ids"]
+            if not ids:
+                break
+            vecs = page.get("embeddings") if embeddings else None
+            owners = shared_chunks.owners(m["content_hash"] for m in page["metadatas"]) if name == COLL_SHARED else {}
+            for i, id_ in enumerate(ids):
+                meta = page["metadatas"][i] or {}
+                if target == "properties" and tombstones.is_dead(meta.get("property_id")):
+                    continue
+                rec = {"c": name, "id": id_, "doc": page["documents"][i], "meta": meta}
+                if name == COLL_SHARED:
+                    rec["owners"] = [o["property_id"] for o in owners.get(meta.get("content_hash"), ())
+                                     if not tombstones.is_dead(o["property_id"])]
+                if vecs is not None:
+                    rec["vec"] = _vec_to_f16(vecs[i])
+                yield rec
+            if len(ids) < batch:
+                break
+            offset += len(ids)
+
+
+def iter_ndjson(target: str, embeddings: bool = False, batch: int = DEFAULT_BATCH) -> Iterator[bytes]:
+    for rec in iter_records(target, embeddings, batch):
+        yield json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m services.api.export")
+    ap.add_argument("target", choices=TARGETS)
+    ap.add_argument("-o", "--output", help="file to write (default: stdout)")
+    ap.add_argument("--embeddings", action="store_true", help="include vectors as base64 float16")
+    ap.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    args = ap.parse_args()
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for line in iter_ndjson(args.target, args.embeddings, args.batch):
+            out.write(line)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
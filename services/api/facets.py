@@ -0,0 +1,228 @@
+from __future__ import annotations
+import math
+import os
+import threading
+from collections import Counter
+from itertools import product
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import delete, select
+
+from . import geo
+from .db import SessionLocal
+from .models import PropertyFacet
+
+# Facet counts kept as a small data cube: every property adds 1 to each of the
+# 2^4 cells obtained by replacing any subset of its dimension values with ANY.
+# A query is then a handful of dict lookups, independent of catalog size.
+# The location dimension holds the gazetteer id of the most specific place (ward,
+# district or city), so "Quận 7", "Q7" and "District 7, HCMC" count together and a
+# city filter counts its districts; locations the gazetteer misses keep their text.
+DIMENSIONS = ("location", "property_type", "bedrooms", "price_band")
+ANY = "*"
+UNKNOWN = "unknown"
+
+BEDROOM_BUCKETS = ["0", "1", "2", "3", "4+"]
+
+# FACET_PRICE_BANDS="1e9,2e9,3e9,5e9,10e9" -> [0,1e9) [1e9,2e9) ... [10e9,inf)  (VND)
+_BAND_EDGES = [float(x) for x in os.getenv("FACET_PRICE_BANDS", "1e9,2e9,3e9,5e9,10e9").split(",") if x.strip()]
+PRICE_BANDS: List[Tuple[str, float, float]] = [
+    (f"{lo / 1e9:g}+ tỷ" if math.isinf(hi) else f"{lo / 1e9:g}-{hi / 1e9:g} tỷ", lo, hi)
+    for lo, hi in zip([0.0] + _BAND_EDGES, _BAND_EDGES + [math.inf])
+]
+
+_lock = threading.Lock()
+_loaded = False
+_cube: Counter = Counter()
+_cells: Dict[str, Tuple[str, str, str, str]] = {}  # property_id -> cell
+_values: List[Counter] = [Counter() for _ in DIMENSIONS]  # known values per dimension
+
+
+def bedroom_bucket(v: Any) -> str:
+    try:
+        n = int(float(v))
+    except (TypeError, ValueError):
+        return UNKNOWN
+    return BEDROOM_BUCKETS[-1] if n >= len(BEDROOM_BUCKETS) - 1 else str(max(n, 0))
+
+
+def price_band(v: Any) -> str:
+    try:
+        p = float(v)
+    except (TypeError, ValueError):
+        return UNKNOWN
+    for label, lo, hi in PRICE_BANDS:
+        if lo <= p < hi:
+            return label
+    return UNKNOWN
+
+
+def _norm(v: Any) -> str:
+    s = str(v or "").strip().lower()
+    return s or UNKNOWN
+
+
+def _place(location: Any) -> str:
+    return geo.resolve(location) or _norm(location)
+
+
+def _cell(location: Any, property_type: Any, bedrooms: Any, price: Any) -> Tuple[str, str, str, str]:
+    return (_place(location), _norm(property_type), bedroom_bucket(bedrooms), price_band(price))
+
+
+def _descendants(place_id: str) -> List[str]:
+    out, todo = [], [place_id]
+    while todo:
+        pid = todo.pop()
+        out.append(pid)
+        todo.extend(p["id"] for p in geo.PLACES.values() if p.get("parent") == pid)
+    return out
+
+
+def _apply(cell: Tuple[str, ...], delta: int) -> None:
+    for i, v in enumerate(cell):
+        _values[i][v] += delta
+        if _values[i][v] <= 0:
+            del _values[i][v]
+    for mask in product((False, True), repeat=len(cell)):
+        key = tuple(v if keep else ANY for v, keep in zip(cell, mask))
+        _cube[key] += delta
+        if _cube[key] <= 0:
+            del _cube[key]
+
+
+def _ensure_loaded() -> None:
+    global _loaded
+    if _loaded:
+        return
+    with SessionLocal() as db:
+        rows = db.execute(select(PropertyFacet)).scalars().all()
+        for r in rows:
+            cell = _cell(r.location, r.property_type, r.bedrooms, r.price)
+            _cells[r.property_id] = cell
+            _apply(cell, +1)
+    _loaded = True
+
+
+def record(property_id: str, meta: Dict[str, Any]) -> None:
+    """Insert or replace the facet row of one property (called from the upsert path)."""
+    with _lock:
+        _ensure_loaded()
+        with SessionLocal() as db:
+            row = db.get(PropertyFacet, property_id) or PropertyFacet(property_id=property_id)
+            row.unit_id = meta.get("unitId")
+            row.location = str(meta.get("location") or "")
+            row.property_type = str(meta.get("property_type") or "")
+            row.bedrooms = meta.get("bedrooms")
+            row.price = meta.get("price")
+            db.merge(row); db.commit()
+        old = _cells.pop(property_id, None)
+        if old:
+            _apply(old, -1)
+        cell = _cell(meta.get("location"), meta.get("property_type"), meta.get("bedrooms"), meta.get("price"))
+        _cells[property_id] = cell
+        _apply(cell, +1)
+
+
+def known() -> Set[str]:
+    """Property ids that have a facet row."""
+    with SessionLocal() as db:
+        return set(db.execute(select(PropertyFacet.property_id)).scalars().all())
+
+
+def remove(property_id: str) -> None:
+    with _lock:
+        _ensure_loaded()
+        with SessionLocal() as db:
+            row = db.get(PropertyFacet, property_id)
+            if row: db.delete(row); db.commit()
+        old = _cells.pop(property_id, None)
+        if old:
+            _apply(old, -1)
+
+
+def reset() -> None:
+    """Drop all facet rows (the caller re-records them, e.g. when loading a snapshot)."""
+    global _loaded
+    with _lock:
+        with SessionLocal() as db:
+            db.execute(delete(PropertyFacet)); db.commit()
+        _cube.clear(); _cells.clear()
+        for v in _values:
+            v.clear()
+        _loaded = True
+
+
+def _allowed(filters: Dict[str, Any], notes: Dict[str, Any]) -> List[Iterable[str]]:
+    """Map search-style filters onto the set of cube values allowed per dimension."""
+    allowed: List[Iterable[str]] = [[ANY]] * len(DIMENSIONS)
+    place_id = filters.get("location_id") or geo.resolve(filters.get("location"))
+    if place_id in geo.PLACES:
+        # same as search: a place matches itself and everything under it
+        allowed[0] = _descendants(place_id)
+    elif filters.get("location"):
+        # unknown place: substring on the text-keyed values, like the search post-filter
+        q = _norm(filters["location"])
+        allowed[0] = [v for v in _values[0] if v not in geo.PLACES and q in v]
+    if filters.get("property_type"):
+        allowed[1] = [_norm(filters["property_type"])]
+    if filters.get("bedrooms") is not None:
+        # same semantics as search: at least N bedrooms
+        bucket = bedroom_bucket(filters["bedrooms"])
+        if bucket != UNKNOWN:
+            allowed[2] = BEDROOM_BUCKETS[BEDROOM_BUCKETS.index(bucket):]
+    if filters.get("price_band"):
+        allowed[3] = [str(filters["price_band"])]
+    else:
+        # band-aligned: only bands entirely inside the budget are counted; a budget
+        # between band edges is rounded inwards and reported in notes
+        try:
+            lo_b = float(filters["budget_min"]) if filters.get("budget_min") is not None else None
+            hi_b = float(filters["budget_max"]) if filters.get("budget_max") is not None else None
+        except (TypeError, ValueError):
+            lo_b = hi_b = None
+        if lo_b is not None or hi_b is not None:
+            bands = [(label, lo, hi) for label, lo, hi in PRICE_BANDS
+                     if (hi_b is None or hi <= hi_b + 1e-6) and (lo_b is None or lo >= lo_b - 1e-6)]
+            allowed[3] = [label for label, _, _ in bands]
+            if hi_b is not None and not any(abs(hi - hi_b) <= 1e-6 for _, _, hi in PRICE_BANDS):
+                notes["budget_max"] = {"requested": hi_b, "counted_up_to": max((hi for _, _, hi in bands), default=0.0)}
+            if lo_b is not None and not any(abs(lo - lo_b) <= 1e-6 for _, lo, _ in PRICE_BANDS):
+                notes["budget_min"] = {"requested": lo_b, "counted_from": min((lo for _, lo, _ in bands), default=None)}
+    return allowed
+
+
+def _count(allowed: List[Iterable[str]]) -> int:
+    return sum(_cube.get(key, 0) for key in product(*allowed))
+
+
+def facet_counts(filters: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Total matching properties plus per-dimension counts (each dimension ignores its own filter)."""
+    filters = filters or {}
+    with _lock:
+        _ensure_loaded()
+        notes: Dict[str, Any] = {}
+        allowed = _allowed(filters, notes)
+        out: Dict[str, Dict[str, int]] = {}
+        for i, dim in enumerate(DIMENSIONS):
+            counts = {}
+            for value in _values[i]:
+                sideways = list(allowed); sideways[i] = [value]
+                c = _count(sideways)
+                if c:
+                    # place ids are shown by name (which also works as a location filter)
+                    label = geo.PLACES[value]["name"] if i == 0 and value in geo.PLACES else value
+                    counts[label] = counts.get(label, 0) + c
+            out[dim] = counts
+        # budgets that are not band edges are counted approximately (see _allowed)
+        return {"total": _count(allowed), "facets": out, "approximate": notes}
+
+
+def get(property_id: str) -> Dict[str, Any] | None:
+    """Stored property-level attributes, or None for unknown/deleted properties."""
+    with SessionLocal() as db:
+        row = db.get(PropertyFacet, property_id)
+        if row is None:
+            return None
+        return {"unitId": row.unit_id, "location": row.location, "property_type": row.property_type,
+                "bedrooms": row.bedrooms, "price": row.price}
@@ -0,0 +1,231 @@
+from __future__ import annotations
+import math
+import threading
+from typing import Any, Dict, List, Set, Tuple
+
+from sqlalchemy import delete, select
+
+from .db import SessionLocal
+from .models import PropertyLocation
+from .query_parser import PLACES, match_place
+
+# Canonical locations for properties: free-text locations ("Q7", "Quận 7, TP HCM",
+# "District 7") resolve through the gazetteer (data/gazetteer.json) to city /
+# district / ward ids, which ingest writes into chunk metadata so the store can
+# filter on them. Coordinates (the listing's own, else the place centroid) go
+# into a geohash grid for "within N km" searches, resolved to a property id set
+# before the vector query.
+LEVELS = ("city", "district", "ward")
+GRID_PRECISIONS = (4, 5, 6)  # cells of ~39x20 km, ~4.9x4.9 km, ~1.2x0.6 km
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_EARTH_KM = 6371.0088
+
+_lock = threading.Lock()
+_loaded = False
+_grid: Dict[int, Dict[str, Set[str]]] = {p: {} for p in GRID_PRECISIONS}
+_points: Dict[str, Tuple[float, float]] = {}   # property_id -> (lat, lon)
+
+
+def geohash(lat: float, lon: float, precision: int = 6) -> str:
+    lat_rng, lon_rng = [-90.0, 90.0], [-180.0, 180.0]
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        rng, v = (lon_rng, lon) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        ch <<= 1
+        if v >= mid:
+            ch |= 1; rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch]); bits = ch = 0
+    return "".join(out)
+
+
+def _cell_size(precision: int) -> Tuple[float, float]:
+    """(lat degrees, lon degrees) of a geohash cell."""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * _EARTH_KM * math.asin(math.sqrt(h))
+
+
+# --- place hierarchy -------------------------------------------------------
+
+def resolve(text: Any) -> str | None:
+    """Gazetteer id for a free-text location, or None."""
+    return match_place(str(text)) if text else None
+
+
+def hierarchy(place_id: str | None) -> Dict[str, str]:
+    """{"city_id": .., "district_id": .., "ward_id": ..} for a place and its ancestors."""
+    out: Dict[str, str] = {}
+    place = PLACES.get(place_id or "")
+    while place is not None:
+        out[f"{place['level']}_id"] = place["id"]
+        place = PLACES.get(place.get("parent") or "")
+    return out
+
+
+def level_key(place_id: str) -> str | None:
+    """Metadata key a place id is matched against ("district_id" for a district, ...)."""
+    place = PLACES.get(place_id)
+    return f"{place['level']}_id" if place else None
+
+
+def center(place_id: str) -> Tuple[float, float] | None:
+    place = PLACES.get(place_id)
+    if place is None or place.get("lat") is None:
+        return None
+    return float(place["lat"]), float(place["lon"])
+
+
+def _coords(data: Dict[str, Any]) -> Tuple[float, float] | None:
+    for section in ("design_and_layout", "physical_features"):
+        d = data.get(section) or {}
+        lat = d.get("lat", d.get("latitude"))
+        lon = d.get("lon", d.get("lng", d.get("longitude")))
+        try:
+            if lat is not None and lon is not None:
+                return float(lat), float(lon)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def locate(data: Dict[str, Any], location: Any) -> Dict[str, Any]:
+    """Location metadata for one property: place ids plus lat/lon (own coordinates, else the place centroid)."""
+    place_id = resolve(location)
+    out: Dict[str, Any] = hierarchy(place_id)
+    point = _coords(data) or (center(place_id) if place_id else None)
+    if point:
+        out["lat"], out["lon"] = point
+    return out
+
+
+# --- geohash grid ----------------------------------------------------------
+
+def _index(property_id: str, lat: float, lon: float) -> None:
+    h = geohash(lat, lon, max(GRID_PRECISIONS))
+    _points[property_id] = (lat, lon)
+    for p in GRID_PRECISIONS:
+        _grid[p].setdefault(h[:p], set()).add(property_id)
+
+
+def _unindex(property_id: str) -> None:
+    point = _points.pop(property_id, None)
+    if point is None:
+        return
+    h = geohash(point[0], point[1], max(GRID_PRECISIONS))
+    for p in GRID_PRECISIONS:
+        cell = _grid[p].get(h[:p])
+        if cell is not None:
+            cell.discard(property_id)
+            if not cell:
+                del _grid[p][h[:p]]
+
+
+def _ensure_loaded() -> None:
+    global _loaded
+    if _loaded:
+        return
+    with SessionLocal() as db:
+        for r in db.execute(select(PropertyLocation)).scalars().all():
+            if r.lat is not None and r.lon is not None:
+                _index(r.property_id, r.lat, r.lon)
+    _loaded = True
+
+
+def record(property_id: str, meta: Dict[str, Any]) -> None:
+    """Insert or replace the location row of one property (called from the upsert path)."""
+    with _lock:
+        _ensure_loaded()
+        lat, lon = meta.get("lat"), meta.get("lon")
+        with SessionLocal() as db:
+            row = db.get(PropertyLocation, property_id) or PropertyLocation(property_id=property_id)
+            row.city_id, row.district_id, row.ward_id = (meta.get(f"{lv}_id") for lv in LEVELS)
+            row.place_id = row.ward_id or row.district_id or row.city_id
+            row.lat, row.lon = lat, lon
+            row.geohash = geohash(lat, lon, max(GRID_PRECISIONS)) if lat is not None and lon is not None else None
+            db.merge(row); db.commit()
+        _unindex(property_id)
+        if lat is not None and lon is not None:
+            _index(property_id, float(lat), float(lon))
+
+
+def remove(property_id: str) -> None:
+    with _lock:
+        _ensure_loaded()
+        with SessionLocal() as db:
+            db.execute(delete(PropertyLocation).where(PropertyLocation.property_id == property_id)); db.commit()
+        _unindex(property_id)
+
+
+def reset() -> None:
+    global _loaded
+    with _lock:
+        with SessionLocal() as db:
+            db.execute(delete(PropertyLocation)); db.commit()
+        _points.clear()
+        for cells in _grid.values():
+            cells.clear()
+        _loaded = True
+
+
+def within(lat: float, lon: float, km: float) -> List[str]:
+    """Ids of properties within km of (lat, lon), nearest first."""
+    with _lock:
+        _ensure_loaded()
+        # finest precision whose cells are still at least half the radius (bounded cell count)
+        precision = next((p for p in reversed(GRID_PRECISIONS)
+                          if _cell_size(p)[0] * 111.0 >= km / 2), GRID_PRECISIONS[0])
+        dlat, dlon = _cell_size(precision)
+        rlat = km / 111.0
+        rlon = km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+        cells = set()
+        y = lat - rlat
+        while y <= lat + rlat + dlat:
+            x = lon - rlon
+            while x <= lon + rlon + dlon:
+                cells.add(geohash(min(y, lat + rlat), min(x, lon + rlon), precision))
+                x += dlon
+            y += dlat
+        grid = _grid[precision]
+        candidates = {pid for c in cells for pid in grid.get(c, ())}
+        hits = [(haversine_km((lat, lon), _points[pid]), pid) for pid in candidates]
+    return [pid for d, pid in sorted(hits) if d <= km]
+
+
+def radius_center(filters: Dict[str, Any]) -> Tuple[float, float, float] | None:
+    """(lat, lon, km) of a radius filter (lat/lon or location_id + radius_km); None if there is none or no centre resolves."""
+    if filters.get("radius_km") is None:
+        return None
+    try:
+        km = float(filters["radius_km"])
+        if filters.get("lat") is not None and filters.get("lon") is not None:
+            point = float(filters["lat"]), float(filters["lon"])
+        else:
+            point = center(filters.get("location_id") or resolve(filters.get("location")) or "")
+    except (TypeError, ValueError):
+        return None
+    return (point[0], point[1], km) if point is not None else None
+
+
+def near(property_id: str | None, lat: float, lon: float, km: float) -> bool:
+    with _lock:
+        _ensure_loaded()
+        point = _points.get(property_id or "")
+    return point is not None and haversine_km((lat, lon), point) <= km
+
+
+def radius_candidates(filters: Dict[str, Any]) -> List[str] | None:
+    """Property ids allowed by a radius filter, nearest first; None if there is none."""
+    radius = radius_center(filters)
+    return within(*radius) if radius is not None else None
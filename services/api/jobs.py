@@ -0,0 +1,164 @@
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from .chunker import CHUNK_OVERLAP_TOKENS, chunk_documents, json_to_documents
+from .db import SessionLocal
+from .models import IngestJob
+from .vectorstore_langchain import chunk_budget, upsert_property_docs
+
+# Persistent queue for asynchronous property ingest (POST /property/embedding?async=true).
+# Jobs live in the ingest_jobs table, so they survive restarts; the key makes
+# resubmitting the same payload (CMS retries) return the existing job. Workers run
+# the chunk -> embed -> persist cycle as background work on scheduler.gate, i.e.
+# only in the gaps between searches. A client Idempotency-Key is kept for good; the
+# default content key only dedupes while its job is pending, so re-sending an
+# earlier revision (A -> B -> A) is applied again.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_POLL_S = float(os.getenv("INGEST_POLL_S", "5"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+
+log = logging.getLogger(__name__)
+_stop = threading.Event()
+_wake = threading.Event()
+_threads: list[threading.Thread] = []
+
+
+def ingest_property(data: Dict[str, Any], background: bool = False) -> Tuple[int, int]:
+    """chunk -> embed -> persist one property; returns (chunks, properties)."""
+    tokenizer, max_tokens = chunk_budget()
+    chunks = chunk_documents(json_to_documents(data), chunk_size=max_tokens,
+                             chunk_overlap=CHUNK_OVERLAP_TOKENS, tokenizer=tokenizer)
+    return upsert_property_docs(chunks, background=background)
+
+
+CONTENT_KEY_PREFIX = "content:"
+
+
+def job_key(data: Dict[str, Any]) -> str:
+    body = json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return f"{CONTENT_KEY_PREFIX}{data.get('id')}:{hashlib.sha256(body).hexdigest()[:32]}"
+
+
+def as_dict(job: IngestJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id, "key": job.key, "property_id": job.property_id, "status": job.status,
+        "attempts": job.attempts, "chunks": job.chunks, "error": job.error,
+        "created_at": job.created_at, "updated_at": job.updated_at,
+    }
+
+
+def submit(data: Dict[str, Any], key: str | None = None) -> Tuple[Dict[str, Any], bool]:
+    """Queue an ingest; returns (job, created). A known key returns the existing job."""
+    key = key or job_key(data)
+    now = time.time()
+    with SessionLocal() as db:
+        job = db.execute(select(IngestJob).where(IngestJob.key == key)).scalar_one_or_none()
+        if job is not None:
+            if job.status == "failed":
+                job.status, job.attempts, job.error, job.updated_at = "queued", 0, None, now
+                db.commit()
+                _wake.set()
+            return as_dict(job), False
+        job = IngestJob(id=str(uuid.uuid4()), key=key, property_id=str(data.get("id")), status="queued",
+                        payload=json.dumps(data, ensure_ascii=False), attempts=0, created_at=now, updated_at=now)
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            # a concurrent submit with the same key won
+            db.rollback()
+            job = db.execute(select(IngestJob).where(IngestJob.key == key)).scalar_one()
+            return as_dict(job), False
+        out = as_dict(job)
+    _wake.set()
+    return out, True
+
+
+def get(job_id: str) -> Dict[str, Any] | None:
+    with SessionLocal() as db:
+        job = db.get(IngestJob, job_id)
+        return as_dict(job) if job else None
+
+
+def _claim() -> IngestJob | None:
+    # oldest queued job whose property is not being written by another worker
+    with SessionLocal() as db:
+        running = select(IngestJob.property_id).where(IngestJob.status == "running")
+        candidates = db.execute(
+            select(IngestJob.id).where(IngestJob.status == "queued", IngestJob.property_id.not_in(running))
+            .order_by(IngestJob.created_at).limit(5)
+        ).scalars().all()
+        for job_id in candidates:
+            claimed = db.execute(
+                update(IngestJob).where(IngestJob.id == job_id, IngestJob.status == "queued")
+                .values(status="running", attempts=IngestJob.attempts + 1, updated_at=time.time())
+            ).rowcount
+            db.commit()
+            if claimed:
+                job = db.get(IngestJob, job_id)
+                db.expunge(job)
+                return job
+    return None
+
+
+def _finish(job_id: str, key: str, **values: Any) -> None:
+    if key.startswith(CONTENT_KEY_PREFIX) and values.get("status") in ("done", "failed"):
+        # release the content key: the same payload submitted later is a new edit
+        values["key"] = f"{key}#{job_id}"
+    with SessionLocal() as db:
+        db.execute(update(IngestJob).where(IngestJob.id == job_id).values(updated_at=time.time(), **values))
+        db.commit()
+
+
+def run_once() -> bool:
+    """Run one queued job; False when there was nothing to do."""
+    job = _claim()
+    if job is None:
+        return False
+    try:
+        n_chunks, _ = ingest_property(json.loads(job.payload), background=True)
+        _finish(job.id, job.key, status="done", chunks=n_chunks, error=None)
+    except Exception as e:
+        retry = job.attempts < INGEST_MAX_ATTEMPTS
+        _finish(job.id, job.key, status="queued" if retry else "failed", error=str(e))
+        log.warning("[jobs] %s (%s) attempt %d failed: %s", job.id, job.property_id, job.attempts, e)
+    return True
+
+
+def _loop() -> None:
+    while not _stop.is_set():
+        try:
+            if run_once():
+                continue
+        except Exception:
+            log.exception("[jobs] worker pass failed")
+        _wake.wait(INGEST_POLL_S)
+        _wake.clear()
+
+
+def start() -> None:
+    # jobs left "running" by a crash are picked up again
+    with SessionLocal() as db:
+        db.execute(update(IngestJob).where(IngestJob.status == "running").values(status="queued"))
+        db.commit()
+    _stop.clear()
+    _threads[:] = [t for t in _threads if t.is_alive()]
+    for i in range(len(_threads), INGEST_WORKERS):
+        t = threading.Thread(target=_loop, name=f"ingest-worker-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def stop() -> None:
+    _stop.set()
+    _wake.set()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Float
+from sqlalchemy import Column, Integer, LargeBinary, String, Text, Float
 from sqlalchemy.orm import Mapped, mapped_column
 from .db import Base
 
@@ -20,4 +20,92 @@ class Property(Base):
     bedrooms: Mapped[float] = mapped_column(Float)
     price: Mapped[float] = mapped_column(Float)
     description: Mapped[str] = mapped_column(Text)
-    raw_json: Mapped[str] = mapped_column(Text) # original schema blob
\ No newline at end of file
+    raw_json: Mapped[str] = mapped_column(Text) # original schema blob
+
+
+class PropertyFacet(Base):
+    # one row per property_id; source of truth for the in-memory facet cube (see facets.py)
+    __tablename__ = "property_facets"
+    property_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    unit_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    location: Mapped[str] = mapped_column(String(200), default="")
+    property_type: Mapped[str] = mapped_column(String(50), default="")
+    bedrooms: Mapped[float | None] = mapped_column(Float, nullable=True)
+    price: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+
+class Tombstone(Base):
+    # logically deleted property; chunks are physically removed by compactor.py
+    __tablename__ = "property_tombstones"
+    property_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    deleted_at: Mapped[float] = mapped_column(Float)
+
+
+class ConversationActivity(Base):
+    # last stored turn per conversation; drives message retention (retention.py)
+    __tablename__ = "conversation_activity"
+    conversation_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    user_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    last_ts: Mapped[float] = mapped_column(Float, index=True)
+    turns: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class IngestJob(Base):
+    # async /property/embedding requests, worked off by jobs.py
+    __tablename__ = "ingest_jobs"
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    key: Mapped[str] = mapped_column(String(128), unique=True, index=True)   # idempotency key
+    property_id: Mapped[str] = mapped_column(String(128), index=True)
+    status: Mapped[str] = mapped_column(String(16), index=True, default="queued")  # queued|running|done|failed
+    payload: Mapped[str] = mapped_column(Text)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    chunks: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[float] = mapped_column(Float, index=True)
+    updated_at: Mapped[float] = mapped_column(Float)
+
+
+class PropertyLocation(Base):
+    # canonical place + coordinates per property; drives geo.py (radius / hierarchy filters)
+    __tablename__ = "property_locations"
+    property_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    place_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    city_id: Mapped[str | None] = mapped_column(String(64), index=True, nullable=True)
+    district_id: Mapped[str | None] = mapped_column(String(64), index=True, nullable=True)
+    ward_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    lat: Mapped[float | None] = mapped_column(Float, nullable=True)
+    lon: Mapped[float | None] = mapped_column(Float, nullable=True)
+    geohash: Mapped[str | None] = mapped_column(String(12), index=True, nullable=True)
+
+
+class PropertyNeighbor(Base):
+    # precomputed "similar properties" list, one row per (property, neighbour); see similar.py
+    __tablename__ = "property_neighbors"
+    property_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    rank: Mapped[int] = mapped_column(Integer, primary_key=True)
+    neighbor_id: Mapped[str] = mapped_column(String(128), index=True)
+    score: Mapped[float] = mapped_column(Float)
+
+
+class NeighborRefresh(Base):
+    # properties whose neighbour list must be recomputed by the refresher
+    __tablename__ = "neighbor_refresh"
+    property_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    queued_at: Mapped[float] = mapped_column(Float, index=True)
+
+
+class UserPreference(Base):
+    # EMA of a user's messages in the property embedding space (preferences.py), float16-packed
+    __tablename__ = "user_preferences"
+    user_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    vector: Mapped[bytes] = mapped_column(LargeBinary)
+    updates: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[float] = mapped_column(Float)
+
+
+class SharedChunkOwner(Base):
+    # a deduplicated chunk (shared_chunks.py) and one property it belongs to; meta = that unit's chunk metadata
+    __tablename__ = "shared_chunk_owners"
+    content_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    property_id: Mapped[str] = mapped_column(String(128), primary_key=True, index=True)
+    meta: Mapped[str] = mapped_column(Text)
@@ -0,0 +1,109 @@
+from __future__ import annotations
+import math
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+from . import encoders
+from .db import SessionLocal
+from .models import UserPreference
+
+# Per-user preference vector for personalized property search. Every stored user
+# message moves the user's vector towards the message: v <- norm((1-a) v + a m),
+# with m embedded by the *property* model (the messages collection uses a different
+# model, its vectors cannot be mixed with property queries). Rows live in
+# user_preferences as float16; recently used vectors are cached in memory, so a
+# personalized search costs one dict lookup (one primary-key read on a miss).
+PREF_ALPHA = float(os.getenv("PREF_ALPHA", "0.2"))     # EMA rate per message
+PREF_BLEND = float(os.getenv("PREF_BLEND", "0.2"))     # default weight in the query vector
+PREF_MIN_UPDATES = int(os.getenv("PREF_MIN_UPDATES", "3"))  # fewer messages: not personalized yet
+PREF_CACHE = int(os.getenv("PREF_CACHE", "10000"))
+
+_lock = threading.Lock()
+_cache: "OrderedDict[str, tuple[List[float], int]]" = OrderedDict()
+
+
+def _normalize(v: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in v)) or 1.0
+    return [x / norm for x in v]
+
+
+def _pack(v: List[float]) -> bytes:
+    return struct.pack(f"<{len(v)}e", *v)
+
+
+def _unpack(b: bytes) -> List[float]:
+    return list(struct.unpack(f"<{len(b) // 2}e", b))
+
+
+def _remember(user_id: str, vec: List[float], updates: int) -> None:
+    _cache[user_id] = (vec, updates)
+    _cache.move_to_end(user_id)
+    while len(_cache) > PREF_CACHE:
+        _cache.popitem(last=False)
+
+
+def _load(user_id: str) -> tuple[List[float], int] | None:
+    hit = _cache.get(user_id)
+    if hit is not None:
+        _cache.move_to_end(user_id)
+        return hit
+    with SessionLocal() as db:
+        row = db.get(UserPreference, user_id)
+        if row is None:
+            return None
+        hit = (_unpack(row.vector), row.updates)
+    _remember(user_id, *hit)
+    return hit
+
+
+def observe(user_id: str, text: str) -> None:
+    """Fold one user message into the user's preference vector."""
+    m = _normalize(encoders.embeddings(encoders.PROPERTY_MODEL).embed_query(text))
+    with _lock:
+        prev = _load(user_id)
+        if prev is None or len(prev[0]) != len(m):
+            vec, updates = m, 1
+        else:
+            vec = _normalize([(1 - PREF_ALPHA) * p + PREF_ALPHA * x for p, x in zip(prev[0], m)])
+            updates = prev[1] + 1
+        with SessionLocal() as db:
+            db.merge(UserPreference(user_id=user_id, vector=_pack(vec), updates=updates, updated_at=time.time()))
+            db.commit()
+        _remember(user_id, vec, updates)
+
+
+def vector(user_id: str) -> List[float] | None:
+    with _lock:
+        hit = _load(user_id)
+    if hit is None or hit[1] < PREF_MIN_UPDATES:
+        return None
+    return hit[0]
+
+
+def blend(query_vec: List[float], user_id: str | None, weight: float | None = None) -> List[float]:
+    """
+    Direction of (1-w) q + w u (both unit length), scaled back to |query_vec|: the
+    property collections use L2 distance over unnormalized vectors, so a unit-length
+    query would rank by stored-vector norm. q unchanged without a (mature) preference vector.
+    """
+    weight = PREF_BLEND if weight is None else weight
+    u = vector(user_id) if user_id and weight > 0 else None
+    if u is None or len(u) != len(query_vec):
+        return query_vec
+    norm = math.sqrt(sum(x * x for x in query_vec)) or 1.0
+    mixed = _normalize([(1 - weight) * a / norm + weight * b for a, b in zip(query_vec, u)])
+    return [x * norm for x in mixed]
+
+
+def forget(user_id: str) -> None:
+    with _lock:
+        _cache.pop(user_id, None)
+        with SessionLocal() as db:
+            row = db.get(UserPreference, user_id)
+            if row is not None:
+                db.delete(row)
+                db.commit()
@@ -0,0 +1,201 @@
+from __future__ import annotations
+import json
+import os
+import re
+import unicodedata
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+# Rule-based query understanding for /property/search/natural: turns
+# "căn hộ 2 phòng ngủ Quận 7 dưới 3 tỷ" into
+# {"property_type": "căn hộ", "bedrooms": 2, "location": "Quận 7", "budget_max": 3e9}
+# Places and property types are matched with one Aho-Corasick automaton built at
+# import time; prices and bedrooms with regexes. Everything runs on accent-folded,
+# lowercased text so "quan 7" and "Quận 7" match alike.
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(__file__), "data", "gazetteer.json"))
+
+# synonym -> canonical value of VALID_TYPES (rasa-bot/actions/actions.py)
+TYPE_SYNONYMS: Dict[str, List[str]] = {
+    "căn hộ": ["căn hộ", "chung cư", "căn hộ chung cư", "apartment", "condo", "penthouse", "duplex"],
+    "studio": ["studio", "căn hộ studio"],
+    "nhà ở": ["nhà ở", "nhà riêng", "nhà phố", "nhà hẻm", "nhà", "house", "villa", "biệt thự"],
+    "nhà mặt tiền": ["nhà mặt tiền", "mặt tiền", "mặt phố", "shophouse"],
+    "nhà vùng ven": ["nhà vùng ven", "vùng ven", "ngoại thành"],
+}
+
+_UNITS = {"ty": 1e9, "ti": 1e9, "trieu": 1e6, "tr": 1e6}
+_NUM = r"(\d+(?:[.,]\d+)?)"
+_UNIT = r"(ty|ti|trieu|tr)"
+# optional remainder after "tỷ": "3 tỷ 5", "3 tỷ 500", "3 tỷ 50 triệu"
+_TAIL = r"(?:\s*(\d{1,3})(\s*(?:trieu|tr))?)?"
+RE_PRICE_RANGE = re.compile(rf"(?:tu\s+)?{_NUM}\s*{_UNIT}?\s*(?:-|den|toi)\s*{_NUM}\s*{_UNIT}{_TAIL}\b")
+_CEIL = r"(duoi|it hon|nho hon|khong qua|toi da|max|under|below|<=?)"
+_FLOOR = r"(tren|hon|tu|it nhat|toi thieu|min|over|above|>=?)"
+RE_PRICE = re.compile(rf"(?:{_CEIL}|{_FLOOR})?\s*{_NUM}\s*{_UNIT}{_TAIL}\b")
+# plain VND amounts as the Rasa prompts suggest them: "giá dưới 1500000000"
+RE_PRICE_VND = re.compile(rf"(?:{_CEIL}|{_FLOOR}|gia)\s*(\d{{8,}})\b")
+# "trong vòng 3km", "bán kính 5 km", "cách 2km", "within 3 km"
+RE_RADIUS = re.compile(r"\b(?:trong vong|trong ban kinh|ban kinh|cach|within|quanh)\s*(\d+(?:[.,]\d+)?)\s*(?:km|kilomet)\b")
+# a bare "phong" counts as bedrooms ("3 phong"), not when another room type follows
+RE_BEDROOMS = re.compile(r"\b(\d{1,2})\s*(?:phong ngu|pn|br|bedrooms?|beds?|phong(?!\s*(?:tam|khach|bep|lam viec|ve sinh|wc|an|tho)\b))\b")
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip Vietnamese diacritics character by character (keeps offsets)."""
+    out = []
+    for ch in text.lower():
+        if ch == "đ":
+            out.append("d"); continue
+        base = unicodedata.normalize("NFD", ch)[0]
+        out.append(base if len(base) == 1 else ch)
+    return "".join(out)
+
+
+class _Automaton:
+    """Minimal Aho-Corasick over characters; payloads are attached to pattern ends."""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, Any]]] = [[]]
+
+    def add(self, pattern: str, payload: Any) -> None:
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({}); self.fail.append(0); self.out.append([])
+            node = nxt
+        self.out[node].append((len(pattern), payload))
+
+    def build(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def finditer(self, text: str):
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for length, payload in self.out[node]:
+                yield i + 1 - length, i + 1, payload
+
+
+def _load_places() -> List[Dict[str, Any]]:
+    with open(GAZETTEER_PATH, encoding="utf-8") as f:
+        return json.load(f)["places"]
+
+
+def _compile() -> _Automaton:
+    ac = _Automaton()
+    for place in PLACES.values():
+        for alias in [place["name"]] + place.get("aliases", []):
+            ac.add(fold(alias), ("location", place["id"]))
+    for canonical, synonyms in TYPE_SYNONYMS.items():
+        for syn in synonyms:
+            ac.add(fold(syn), ("property_type", canonical))
+    ac.build()
+    return ac
+
+
+PLACES: Dict[str, Dict[str, Any]] = {p["id"]: p for p in _load_places()}
+_AC = _compile()
+
+
+def _is_word_edge(text: str, start: int, end: int) -> bool:
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not before.isalnum() and not after.isalnum()
+
+
+def _amount(num: str, unit: str, tail: str | None = None, tail_unit: str | None = None) -> float:
+    amount = float(num.replace(",", ".")) * _UNITS[unit]
+    if tail and _UNITS[unit] == 1e9:
+        # "3 tỷ 50 triệu" -> +50e6, "3 tỷ 5" / "3 tỷ 500" -> +0.5 tỷ
+        amount += int(tail) * 1e6 if tail_unit else int(tail) / 10 ** len(tail) * 1e9
+    return amount
+
+
+def _matches(t: str) -> List[Tuple[str, str]]:
+    """Longest non-overlapping dictionary matches in folded text, left to right."""
+    found = sorted(
+        ((s, e, p) for s, e, p in _AC.finditer(t) if _is_word_edge(t, s, e)),
+        key=lambda m: (m[0], -(m[1] - m[0])),
+    )
+    out, taken_until = [], -1
+    for start, end, payload in found:
+        if start >= taken_until:
+            taken_until = end
+            out.append(payload)
+    return out
+
+
+_LEVEL_RANK = {"city": 0, "district": 1, "ward": 2}
+
+
+def _most_specific(place_ids: List[str]) -> str | None:
+    # a district beats its city ("Quận 7 TP HCM" -> Quận 7); first one wins among equals
+    best = None
+    for pid in place_ids:
+        if best is None or _LEVEL_RANK[PLACES[pid]["level"]] > _LEVEL_RANK[PLACES[best]["level"]]:
+            best = pid
+    return best
+
+
+def match_place(text: str) -> str | None:
+    """Gazetteer id of the most specific place named in text ("Q7", "District 7" -> "hcm-q7")."""
+    return _most_specific([v for kind, v in _matches(fold(text)) if kind == "location"])
+
+
+def extract_filters(text: str) -> Dict[str, Any]:
+    """Structured filters found in free text; keys follow SearchReq.filters."""
+    t = fold(text)
+    filters: Dict[str, Any] = {}
+
+    places = []
+    for kind, value in _matches(t):
+        if kind == "location":
+            places.append(value)
+        elif kind == "property_type":
+            filters.setdefault("property_type", value)
+    place_id = _most_specific(places)
+    if place_id:
+        filters["location"] = PLACES[place_id]["name"]
+        filters["location_id"] = place_id
+
+    m = RE_RADIUS.search(t)
+    if m and place_id:
+        filters["radius_km"] = float(m.group(1).replace(",", "."))
+
+    m = RE_BEDROOMS.search(t)
+    if m:
+        filters["bedrooms"] = float(m.group(1))
+
+    r = RE_PRICE_RANGE.search(t)
+    if r:
+        lo_unit = r.group(2) or r.group(4)
+        filters["budget_min"] = _amount(r.group(1), lo_unit)
+        filters["budget_max"] = _amount(r.group(3), r.group(4), r.group(5), r.group(6))
+    else:
+        for p in RE_PRICE.finditer(t):
+            amount = _amount(p.group(3), p.group(4), p.group(5), p.group(6))
+            if p.group(2):
+                filters["budget_min"] = amount
+            else:
+                # "dưới 3 tỷ" and a bare "3 tỷ" both read as a ceiling
+                filters["budget_max"] = amount
+        if "budget_min" not in filters and "budget_max" not in filters:
+            for p in RE_PRICE_VND.finditer(t):
+                filters["budget_min" if p.group(2) else "budget_max"] = float(p.group(3))
+    return filters
@@ -0,0 +1,80 @@
+from __future__ import annotations
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+from .vectorstore_langchain import rebuild_centroids, search_properties
+
+# Recall of the approximate search paths against the flat (exhaustive chunk) search,
+# measured on property ids:  recall@k = |approx ∩ flat| / |flat|
+#   python -m services.api.recall queries.txt --k 10 [--filters '{"location": "Quận 7"}']
+# queries.txt: one query per line. Prints one JSON report.
+Strategy = Callable[[str, Dict[str, Any], int], List[str]]
+
+
+def _grouped(**kwargs: Any) -> Strategy:
+    def run(query: str, filters: Dict[str, Any], k: int) -> List[str]:
+        items = search_properties(query, filters, k, group_by_property=True, **kwargs)
+        return [it["metadata"].get("property_id") for it in items]
+    return run
+
+
+STRATEGIES: Dict[str, Strategy] = {
+    "flat": _grouped(two_stage=False),
+    "two_stage": _grouped(two_stage=True),
+}
+
+
+def _pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def report(queries: List[str], k: int = 10, filters: Dict[str, Any] | None = None,
+           strategies: List[str] | None = None) -> Dict[str, Any]:
+    filters = filters or {}
+    names = [s for s in (strategies or list(STRATEGIES)) if s != "flat"]
+    latency: Dict[str, List[float]] = {name: [] for name in ["flat"] + names}
+    recall: Dict[str, List[float]] = {name: [] for name in names}
+    for q in queries:
+        t = time.perf_counter()
+        truth = set(STRATEGIES["flat"](q, filters, k))
+        latency["flat"].append((time.perf_counter() - t) * 1000)
+        for name in names:
+            t = time.perf_counter()
+            got = set(STRATEGIES[name](q, filters, k))
+            latency[name].append((time.perf_counter() - t) * 1000)
+            recall[name].append(len(got & truth) / len(truth) if truth else 1.0)
+    return {
+        "queries": len(queries), "k": k, "filters": filters,
+        "strategies": {
+            name: {
+                "recall": (sum(recall[name]) / len(recall[name])) if name in recall and recall[name] else None,
+                "p50_ms": round(_pct(latency[name], 0.5), 2),
+                "p95_ms": round(_pct(latency[name], 0.95), 2),
+            }
+            for name in latency
+        },
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m services.api.recall")
+    ap.add_argument("queries", help="text file, one query per line")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--filters", default="{}", help="JSON filters applied to every query")
+    ap.add_argument("--strategy", action="append", choices=list(STRATEGIES), help="default: all")
+    ap.add_argument("--rebuild-centroids", action="store_true", help="backfill the centroid index first")
+    args = ap.parse_args()
+    if args.rebuild_centroids:
+        rebuild_centroids()
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    print(json.dumps(report(queries, args.k, json.loads(args.filters), args.strategy), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
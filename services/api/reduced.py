@@ -0,0 +1,334 @@
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+# Reduced-dimension index for the messages collection.
+#
+# `refit` fits a PCA projection on the stored (full, 384-d) vectors, writes every
+# full vector to a cold store on disk and re-indexes the collection with the
+# projected 64-128-d vectors. Searches then generate candidates on the small
+# index and rescore them against the full vectors read back from the cold store.
+# The projection file is the switch: without it the collection stays full-size.
+#
+#   POST /api/v2/admin/messages/refit?dim=64        (running server)
+#   python -m services.api.reduced refit --dim 64 --offline   (API stopped)
+#   python -m services.api.reduced recall queries.txt --k 10
+#
+# A refit swaps the collection and the projection under the server's feet: a
+# running API keeps its cached collection handle and cold-store row counter, so
+# from another process refit is only allowed with --offline (the API is stopped).
+#
+# No int8 mode: Chroma keeps float32 vectors in its HNSW index, so quantized codes
+# would not shrink its memory; the dimension reduction is where the saving comes from.
+log = logging.getLogger(__name__)
+
+FIT_SAMPLE = int(os.getenv("REDUCED_FIT_SAMPLE", "50000"))
+BATCH = 1000
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms == 0, 1.0, norms)
+
+
+class Projection:
+    """PCA on L2-normalized vectors; outputs are normalized again (the index is cosine)."""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray):
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)   # (dim, full_dim)
+
+    @property
+    def dim(self) -> int:
+        return int(self.components.shape[0])
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dim: int) -> "Projection":
+        x = _normalize(np.asarray(vectors, dtype=np.float32))
+        mean = x.mean(axis=0)
+        # principal axes = right singular vectors of the centered sample
+        _, _, vt = np.linalg.svd(x - mean, full_matrices=False)
+        return cls(mean, vt[:dim])
+
+    def transform(self, vectors: Any) -> np.ndarray:
+        x = _normalize(np.asarray(vectors, dtype=np.float32))
+        return _normalize((x - self.mean) @ self.components.T)
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, mean=self.mean, components=self.components)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Projection | None":
+        try:
+            with np.load(path) as f:
+                return cls(f["mean"], f["components"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+class ColdStore:
+    """
+    Full-precision vectors on disk, addressed by id: `vectors.f32` holds raw rows,
+    `ids.jsonl` one {"id", "row"} per put (or {"id", "row": null} per delete); the
+    last entry of an id wins. Rows are read through a memmap, so only the pages of
+    rescored candidates are touched. Deletes only drop the id; compact() rewrites
+    both files with the live rows.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._vec_path = os.path.join(path, "vectors.f32")
+        self._ids_path = os.path.join(path, "ids.jsonl")
+        self._rows: Dict[str, int] = {}
+        if os.path.exists(self._ids_path):
+            with open(self._ids_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break  # torn tail
+                    if rec["row"] is None:
+                        self._rows.pop(rec["id"], None)
+                    else:
+                        self._rows[rec["id"]] = rec["row"]
+        self._n = os.path.getsize(self._vec_path) // (4 * dim) if os.path.exists(self._vec_path) else 0
+
+    def put(self, ids: List[str], vectors: Any) -> None:
+        arr = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        with self._lock:
+            with open(self._vec_path, "ab") as f:
+                f.write(arr.tobytes())
+            with open(self._ids_path, "a", encoding="utf-8") as f:
+                for i, id_ in enumerate(ids):
+                    f.write(json.dumps({"id": id_, "row": self._n + i}) + "\n")
+                    self._rows[id_] = self._n + i
+            self._n += len(ids)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock, open(self._ids_path, "a", encoding="utf-8") as f:
+            for id_ in ids:
+                if self._rows.pop(id_, None) is not None:
+                    f.write(json.dumps({"id": id_, "row": None}) + "\n")
+
+    def get(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        # under the lock: compact() may swap the files
+        with self._lock:
+            rows = {id_: self._rows[id_] for id_ in ids if id_ in self._rows}
+            if not rows or not self._n:
+                return {}
+            mm = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(self._n, self.dim))
+            return {id_: np.array(mm[row]) for id_, row in rows.items()}
+
+    def dead_fraction(self) -> float:
+        with self._lock:
+            return 1.0 - len(self._rows) / self._n if self._n else 0.0
+
+    def compact(self) -> int:
+        """Rewrite the files with live rows only; returns rows dropped."""
+        with self._lock:
+            items = sorted(self._rows.items(), key=lambda t: t[1])
+            dropped = self._n - len(items)
+            if not dropped:
+                return 0
+            vec_tmp, ids_tmp = self._vec_path + ".tmp", self._ids_path + ".tmp"
+            mm = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(self._n, self.dim)) if self._n else None
+            rows: Dict[str, int] = {}
+            with open(vec_tmp, "wb") as fv, open(ids_tmp, "w", encoding="utf-8") as fi:
+                for i in range(0, len(items), BATCH):
+                    part = items[i:i + BATCH]
+                    fv.write(np.asarray(mm[[row for _, row in part]], dtype=np.float32).tobytes())
+                    for j, (id_, _) in enumerate(part):
+                        rows[id_] = i + j
+                        fi.write(json.dumps({"id": id_, "row": i + j}) + "\n")
+            del mm
+            os.replace(vec_tmp, self._vec_path)
+            os.replace(ids_tmp, self._ids_path)
+            self._rows, self._n = rows, len(items)
+        return dropped
+
+    def iter_all(self, batch: int = BATCH) -> Iterator[Tuple[List[str], np.ndarray]]:
+        # compact() is held off while a refit iterates (see vectorstore.compact_cold_store)
+        with self._lock:
+            items = sorted(self._rows.items(), key=lambda t: t[1])
+            n = self._n
+        if not items:
+            return
+        mm = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        for i in range(0, len(items), batch):
+            part = items[i:i + batch]
+            yield [id_ for id_, _ in part], np.array(mm[[row for _, row in part]])
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+def rescore(query: Any, ids: List[str], cold: ColdStore) -> Dict[str, float]:
+    """Cosine similarity of the full query vector to the full vectors of ids (missing ids are left out)."""
+    full = cold.get(ids)
+    if not full:
+        return {}
+    keys = list(full)
+    sims = _normalize(np.stack([full[k] for k in keys])) @ _normalize(np.asarray(query, dtype=np.float32))
+    return dict(zip(keys, sims.tolist()))
+
+
+def refit(dim: int, sample: int = FIT_SAMPLE, keep_full: bool = False) -> Dict[str, Any]:
+    """
+    Fit a projection and (re)build the reduced messages index (see the notes at the top).
+    Fitting and copying run without vectorstore._msg_lock, so message writes and
+    searches go on; turns written meanwhile are recorded (vs._refit_dirty) and
+    re-copied under the lock just before the new index and projection are swapped in.
+    """
+    from . import vectorstore as vs
+
+    t0 = time.time()
+    with vs._msg_lock:
+        if vs._refit_dirty is not None:
+            raise ValueError("a refit is already running")
+        vs._refit_dirty = set()
+        src = vs._msg_collection()
+        cold = vs._cold_store()
+        first = vs._projection() is None
+        listed = src.get(include=[])["ids"]
+    try:
+        if first:
+            # first fit: the full vectors still live in the collection, copy them to the cold store
+            for i in range(0, len(listed), BATCH):
+                page = src.get(ids=listed[i:i + BATCH], include=["embeddings"])
+                if page["ids"]:
+                    cold.put(page["ids"], page["embeddings"])
+        if not len(cold):
+            raise ValueError("no message vectors to fit on")
+        cold.compact()
+        rng = np.random.default_rng(0)
+        picked: List[np.ndarray] = []
+        rate = min(1.0, sample / len(cold))
+        for _, vecs in cold.iter_all():
+            picked.append(vecs[rng.random(len(vecs)) < rate] if rate < 1.0 else vecs)
+        proj = Projection.fit(np.concatenate(picked), dim)
+        explained = _explained(proj, np.concatenate(picked))
+
+        target_name = f"{vs.MSG_COLLECTION}__r{dim}"
+        client = vs.get_client()
+        tmp_name = target_name + "-refit"
+        try: client.delete_collection(tmp_name)
+        except Exception: pass
+        new = client.create_collection(tmp_name, metadata={"hnsw:space": "cosine", "reduced_dim": dim})
+
+        def copy(ids: List[str]) -> None:
+            page = src.get(ids=ids, include=["documents", "metadatas"])
+            full = cold.get(page["ids"])
+            keep = [i for i, id_ in enumerate(page["ids"]) if id_ in full]
+            if keep:
+                ids = [page["ids"][i] for i in keep]
+                new.upsert(ids=ids, embeddings=proj.transform(np.stack([full[i] for i in ids])).tolist(),
+                           documents=[page["documents"][i] for i in keep],
+                           metadatas=[page["metadatas"][i] for i in keep])
+
+        for i in range(0, len(listed), BATCH):
+            copy(listed[i:i + BATCH])
+
+        with vs._msg_lock:
+            # catch up with the turns written, merged or deleted while we were copying
+            dirty = sorted(vs._refit_dirty)
+            for i in range(0, len(dirty), BATCH):
+                part = dirty[i:i + BATCH]
+                page = src.get(ids=part, include=["embeddings"] if first else [])
+                if first and page["ids"]:
+                    cold.put(page["ids"], page["embeddings"])
+                gone = sorted(set(part) - set(page["ids"]))
+                if gone:
+                    new.delete(ids=gone)
+                    cold.delete(gone)
+                copy(page["ids"])
+            copied = new.count()
+            old_name = src.name
+            for name in (target_name, ) + (() if keep_full or old_name == target_name else (old_name,)):
+                try: client.delete_collection(name)
+                except Exception: pass
+            new.modify(name=target_name)
+            proj.save(vs._projection_path())
+            vs._reset_msg_collection()
+    finally:
+        with vs._msg_lock:
+            vs._refit_dirty = None
+    return {"collection": target_name, "dim": dim, "messages": copied,
+            "explained_variance": round(explained, 4), "seconds": round(time.time() - t0, 1)}
+
+
+def _explained(proj: Projection, vectors: np.ndarray) -> float:
+    x = _normalize(vectors) - proj.mean
+    total = float((x ** 2).sum()) or 1.0
+    return float(((x @ proj.components.T) ** 2).sum()) / total
+
+
+def recall(queries: List[str], k: int = 10) -> Dict[str, Any]:
+    """recall@k of reduced-only and reduced+rescore against exact search over the cold store."""
+    from . import vectorstore as vs
+
+    proj, cold, coll = vs._projection(), vs._cold_store(), vs._msg_collection()
+    if proj is None:
+        raise ValueError("messages index is not reduced; run refit first")
+    ids_all: List[str] = []
+    mats: List[np.ndarray] = []
+    for ids, vecs in cold.iter_all():
+        ids_all.extend(ids); mats.append(_normalize(vecs))
+    full = np.concatenate(mats)
+    out: Dict[str, List[float]] = {"reduced": [], "rescored": []}
+    for q in queries:
+        qv = np.asarray(vs.embed_text(q), dtype=np.float32)
+        truth = {ids_all[i] for i in np.argsort(-(full @ _normalize(qv)))[:k]}
+        res = coll.query(query_embeddings=proj.transform(qv[None, :]).tolist(), n_results=k * vs.RESCORE_FACTOR,
+                         include=[])
+        cand = res["ids"][0]
+        out["reduced"].append(len(truth & set(cand[:k])) / len(truth))
+        scores = rescore(qv, cand, cold)
+        top = sorted(scores, key=scores.get, reverse=True)[:k]
+        out["rescored"].append(len(truth & set(top)) / len(truth))
+    full_bytes = len(ids_all) * cold.dim * 4
+    return {
+        "queries": len(queries), "k": k, "messages": len(ids_all), "dim": proj.dim, "full_dim": cold.dim,
+        "recall_reduced": sum(out["reduced"]) / max(len(queries), 1),
+        "recall_rescored": sum(out["rescored"]) / max(len(queries), 1),
+        "index_vector_bytes": {"full": full_bytes, "reduced": len(ids_all) * proj.dim * 4},
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m services.api.reduced")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rf = sub.add_parser("refit")
+    rf.add_argument("--dim", type=int, default=64)
+    rf.add_argument("--sample", type=int, default=FIT_SAMPLE)
+    rf.add_argument("--keep-full", action="store_true", help="keep the full-size collection")
+    rf.add_argument("--offline", action="store_true",
+                    help="confirm the API is stopped (otherwise use POST /api/v2/admin/messages/refit)")
+    rc = sub.add_parser("recall")
+    rc.add_argument("queries", help="text file, one query per line")
+    rc.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+    if args.cmd == "refit":
+        if not args.offline:
+            ap.error("refit from the CLI needs --offline (API stopped); on a running server use "
+                     "POST /api/v2/admin/messages/refit")
+        print(json.dumps(refit(args.dim, args.sample, args.keep_full)))
+    else:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+        print(json.dumps(recall(queries, args.k), indent=2))
+
+
+if __name__ == "__main__":
+    main()
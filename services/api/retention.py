@@ -0,0 +1,165 @@
+from __future__ import annotations
+import logging
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import select
+
+from .db import SessionLocal
+from .models import ConversationActivity
+from .vectorstore import PERSIST_DIR, _msg_collection, compact_cold_store, delete_messages, full_vectors, upsert_messages
+
+# TTL-based retention for the messages collection: a conversation whose last turn
+# is older than MSG_TTL_S has its turns removed in batches by a background job.
+# With MSG_ROLLUP=1 they are first compacted into one "rollup" record (mean
+# embedding + the user's turns) so long-term memory survives at 1 vector/conversation.
+MSG_TTL_S = float(os.getenv("MSG_TTL_S", str(30 * 24 * 3600)))
+MSG_ROLLUP = os.getenv("MSG_ROLLUP", "0") == "1"
+RETENTION_INTERVAL_S = float(os.getenv("MSG_RETENTION_INTERVAL_S", "600"))
+RETENTION_BATCH = int(os.getenv("MSG_RETENTION_BATCH", "20"))   # conversations per pass
+DELETE_BATCH = 500
+ROLLUP_MAX_CHARS = 2000
+_BACKFILL_MARKER = os.path.join(PERSIST_DIR, "conversation_activity_backfilled")
+
+log = logging.getLogger(__name__)
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def touch(conversation_id: str, user_id: str | None, ts_ms: int) -> None:
+    """Record activity for a conversation (called for stored and merged turns)."""
+    with SessionLocal() as db:
+        row = db.get(ConversationActivity, conversation_id)
+        if row is None:
+            row = ConversationActivity(conversation_id=conversation_id, user_id=user_id, last_ts=0.0, turns=0)
+            db.add(row)
+        row.last_ts = max(row.last_ts, ts_ms / 1000.0)
+        row.turns = (row.turns or 0) + 1
+        db.commit()
+
+
+def backfill_activity(batch_size: int = 1000) -> int:
+    """
+    One-off: activity rows for conversations stored before they were tracked (else
+    they would never expire); returns rows added. Turns without a ts start the TTL now.
+    """
+    coll = _msg_collection()
+    now = time.time()
+    last: dict = {}  # conversation_id -> [last_ts, user_id, turns]
+    offset = 0
+    while True:
+        page = coll.get(limit=batch_size, offset=offset, include=["metadatas"])
+        if not page["ids"]:
+            break
+        for m in page["metadatas"]:
+            conv = (m or {}).get("conversation_id")
+            if not conv:
+                continue
+            ts = float(m["ts"]) / 1000.0 if m.get("ts") else now
+            row = last.setdefault(conv, [0.0, m.get("user_id") or None, 0])
+            row[0] = max(row[0], ts); row[2] += int(m.get("turns") or 1)
+        offset += len(page["ids"])
+    added = 0
+    with SessionLocal() as db:
+        have = set(db.execute(select(ConversationActivity.conversation_id)).scalars().all())
+        for conv, (ts, user_id, turns) in last.items():
+            if conv not in have:
+                db.add(ConversationActivity(conversation_id=conv, user_id=user_id, last_ts=ts, turns=turns))
+                added += 1
+        db.commit()
+    os.makedirs(PERSIST_DIR, exist_ok=True)
+    with open(_BACKFILL_MARKER, "w", encoding="utf-8") as f:
+        f.write(str(added))
+    return added
+
+
+def _rollup(conversation_id: str, user_id: str | None, data: dict) -> None:
+    vecs = full_vectors(data["ids"], [list(v) for v in data["embeddings"]])
+    if not vecs:
+        return
+    dim = len(vecs[0])
+    mean = [sum(v[i] for v in vecs) / len(vecs) for i in range(dim)]
+    norm = math.sqrt(sum(x * x for x in mean)) or 1.0
+    texts = [d for d, m in zip(data["documents"], data["metadatas"]) if (m or {}).get("role") == "user" and d]
+    upsert_messages(
+        [f"{conversation_id}:rollup"],
+        [[x / norm for x in mean]],
+        ["\n".join(texts)[:ROLLUP_MAX_CHARS]],
+        [{
+            "conversation_id": conversation_id, "user_id": user_id or "", "role": "rollup",
+            "turns": len(vecs), "ts": max(int((m or {}).get("ts") or 0) for m in data["metadatas"]),
+        }],
+    )
+
+
+def expire_conversation(conversation_id: str, user_id: str | None = None) -> int:
+    coll = _msg_collection()
+    where = {"conversation_id": conversation_id}
+    include = ["embeddings", "documents", "metadatas"] if MSG_ROLLUP else []
+    data = coll.get(where=where, include=include)
+    ids = [i for i in data["ids"] if not i.endswith(":rollup")]
+    if MSG_ROLLUP and ids:
+        keep = [k for k, i in enumerate(data["ids"]) if not i.endswith(":rollup")]
+        _rollup(conversation_id, user_id,
+                {key: [data[key][k] for k in keep] for key in ("ids", "embeddings", "documents", "metadatas")})
+    for i in range(0, len(ids), DELETE_BATCH):
+        delete_messages(ids[i:i + DELETE_BATCH])
+    return len(ids)
+
+
+def run_once() -> int:
+    """Expire up to RETENTION_BATCH idle conversations; returns turns removed."""
+    cutoff = time.time() - MSG_TTL_S
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(ConversationActivity)
+            .where(ConversationActivity.last_ts < cutoff)
+            .order_by(ConversationActivity.last_ts)
+            .limit(RETENTION_BATCH)
+        ).scalars().all()
+        expired = [(r.conversation_id, r.user_id) for r in rows]
+    removed = 0
+    for conversation_id, user_id in expired:
+        if _stop.is_set():
+            break
+        removed += expire_conversation(conversation_id, user_id)
+        with SessionLocal() as db:
+            row = db.get(ConversationActivity, conversation_id)
+            # a new turn may have arrived meanwhile
+            if row is not None and row.last_ts < cutoff:
+                db.delete(row); db.commit()
+    if removed:
+        log.info("[retention] removed %d turns from %d conversations", removed, len(expired))
+        # reduced mode: deleted turns only drop out of the cold store's id map until it is compacted
+        dropped = compact_cold_store()
+        if dropped:
+            log.info("[retention] compacted %d cold-store rows", dropped)
+    return removed
+
+
+def _loop() -> None:
+    if not os.path.exists(_BACKFILL_MARKER):
+        try:
+            log.info("[retention] backfilled activity of %d conversations", backfill_activity())
+        except Exception:
+            log.exception("[retention] activity backfill failed")
+    while not _stop.wait(RETENTION_INTERVAL_S):
+        try:
+            while run_once() and not _stop.is_set():
+                pass
+        except Exception:
+            log.exception("[retention] pass failed")
+
+
+def start() -> None:
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _stop.clear()
+        _thread = threading.Thread(target=_loop, name="message-retention", daemon=True)
+        _thread.start()
+
+
+def stop() -> None:
+    _stop.set()
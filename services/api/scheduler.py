@@ -0,0 +1,80 @@
+from __future__ import annotations
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Shared by the encoders and the stores: interactive work (searches, message
+# retrieval) never waits here, background work (ingest jobs) only runs in the
+# gaps. A background section is entered when no interactive call is in flight
+# and none finished in the last BACKGROUND_GRACE_MS, and at most
+# BACKGROUND_SLOTS background sections run at once. Background work is cut into
+# small sections (one embedding batch, one store write) so a search arriving
+# mid-ingest waits for at most one of them.
+BACKGROUND_GRACE_MS = int(os.getenv("BACKGROUND_GRACE_MS", "50"))
+BACKGROUND_SLOTS = int(os.getenv("BACKGROUND_SLOTS", "1"))
+BACKGROUND_MAX_WAIT_S = float(os.getenv("BACKGROUND_MAX_WAIT_S", "2"))
+
+
+class PriorityGate:
+    def __init__(self, grace_ms: int = BACKGROUND_GRACE_MS, slots: int = BACKGROUND_SLOTS,
+                 max_wait_s: float = BACKGROUND_MAX_WAIT_S):
+        self._cond = threading.Condition()
+        self._grace = grace_ms / 1000.0
+        self._slots = max(1, slots)
+        # under sustained chat load background work still gets a turn after this long
+        self._max_wait = max_wait_s
+        self._interactive = 0
+        self._background = 0
+        self._last_interactive = 0.0
+
+    @contextmanager
+    def interactive(self):
+        with self._cond:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._interactive -= 1
+                self._last_interactive = time.monotonic()
+                self._cond.notify_all()
+
+    @contextmanager
+    def background(self):
+        deadline = time.monotonic() + self._max_wait
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                idle = self._interactive == 0 and now - self._last_interactive >= self._grace
+                if self._background < self._slots and (idle or now >= deadline):
+                    break
+                if self._interactive == 0 and self._background < self._slots:
+                    timeout = self._last_interactive + self._grace - now
+                else:
+                    timeout = self._grace or 0.01
+                self._cond.wait(max(0.001, min(timeout, deadline - now) if deadline > now else timeout))
+            self._background += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._background -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"interactive": self._interactive, "background": self._background}
+
+
+gate = PriorityGate()
+
+
+def prioritized(fn):
+    """Run fn as interactive work on the shared gate."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with gate.interactive():
+            return fn(*args, **kwargs)
+    return wrapper
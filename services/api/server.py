@@ -1,19 +1,84 @@
-from fastapi import FastAPI, HTTPException
+import time
+_T_START = time.perf_counter()
+import logging
+import os
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import select
-from sqlalchemy.orm import Session
-import json
-from typing import Any, Dict, Optional, List
+from typing import Any, Dict, Optional, List, Literal
 from pydantic import BaseModel, Field   
 from services.api.vectorstore import add_message_embedding, search_messages
 
 from .db import Base, engine, SessionLocal
-from .models import Character, Property
-from .schemas import CharacterIn, CharacterOut, PropertyIn, PropertyResponse, SearchRequest, SearchResult, SearchResultItem
-from .vectorstore import add_or_update, delete, search
-from services.api.chunker import json_to_documents, chunk_documents
-from services.api.vectorstore_langchain import upsert_property_docs, delete_property, search_properties
-app = FastAPI(title="Real Estate API")
+from .models import Character
+from .schemas import CharacterIn, CharacterOut, PropertyIn
+from services.api.vectorstore_langchain import delete_property, search_properties, search_page, search_batch, recover, close_store
+from services.api.vectorstore_langchain import SHARD_BY_LOCATION, backfill_facets, backfill_locations, facets_ready, locations_ready, partition_stats, rebuild_index
+from services.api.cursors import CursorExpired
+from services.api.facets import facet_counts
+from services.api.query_parser import extract_filters
+from services.api import compactor, encoders, jobs, preferences, retention, similar, snapshot
+from services.api import vectorstore
+try:
+    # orjson serializes plain dicts several times faster than the stdlib encoder
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+    import orjson  # noqa: F401
+except ImportError:
+    from fastapi.responses import JSONResponse as FastJSONResponse
+log = logging.getLogger(__name__)
+# WARMUP_IN_BACKGROUND=1: serve /healthz right away and report /readyz 503 until the
+# snapshot/WAL recovery and model warm-up are done (the load balancer waits for it).
+# 0: do it all before uvicorn accepts connections.
+WARMUP_IN_BACKGROUND = os.getenv("WARMUP_IN_BACKGROUND", "1") == "1"
+_lifecycle: Dict[str, Any] = {"ready": False, "error": None, "timings": {}}
+
+def _warm_up():
+    timings = _lifecycle["timings"]
+    def step(name, fn):
+        t = time.perf_counter()
+        out = fn()
+        timings[name] = round(time.perf_counter() - t, 3)
+        return out
+    try:
+        step("snapshot_bootstrap", snapshot.bootstrap_if_configured)
+        step("wal_recover", recover)
+        timings["encode"] = step("models", encoders.warm_up)
+        timings["model_load"] = encoders.loaded()
+        step("stores", lambda: (partition_stats(), vectorstore._msg_collection()))
+        if not locations_ready():
+            # one-off: chunks stored before gazetteer ids get them (location filters are pushed down after)
+            step("locations_backfill", backfill_locations)
+        if not facets_ready():
+            # one-off: facet rows for properties stored before /facets existed
+            step("facets_backfill", backfill_facets)
+        compactor.start()
+        retention.start()
+        jobs.start()
+        similar.start()
+        timings["ready_since_import"] = round(time.perf_counter() - _T_START, 3)
+        _lifecycle["ready"] = True
+        log.info("[startup] ready: %s", timings)
+    except Exception as e:
+        _lifecycle["error"] = str(e)
+        log.exception("[startup] warm-up failed")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_IN_BACKGROUND:
+        threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+    else:
+        _warm_up()
+    yield
+    compactor.stop()
+    retention.stop()
+    jobs.stop()
+    similar.stop()
+    close_store()
+
+app = FastAPI(title="Real Estate API", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -23,6 +88,17 @@ app.add_middleware(
 )
 
 Base.metadata.create_all(bind=engine)
+_lifecycle["timings"]["import"] = round(time.perf_counter() - _T_START, 3)
+
+@app.get("/healthz")
+def healthz():
+    # liveness only: the process is up and serving
+    return {"status": "ok", "uptime_s": round(time.perf_counter() - _T_START, 1)}
+
+@app.get("/readyz")
+def readyz():
+    body = {"ready": _lifecycle["ready"], "error": _lifecycle["error"], "timings": _lifecycle["timings"]}
+    return JSONResponse(status_code=200 if _lifecycle["ready"] else 503, content=body)
 
 class MessageIn(BaseModel):
     conversation_id: str
@@ -61,11 +137,59 @@ class APIResp(BaseModel):
 
 class SearchReq(BaseModel):
     query: str
+    # location, location_id, property_type, bedrooms, budget_min, budget_max,
+    # radius_km (+ lat/lon, or around location_id)
     filters: Dict[str, Any] = Field(default_factory=dict)
     top_k: int = 5
+    # one hit per property_id instead of per chunk
+    group_by_property: bool = False
+    group_score: Literal["max", "weighted"] = "max"
+    section_weights: Optional[Dict[str, float]] = None
+    # shortlist properties on the centroid index first (default: TWO_STAGE_SEARCH)
+    two_stage: Optional[bool] = None
+    # opaque cursor from a previous response; query/filters are then taken from it
+    cursor: Optional[str] = None
+    # projection of each hit: "id", "score" (distance, lower = closer), "relevance"
+    # (grouped only, higher = better), "hits", "page_content", "metadata" or "metadata.<key>"
+    fields: Optional[List[str]] = None
+    # cut page_content to this many characters
+    snippet_chars: Optional[int] = Field(default=None, ge=0)
+    # personalize with this user's preference vector; personalize = its weight (default PREF_BLEND, 0 = off)
+    user_id: Optional[str] = None
+    personalize: Optional[float] = Field(default=None, ge=0, le=1)
 
 class SearchOut(BaseModel):
     items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    # effective filters, including those extracted from the query text (natural search)
+    filters: Optional[Dict[str, Any]] = None
+
+class BatchQuery(BaseModel):
+    query: str
+    filters: Dict[str, Any] = Field(default_factory=dict)
+
+class BatchSearchReq(BaseModel):
+    searches: List[BatchQuery] = Field(max_length=64)
+    top_k: int = 5
+    two_stage: Optional[bool] = None
+    fields: Optional[List[str]] = None
+    snippet_chars: Optional[int] = Field(default=None, ge=0)
+    user_id: Optional[str] = None
+    personalize: Optional[float] = Field(default=None, ge=0, le=1)
+
+class BatchSearchOut(BaseModel):
+    # one entry per search, in request order
+    results: List[SearchOut]
+
+class FacetReq(BaseModel):
+    # same keys as SearchReq.filters (+ optional "price_band")
+    filters: Dict[str, Any] = Field(default_factory=dict)
+
+class FacetOut(BaseModel):
+    total: int
+    facets: Dict[str, Dict[str, int]]
+    # budget filters rounded to price band edges: {"budget_max": {"requested", "counted_up_to"}, ...}
+    approximate: Dict[str, Any] = Field(default_factory=dict)
     
 @app.post("/api/v2/conversation/message", response_model=MessageAck)
 def store_message(msg: MessageIn):
@@ -82,8 +206,15 @@ def store_message(msg: MessageIn):
         "slots": msg.slots,
         **msg.extra
     }
-    add_message_embedding(msg_id=msg_id, text=msg.text, metadata=meta)
-    return MessageAck(success=True, message="Message embedded", id=msg_id)
+    meta["ts"] = ts
+    status = add_message_embedding(msg_id=msg_id, text=msg.text, metadata=meta)
+    if status != "skipped":
+        retention.touch(msg.conversation_id, msg.user_id, ts)
+        if msg.role == "user":
+            try: preferences.observe(msg.user_id, msg.text)
+            except Exception: log.exception("[preferences] update failed for %s", msg.user_id)
+    text = {"stored": "Message embedded", "merged": "Merged into an earlier turn", "skipped": "Trivial message, not embedded"}
+    return MessageAck(success=True, message=text[status], id=msg_id)
 
 # Optional: search conversation messages (for memory / retrieval)
 class MsgSearchReq(BaseModel):
@@ -197,11 +328,19 @@ def delete_character(cid: int):
 #     return SearchResult(items=[SearchResultItem(id=i["id"], score=i["score"], metadata=i["metadata"]) for i in items])
 
 @app.post("/api/v2/property/embedding", response_model=APIResp)
-def create_or_upsert_property(prop: PropertyIn):
+def create_or_upsert_property(prop: PropertyIn, async_job: bool = Query(False, alias="async"),
+                              idempotency_key: Optional[str] = Header(None)):
+    if async_job:
+        # 202 + job id; the work runs on the ingest queue (jobs.py) behind interactive traffic
+        job, created = jobs.submit(prop.model_dump(), key=idempotency_key)
+        return JSONResponse(status_code=202, content=APIResp(
+            message=f"Ingest job {job['status']} for {prop.id}",
+            unitId=prop.unitId,
+            success=True,
+            additional={**job, "created": created},
+        ).model_dump())
     try:
-        base_docs = json_to_documents(prop.model_dump())
-        chunks = chunk_documents(base_docs, chunk_size=800, chunk_overlap=120)
-        n_chunks, _ = upsert_property_docs(chunks)
+        n_chunks, _ = jobs.ingest_property(prop.model_dump())
         return APIResp(
             message=f"Embedded {n_chunks} chunks for {prop.id}",
             unitId=prop.unitId,
@@ -211,14 +350,24 @@ def create_or_upsert_property(prop: PropertyIn):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Embedding failed: {e}")
 
+@app.get("/api/v2/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "not found")
+    return job
+
 @app.put("/api/v2/property/embedding", response_model=APIResp)
-def update_property(prop: PropertyIn):
-    return create_or_upsert_property(prop)
+def update_property(prop: PropertyIn, async_job: bool = Query(False, alias="async"),
+                    idempotency_key: Optional[str] = Header(None)):
+    return create_or_upsert_property(prop, async_job, idempotency_key)
 @app.get("/api/v2/property/vector/{property_id}")
-def get_property_vectors(property_id: str):
-    from .vectorstore_langchain import _chroma
-    vs = _chroma()
-    data = vs.get(where={"property_id": property_id})
+def get_property_vectors(property_id: str, limit: int = 200, offset: int = 0):
+    from .vectorstore_langchain import get_property_chunks
+    from . import tombstones
+    if tombstones.is_dead(property_id):
+        return {"total": 0, "chunks": []}
+    data = get_property_chunks(property_id, limit=limit, offset=offset)
     return {
         "total": len(data["ids"]),
         "chunks": [
@@ -231,6 +380,22 @@ def get_property_vectors(property_id: str):
         ]
     }
 
+@app.get("/api/v2/property/{property_id}/similar")
+def get_similar_properties(property_id: str, limit: int = Query(10, ge=1, le=similar.SIMILAR_TOP_N)):
+    # precomputed neighbour list (similar.py): no embedding call on the request path
+    from . import tombstones
+    if tombstones.is_dead(property_id):
+        raise HTTPException(status_code=404, detail="Property not found")
+    return FastJSONResponse({"property_id": property_id, "items": similar.similar(property_id, limit)})
+
+@app.post("/api/v2/admin/similar/refresh")
+def refresh_similar(all_properties: bool = Query(False, alias="all")):
+    # all=true: queue every property with a centroid (after enabling the feature on an existing catalog)
+    if all_properties:
+        from .vectorstore_langchain import _centroids
+        similar.enqueue(_centroids().get(include=[])["ids"])
+    return {"refreshed": similar.run_once()}
+
 @app.delete("/api/v2/property/embedding/{property_id}", response_model=APIResp)
 def remove_property(property_id: str):
     try:
@@ -244,15 +409,143 @@ def remove_property(property_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Delete failed: {e}")
 
+def _project(item: Dict[str, Any], fields: Optional[List[str]], snippet_chars: Optional[int]) -> Dict[str, Any]:
+    if snippet_chars is not None and len(item.get("page_content") or "") > snippet_chars:
+        item = {**item, "page_content": item["page_content"][:snippet_chars] + "…"}
+    if not fields:
+        return item
+    out: Dict[str, Any] = {}
+    for f in fields:
+        top, _, key = f.partition(".")
+        if top not in item:
+            continue
+        if not key:
+            out[top] = item[top]
+        elif isinstance(item[top], dict) and key in item[top]:
+            out.setdefault(top, {})[key] = item[top][key]
+    return out
+
+def _search(req: SearchReq) -> Dict[str, Any]:
+    try:
+        if req.group_by_property:
+            items = search_properties(req.query, req.filters, req.top_k,
+                                      group_by_property=True,
+                                      group_score=req.group_score,
+                                      section_weights=req.section_weights,
+                                      two_stage=req.two_stage,
+                                      user_id=req.user_id, personalize=req.personalize)
+            next_cursor = None
+        else:
+            items, next_cursor = search_page(req.query, req.filters, req.top_k, cursor=req.cursor, two_stage=req.two_stage,
+                                             user_id=req.user_id, personalize=req.personalize)
+    except CursorExpired:
+        raise HTTPException(status_code=410, detail="Cursor expired, run the search again")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {e}")
+    items = [_project(it, req.fields, req.snippet_chars) for it in items]
+    return {"items": items, "next_cursor": next_cursor, "filters": None}
+
+# Search responses are returned as plain dicts through FastJSONResponse: response_model
+# only documents the shape, the hits are not re-validated/re-encoded by pydantic.
 @app.post("/api/v2/property/search", response_model=SearchOut)
 def search_endpoint(req: SearchReq):
+    return FastJSONResponse(_search(req))
+
+@app.post("/api/v2/property/search/batch", response_model=BatchSearchOut)
+def batch_search_endpoint(req: BatchSearchReq):
+    # one encoder pass and one store query per distinct where clause for the whole batch
     try:
-        items = search_properties(req.query, req.filters, req.top_k)
-        return SearchOut(items=items)
+        batches = search_batch([(q.query, q.filters) for q in req.searches], req.top_k, two_stage=req.two_stage,
+                               user_id=req.user_id, personalize=req.personalize)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {e}")
-@app.post("/api/v2/property/search/natural", response_model=SearchResult)
-def natural_language_search(req: SearchRequest):
-    # For now identical to /search. Keep this route to match your logs.
-    items = search(req.query, req.filters, req.top_k)
-    return SearchResult(items=[SearchResultItem(id=i["id"], score=i["score"], metadata=i["metadata"]) for i in items])
\ No newline at end of file
+    return FastJSONResponse({"results": [
+        {"items": [_project(it, req.fields, req.snippet_chars) for it in items], "next_cursor": None, "filters": None}
+        for items in batches
+    ]})
+
+@app.post("/api/v2/property/facets", response_model=FacetOut)
+def property_facets(req: FacetReq):
+    return FacetOut(**facet_counts(req.filters))
+
+@app.get("/api/v2/admin/partitions")
+def list_partitions():
+    return {"sharded": SHARD_BY_LOCATION, "partitions": partition_stats()}
+
+@app.post("/api/v2/admin/partitions/{name}/rebuild")
+def rebuild_partition(name: str):
+    if name not in partition_stats():
+        raise HTTPException(404, "not found")
+    return {"name": name, "chunks": rebuild_index(name)}
+
+@app.get("/api/v2/admin/export/{target}")
+def export_collection(target: str, embeddings: bool = False, batch: int = 500):
+    # NDJSON, one chunk/message per line, read from the store page by page
+    from fastapi.responses import StreamingResponse
+    from . import export
+    if target not in export.TARGETS:
+        raise HTTPException(404, "not found")
+    return StreamingResponse(export.iter_ndjson(target, embeddings, max(1, min(batch, 5000))),
+                             media_type="application/x-ndjson")
+
+@app.post("/api/v2/admin/locations/backfill")
+def backfill_property_locations():
+    from .vectorstore_langchain import backfill_locations
+    return {"chunks": backfill_locations()}
+
+@app.post("/api/v2/admin/messages/refit")
+def refit_messages_index(dim: int = Query(64, ge=8, le=384), keep_full: bool = False):
+    # in-process, so the cached collection/projection/cold store switch with it (see reduced.py)
+    from .reduced import refit
+    try:
+        return refit(dim, keep_full=keep_full)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/v2/admin/centroids/rebuild")
+def rebuild_property_centroids():
+    from .vectorstore_langchain import rebuild_centroids
+    return {"properties": rebuild_centroids()}
+
+class SnapshotImportReq(BaseModel):
+    path: str
+
+@app.post("/api/v2/admin/snapshot")
+def create_snapshot():
+    import os, time
+    os.makedirs(snapshot.SNAPSHOT_DIR, exist_ok=True)
+    name = time.strftime("properties-%Y%m%dT%H%M%S.snap.gz", time.gmtime())
+    return snapshot.export_snapshot(os.path.join(snapshot.SNAPSHOT_DIR, name))
+
+@app.get("/api/v2/admin/snapshot/{name}")
+def download_snapshot(name: str):
+    import os
+    from fastapi.responses import FileResponse
+    path = os.path.join(snapshot.SNAPSHOT_DIR, os.path.basename(name))
+    if not os.path.exists(path):
+        raise HTTPException(404, "not found")
+    return FileResponse(path, media_type="application/gzip", filename=os.path.basename(path))
+
+@app.post("/api/v2/admin/snapshot/import")
+def load_snapshot(req: SnapshotImportReq):
+    try:
+        return snapshot.import_snapshot(req.path)
+    except snapshot.SnapshotError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+_LOCATION_KEYS = ("location", "location_id", "radius_km", "lat", "lon")
+
+@app.post("/api/v2/property/search/natural", response_model=SearchOut)
+def natural_language_search(req: SearchReq):
+    # /search plus filters read from the text itself; explicit filters (Rasa slots) win
+    if req.cursor:
+        return search_endpoint(req)
+    parsed = extract_filters(req.query)
+    explicit = {k: v for k, v in req.filters.items() if v not in (None, "")}
+    if "location" in explicit or "location_id" in explicit:
+        # the slot's place replaces the parsed one entirely (no parsed id/radius around another place)
+        parsed = {k: v for k, v in parsed.items() if k not in _LOCATION_KEYS}
+    req = req.model_copy(update={"filters": {**parsed, **explicit}})
+    out = _search(req)
+    out["filters"] = req.filters
+    return FastJSONResponse(out)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+import re
+import threading
+import unicodedata
+from typing import Any, Iterable, List, Set
+
+# Location partitions of the property index: one Chroma collection per
+# gazetteer district (or city when no district is known), named "<base>__g_<id>"
+# (e.g. properties__g_hcm_q7), so "Quận 7", "Q7" and "District 7" share a partition.
+# Locations the gazetteer does not know, and partitions created before the ids
+# existed, are keyed by the normalized text instead (e.g. properties__quan_7).
+_SEP = "__"
+PLACE_PREFIX = "g_"
+_lock = threading.Lock()
+_known: Set[str] | None = None
+
+
+def shard_key(location: Any) -> str:
+    """'Quận 7, TP. Hồ Chí Minh' -> 'quan_7' (first comma segment, unaccented, snake_case)."""
+    s = str(location or "").split(",")[0]
+    s = unicodedata.normalize("NFD", s.replace("đ", "d").replace("Đ", "D"))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+    s = re.sub(r"[^a-z0-9]+", "_", s).strip("_")
+    return s[:40] or "unknown"
+
+
+def place_key(place_id: str) -> str:
+    return PLACE_PREFIX + shard_key(place_id)
+
+
+def collection_name(base: str, location: Any) -> str:
+    return f"{base}{_SEP}{shard_key(location)}"
+
+
+def _is_shard(base: str, name: str) -> bool:
+    return name.startswith(base + _SEP) and not name.endswith(("-rebuild", "-retired"))
+
+
+def known(client: Any, base: str) -> List[str]:
+    global _known
+    with _lock:
+        if _known is None:
+            # chromadb 0.5 returns Collection objects, 0.6+ returns names
+            _known = {getattr(c, "name", c) for c in client.list_collections()}
+        return sorted(n for n in _known if _is_shard(base, n))
+
+
+def register(name: str) -> None:
+    with _lock:
+        if _known is not None:
+            _known.add(name)
+
+
+def route(names: Iterable[str], base: str, keys: Set[str]) -> List[str]:
+    """
+    Shards keyed by one of the place keys, plus every text-keyed shard: what those
+    hold cannot be told from their name (a "ho_chi_minh" shard is not all of the
+    city), so they are always queried and the post-filter decides.
+    """
+    prefix = base + _SEP
+    return [n for n in names
+            if n[len(prefix):] in keys or not n[len(prefix):].startswith(PLACE_PREFIX)]
@@ -0,0 +1,122 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import delete, select
+
+from .db import SessionLocal
+from .models import SharedChunkOwner
+
+# Units of one project repeat the same living_experience / equipment / property_groups
+# text. With DEDUP_SHARED_CHUNKS=1 a chunk of those sections is keyed by a hash of
+# its text: it is embedded and stored once (collection property_shared_chunks, id
+# "shared::<hash>") and shared_chunk_owners lists the properties it belongs to,
+# each with that unit's own chunk metadata. Searches expand a shared hit back to
+# one hit per owner, so filters, grouping and tombstones work per unit as before.
+DEDUP_SHARED_CHUNKS = os.getenv("DEDUP_SHARED_CHUNKS", "1") == "1"
+ID_PREFIX = "shared::"
+# all (hash, owner meta) rows, kept in memory to pick the hashes of filter-matching
+# units before a filtered search; reloaded after local writes or OWNERS_TTL_S (other workers)
+OWNERS_TTL_S = float(os.getenv("SHARED_OWNERS_TTL_S", "30"))
+
+_lock = threading.Lock()
+_all: List[Tuple[str, Dict[str, Any]]] | None = None
+_loaded_at = 0.0
+
+
+def content_hash(section: str, text: str) -> str:
+    return hashlib.sha256(f"{section}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def chunk_id(h: str) -> str:
+    return ID_PREFIX + h
+
+
+def _orphans(db, hashes: Set[str]) -> List[str]:
+    if not hashes:
+        return []
+    owned = set(db.execute(
+        select(SharedChunkOwner.content_hash).where(SharedChunkOwner.content_hash.in_(hashes))
+    ).scalars().all())
+    return sorted(hashes - owned)
+
+
+def replace(pids: Iterable[str], rows: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+    """Owner rows of pids := rows [(hash, unit meta)]; returns hashes left without owners."""
+    pids = list(pids)
+    with SessionLocal() as db:
+        before = set(db.execute(
+            select(SharedChunkOwner.content_hash).where(SharedChunkOwner.property_id.in_(pids))
+        ).scalars().all())
+        db.execute(delete(SharedChunkOwner).where(SharedChunkOwner.property_id.in_(pids)))
+        for h, meta in rows:
+            db.merge(SharedChunkOwner(content_hash=h, property_id=meta["property_id"],
+                                      meta=json.dumps(meta, ensure_ascii=False)))
+        db.flush()
+        orphans = _orphans(db, before)
+        db.commit()
+    _invalidate()
+    return orphans
+
+
+def drop(pids: Iterable[str]) -> List[str]:
+    return replace(pids, [])
+
+
+def owners(hashes: Iterable[str], within: Iterable[str] | None = None) -> Dict[str, List[Dict[str, Any]]]:
+    """hash -> metadata of each owning unit (ordered by property_id), optionally only owners in `within`."""
+    hashes = list(set(hashes))
+    out: Dict[str, List[Dict[str, Any]]] = {h: [] for h in hashes}
+    if not hashes:
+        return out
+    q = select(SharedChunkOwner).where(SharedChunkOwner.content_hash.in_(hashes))
+    if within is not None:
+        q = q.where(SharedChunkOwner.property_id.in_(list(within)))
+    with SessionLocal() as db:
+        for r in db.execute(q.order_by(SharedChunkOwner.property_id)).scalars().all():
+            out[r.content_hash].append(json.loads(r.meta))
+    return out
+
+
+def hashes_of(pids: Iterable[str]) -> List[str]:
+    with SessionLocal() as db:
+        return sorted(set(db.execute(
+            select(SharedChunkOwner.content_hash).where(SharedChunkOwner.property_id.in_(list(pids)))
+        ).scalars().all()))
+
+
+def add(h: str, metas: List[Dict[str, Any]]) -> None:
+    """Add owners to one hash (snapshot import); existing owners are kept."""
+    with SessionLocal() as db:
+        for meta in metas:
+            db.merge(SharedChunkOwner(content_hash=h, property_id=meta["property_id"],
+                                      meta=json.dumps(meta, ensure_ascii=False)))
+        db.commit()
+    _invalidate()
+
+
+def reset() -> None:
+    with SessionLocal() as db:
+        db.execute(delete(SharedChunkOwner)); db.commit()
+    _invalidate()
+
+
+def _invalidate() -> None:
+    global _all
+    with _lock:
+        _all = None
+
+
+def all_owners() -> List[Tuple[str, Dict[str, Any]]]:
+    global _all, _loaded_at
+    with _lock:
+        if _all is None or time.time() - _loaded_at >= OWNERS_TTL_S:
+            with SessionLocal() as db:
+                _all = [(r.content_hash, json.loads(r.meta))
+                        for r in db.execute(select(SharedChunkOwner)).scalars().all()]
+            _loaded_at = time.time()
+        return _all
@@ -0,0 +1,170 @@
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import delete, select
+
+from . import tombstones
+from .db import SessionLocal
+from .models import NeighborRefresh, PropertyNeighbor
+from .scheduler import gate
+
+# "More like this": top-N nearest properties per property, by cosine between the
+# property centroids (see _update_centroids), kept in the property_neighbors table
+# so GET /property/{id}/similar is a primary-key read with no model call.
+# Writes only queue work: an upserted property and every property listing it as a
+# neighbour go into neighbor_refresh; the refresher recomputes at most
+# SIMILAR_REFRESH_BATCH lists per pass (one multi-vector centroid query) as
+# background work, and pushes each recomputed property into the lists of its new
+# neighbours, so a listing shows up next to existing ones without recomputing them.
+SIMILAR_TOP_N = int(os.getenv("SIMILAR_TOP_N", "20"))
+SIMILAR_REFRESH_BATCH = int(os.getenv("SIMILAR_REFRESH_BATCH", "50"))
+SIMILAR_INTERVAL_S = float(os.getenv("SIMILAR_INTERVAL_S", "10"))
+
+log = logging.getLogger(__name__)
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def _rows(db, property_id: str) -> List[Tuple[str, float]]:
+    rows = db.execute(
+        select(PropertyNeighbor.neighbor_id, PropertyNeighbor.score)
+        .where(PropertyNeighbor.property_id == property_id).order_by(PropertyNeighbor.rank)
+    ).all()
+    return [(r[0], r[1]) for r in rows]
+
+
+def _write(db, property_id: str, items: List[Tuple[str, float]]) -> None:
+    db.execute(delete(PropertyNeighbor).where(PropertyNeighbor.property_id == property_id))
+    for rank, (nid, score) in enumerate(items[:SIMILAR_TOP_N]):
+        db.add(PropertyNeighbor(property_id=property_id, rank=rank, neighbor_id=nid, score=score))
+
+
+def _enqueue(db, pids: Iterable[str], now: float) -> None:
+    for pid in pids:
+        db.merge(NeighborRefresh(property_id=pid, queued_at=now))
+
+
+def mark_changed(pids: List[str]) -> None:
+    """Called from the upsert path: the properties and the lists that contain them are stale."""
+    if not pids:
+        return
+    with SessionLocal() as db:
+        listed_by = db.execute(
+            select(PropertyNeighbor.property_id).where(PropertyNeighbor.neighbor_id.in_(pids))
+        ).scalars().all()
+        _enqueue(db, set(pids) | set(listed_by), time.time())
+        db.commit()
+
+
+def mark_deleted(property_id: str) -> None:
+    """Drop the property's list and remove it from every other list right away; those lists get refilled later."""
+    with SessionLocal() as db:
+        listed_by = db.execute(
+            select(PropertyNeighbor.property_id).where(PropertyNeighbor.neighbor_id == property_id)
+        ).scalars().all()
+        db.execute(delete(PropertyNeighbor).where(PropertyNeighbor.property_id == property_id))
+        db.execute(delete(PropertyNeighbor).where(PropertyNeighbor.neighbor_id == property_id))
+        db.execute(delete(NeighborRefresh).where(NeighborRefresh.property_id == property_id))
+        _enqueue(db, set(listed_by), time.time())
+        db.commit()
+
+
+def enqueue(pids: Iterable[str]) -> None:
+    with SessionLocal() as db:
+        _enqueue(db, pids, time.time())
+        db.commit()
+
+
+def _merge_into(db, property_id: str, neighbor_id: str, score: float) -> None:
+    items = [(nid, s) for nid, s in _rows(db, property_id) if nid != neighbor_id]
+    if len(items) >= SIMILAR_TOP_N and score <= items[-1][1]:
+        return
+    items.append((neighbor_id, score))
+    items.sort(key=lambda t: -t[1])
+    _write(db, property_id, items)
+
+
+def refresh(pids: List[str]) -> int:
+    """Recompute the neighbour lists of pids from the centroid index; returns lists written."""
+    from .vectorstore_langchain import _centroids
+
+    coll = _centroids()
+    got = coll.get(ids=list(pids), include=["embeddings"])
+    have = dict(zip(got["ids"], got["embeddings"]))
+    live = [pid for pid in pids if pid in have]
+    lists: Dict[str, List[Tuple[str, float]]] = {pid: [] for pid in pids}
+    if live and coll.count() > 1:
+        res = coll.query(query_embeddings=[list(have[pid]) for pid in live],
+                         n_results=min(SIMILAR_TOP_N + 1, coll.count()), include=["distances"])
+        for pid, ids, dists in zip(live, res["ids"], res["distances"]):
+            lists[pid] = [(nid, round(1.0 - d, 6)) for nid, d in zip(ids, dists)
+                          if nid != pid and not tombstones.is_dead(nid)][:SIMILAR_TOP_N]
+    with SessionLocal() as db:
+        for pid, items in lists.items():
+            _write(db, pid, items)
+            for nid, score in items:
+                if nid not in lists:
+                    _merge_into(db, nid, pid, score)
+        db.commit()
+    return len(lists)
+
+
+def similar(property_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+    with SessionLocal() as db:
+        items = _rows(db, property_id)
+        if not items and db.get(NeighborRefresh, property_id) is not None:
+            items = None
+    if items is None:
+        # queued and never computed (new listing): do this one now
+        refresh([property_id])
+        with SessionLocal() as db:
+            db.execute(delete(NeighborRefresh).where(NeighborRefresh.property_id == property_id))
+            db.commit()
+            items = _rows(db, property_id)
+    return [{"property_id": nid, "score": score} for nid, score in items[:limit]]
+
+
+def run_once() -> int:
+    """Refresh up to SIMILAR_REFRESH_BATCH queued lists; returns lists refreshed."""
+    with SessionLocal() as db:
+        queued = db.execute(
+            select(NeighborRefresh.property_id, NeighborRefresh.queued_at)
+            .order_by(NeighborRefresh.queued_at).limit(SIMILAR_REFRESH_BATCH)
+        ).all()
+    if not queued:
+        return 0
+    with gate.background():
+        n = refresh([pid for pid, _ in queued])
+    with SessionLocal() as db:
+        # entries re-queued while we were working stay queued
+        for pid, ts in queued:
+            db.execute(delete(NeighborRefresh).where(NeighborRefresh.property_id == pid,
+                                                      NeighborRefresh.queued_at <= ts))
+        db.commit()
+    return n
+
+
+def _loop() -> None:
+    while not _stop.wait(SIMILAR_INTERVAL_S):
+        try:
+            n = run_once()
+            if n:
+                log.info("[similar] refreshed %d neighbour lists", n)
+        except Exception:
+            log.exception("[similar] refresh pass failed")
+
+
+def start() -> None:
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _stop.clear()
+        _thread = threading.Thread(target=_loop, name="similar-refresher", daemon=True)
+        _thread.start()
+
+
+def stop() -> None:
+    _stop.set()
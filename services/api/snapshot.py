@@ -0,0 +1,224 @@
+from __future__ import annotations
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from array import array
+from typing import Any, Dict, Iterator, List
+
+from . import facets, geo, shards, shared_chunks, tombstones
+from .vectorstore_langchain import (
+    COLL_SHARED, EMBED_MODEL, PERSIST_DIR, SHARD_BY_LOCATION, _all_collections, _apply_delete, _apply_upsert,
+    _chroma, _durability, _embeddings, _flush_store, _forget_stores, _write_lock, rebuild_centroids,
+)
+
+# Portable snapshot of the property index: gzip'd JSONL with
+#   header   {"format", "version", "model", "collections", ...}
+#   records  {"c": collection, "id", "doc", "meta", "vec": base64 float32}
+#            (+ "owners": [unit meta] for deduplicated chunks, c = property_shared_chunks)
+#   wal tail {"wal": record}   writes that landed while the snapshot was taken
+#   trailer  {"sha256", "count"}  over every preceding line
+FORMAT = "rea-snapshot"
+VERSION = 1
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(PERSIST_DIR, "snapshots"))
+BATCH = 500
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _vec_to_b64(vec) -> str:
+    return base64.b64encode(array("f", vec).tobytes()).decode("ascii")
+
+
+def _b64_to_vec(s: str) -> List[float]:
+    a = array("f"); a.frombytes(base64.b64decode(s))
+    return a.tolist()
+
+
+def export_snapshot(path: str) -> Dict[str, Any]:
+    """
+    Write a consistent snapshot without stopping writers for the copy itself:
+    the WAL is pinned and live ids are listed under the write lock (brief), chunks
+    are then copied lock-free, and every WAL record written meanwhile is appended
+    so that replaying it on import yields the state at the end of the export.
+    """
+    wal, _ = _durability()
+    with _write_lock:
+        start = wal.pin()
+        names = _all_collections()
+        if _chroma(COLL_SHARED)._collection.count():
+            names.append(COLL_SHARED)
+        listing = {name: _chroma(name)._collection.get(include=[])["ids"] for name in names}
+    tmp = path + ".tmp"
+    digest = hashlib.sha256()
+    count = 0
+    try:
+        with gzip.open(tmp, "wb") as out:
+            def emit(obj: Dict[str, Any]) -> None:
+                line = json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+                digest.update(line); out.write(line)
+
+            emit({
+                "format": FORMAT, "version": VERSION, "model": EMBED_MODEL, "sharded": SHARD_BY_LOCATION,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "collections": {name: _chroma(name)._collection.metadata for name in names},
+            })
+            for name, ids in listing.items():
+                coll = _chroma(name)._collection
+                for i in range(0, len(ids), BATCH):
+                    page = coll.get(ids=ids[i:i + BATCH], include=["embeddings", "documents", "metadatas"])
+                    owners = shared_chunks.owners(m["content_hash"] for m in page["metadatas"]) \
+                        if name == COLL_SHARED else {}
+                    for id_, vec, doc, meta in zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"]):
+                        if tombstones.is_dead((meta or {}).get("property_id")):
+                            continue
+                        rec = {"c": name, "id": id_, "doc": doc, "meta": meta, "vec": _vec_to_b64(vec)}
+                        if name == COLL_SHARED:
+                            rec["owners"] = [o for o in owners.get(meta["content_hash"], ())
+                                             if not tombstones.is_dead(o["property_id"])]
+                            if not rec["owners"]:
+                                continue
+                        emit(rec)
+                        count += 1
+            for rec in wal.records(start, wal.tell()):
+                emit({"wal": rec})
+            sha = digest.hexdigest()
+            out.write((json.dumps({"sha256": sha, "count": count}) + "\n").encode("utf-8"))
+        os.replace(tmp, path)
+    finally:
+        wal.unpin()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return {"path": path, "count": count, "sha256": sha}
+
+
+def _lines(path: str) -> Iterator[bytes]:
+    with gzip.open(path, "rb") as f:
+        yield from f
+
+
+def verify(path: str) -> Dict[str, Any]:
+    """Check checksum and model before anything is touched; returns the header."""
+    digest = hashlib.sha256()
+    header = trailer = None
+    for line in _lines(path):
+        obj = json.loads(line)
+        if "sha256" in obj:
+            trailer = obj
+            break
+        if header is None:
+            header = obj
+        digest.update(line)
+    if not header or header.get("format") != FORMAT:
+        raise SnapshotError("not a snapshot file")
+    if header.get("version") != VERSION:
+        raise SnapshotError(f"unsupported snapshot version {header.get('version')}")
+    if trailer is None or trailer["sha256"] != digest.hexdigest():
+        raise SnapshotError("checksum mismatch (truncated or corrupted file)")
+    if header.get("model") != EMBED_MODEL:
+        raise SnapshotError(f"snapshot was built with {header.get('model')}, this replica runs {EMBED_MODEL}")
+    if bool(header.get("sharded")) != SHARD_BY_LOCATION:
+        raise SnapshotError("snapshot and replica disagree on SHARD_BY_LOCATION")
+    return header
+
+
+def import_snapshot(path: str) -> Dict[str, Any]:
+    """Replace the local property index with the snapshot content."""
+    header = verify(path)
+    client = _chroma()._client
+    count = 0
+    with _write_lock:
+        for name in _all_collections():
+            client.delete_collection(name)
+        try: client.delete_collection(COLL_SHARED)
+        except Exception: pass
+        _forget_stores()
+        shared_chunks.reset()
+        facets.reset()
+        geo.reset()
+        tombstones.reset()
+        colls = {name: client.get_or_create_collection(name, metadata=meta)
+                 for name, meta in header["collections"].items()}
+        for name in colls:
+            shards.register(name)
+        batch: Dict[str, Dict[str, list]] = {}
+        seen_pids = set()
+
+        def flush(name: str) -> None:
+            b = batch.pop(name, None)
+            if b and b["ids"]:
+                colls[name].add(ids=b["ids"], embeddings=b["vecs"], documents=b["docs"], metadatas=b["metas"])
+
+        lines = _lines(path)
+        next(lines)  # header
+        for line in lines:
+            obj = json.loads(line)
+            if "sha256" in obj:
+                break
+            if "wal" in obj:
+                for name in list(batch):
+                    flush(name)
+                rec = obj["wal"]
+                if rec.get("op") == "upsert":
+                    embeddings = _embeddings.embed_documents(rec["texts"]) if rec["texts"] else []
+                    _apply_upsert(rec["ids"], rec["texts"], rec["metas"], embeddings, rec["pids"])
+                elif rec.get("op") == "delete":
+                    _apply_delete(rec["property_id"])
+                continue
+            b = batch.setdefault(obj["c"], {"ids": [], "vecs": [], "docs": [], "metas": []})
+            b["ids"].append(obj["id"]); b["vecs"].append(_b64_to_vec(obj["vec"]))
+            b["docs"].append(obj["doc"]); b["metas"].append(obj["meta"])
+            if obj.get("owners"):
+                shared_chunks.add(obj["meta"]["content_hash"], obj["owners"])
+            pid = (obj["meta"] or {}).get("property_id")
+            if pid and pid not in seen_pids:
+                seen_pids.add(pid)
+                facets.record(pid, obj["meta"])
+                geo.record(pid, obj["meta"])
+            count += 1
+            if len(b["ids"]) >= BATCH:
+                flush(obj["c"])
+        for name in list(batch):
+            flush(name)
+        rebuild_centroids()
+        _flush_store()
+    log.info("[snapshot] loaded %d chunks from %s", count, path)
+    return {"path": path, "count": count, "model": header["model"], "created_at": header["created_at"]}
+
+
+def bootstrap_if_configured() -> None:
+    """SNAPSHOT_BOOTSTRAP=<file>: load it on startup when the local index is empty."""
+    path = os.getenv("SNAPSHOT_BOOTSTRAP")
+    if not path:
+        return
+    if any(_chroma(name)._collection.count() for name in _all_collections()):
+        log.info("[snapshot] local index not empty, skipping bootstrap from %s", path)
+        return
+    import_snapshot(path)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m services.api.snapshot")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export"); ex.add_argument("path")
+    im = sub.add_parser("import"); im.add_argument("path")
+    vf = sub.add_parser("verify"); vf.add_argument("path")
+    args = ap.parse_args()
+    if args.cmd == "export":
+        print(json.dumps(export_snapshot(args.path)))
+    elif args.cmd == "import":
+        print(json.dumps(import_snapshot(args.path), ensure_ascii=False))
+    else:
+        print(json.dumps(verify(args.path), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+from __future__ import annotations
+import threading
+import time
+from itertools import islice
+from typing import Iterable, List, Set
+
+from sqlalchemy import delete, select
+
+from .db import SessionLocal
+from .models import Tombstone
+
+# Deleted property_ids. Every search path drops hits whose property_id is in
+# this set; compactor.py removes the chunks from the store in the background.
+_lock = threading.Lock()
+_dead: Set[str] | None = None
+
+
+def _ensure_loaded() -> Set[str]:
+    global _dead
+    if _dead is None:
+        with SessionLocal() as db:
+            _dead = set(db.execute(select(Tombstone.property_id)).scalars().all())
+    return _dead
+
+
+def add(property_id: str) -> None:
+    with _lock:
+        dead = _ensure_loaded()
+        if property_id in dead:
+            return
+        with SessionLocal() as db:
+            db.merge(Tombstone(property_id=property_id, deleted_at=time.time())); db.commit()
+        dead.add(property_id)
+
+
+def discard(property_id: str) -> None:
+    """Re-upserted property: it is alive again."""
+    forget([property_id])
+
+
+def forget(property_ids: Iterable[str]) -> None:
+    pids = list(property_ids)
+    if not pids:
+        return
+    with _lock:
+        dead = _ensure_loaded()
+        if not dead.intersection(pids):
+            return
+        with SessionLocal() as db:
+            db.execute(delete(Tombstone).where(Tombstone.property_id.in_(pids))); db.commit()
+        dead.difference_update(pids)
+
+
+def is_dead(property_id: str | None) -> bool:
+    if _dead is None:
+        with _lock:
+            _ensure_loaded()
+    return property_id in _dead
+
+
+def pending(limit: int) -> List[str]:
+    with _lock:
+        return list(islice(_ensure_loaded(), limit))
+
+
+def reset() -> None:
+    global _dead
+    with _lock:
+        with SessionLocal() as db:
+            db.execute(delete(Tombstone)); db.commit()
+        _dead = set()
@@ -1,44 +1,174 @@
 from __future__ import annotations
 from typing import Dict, Any, List
-import os, json, logging
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+import os, json, logging, re, threading, time
+from . import encoders
+from .scheduler import prioritized
 
 PERSIST_DIR = os.getenv("PERSIST_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..", "vectorstore_data")))
 COLLECTION = "properties"
 logging.getLogger(__name__).warning(f"[Chroma] PERSIST_DIR = {PERSIST_DIR}")
 
 
-_model = None
 _client = None
 _collection = None
 
 # --- add alongside your property helpers ---
 MSG_COLLECTION = "messages"
+# Ingest policy for conversation turns (see also retention.py)
+MSG_DEDUP_THRESHOLD = float(os.getenv("MSG_DEDUP_THRESHOLD", "0.95"))  # cosine similarity to merge into a previous turn
+# stop phrases (after lowercasing/punctuation removal) that are not embedded; MSG_STOP_PHRASES adds more
+TRIVIAL_MESSAGES = {
+    "ok", "oke", "okay", "okie", "yes", "no", "yep", "nope", "thanks", "thank you", "hi", "hello", "bye",
+    "vâng", "dạ", "ừ", "ờ", "uh", "có", "không", "ko", "k", "được", "đúng rồi", "cảm ơn", "cám ơn",
+    "chào", "xin chào", "alo", "hihi", "haha",
+    "ok ạ", "oke ạ", "vâng ạ", "dạ vâng", "dạ ạ", "ừm", "uhm", "cảm ơn bạn", "cảm ơn em", "cảm ơn ạ",
+    "thanks a lot", "ok thanks", "good", "tốt", "được rồi", "ok em",
+} | {p.strip().lower() for p in os.getenv("MSG_STOP_PHRASES", "").split(",") if p.strip()}
+RESCORE_FACTOR = int(os.getenv("REDUCED_RESCORE_FACTOR", "4"))   # reduced mode: candidates per wanted hit
+_RE_NON_WORD = re.compile(r"[^\w\s]+")
+_msg_coll = None
+# Reduced-dimension mode (reduced.py): present once `reduced refit` has run
+_msg_lock = threading.RLock()
+_msg_proj = None   # None: not looked up yet, False: full-size index
+_msg_cold = None
+_refit_dirty = None   # set of message ids written while reduced.refit() copies, else None
+COLD_COMPACT_RATIO = float(os.getenv("REDUCED_COLD_COMPACT_RATIO", "0.3"))
+
+def _projection_path() -> str:
+    return os.path.join(PERSIST_DIR, f"{MSG_COLLECTION}.pca.npz")
+
+def _projection():
+    # read once: only an in-process refit (_reset_msg_collection) switches this process's mode
+    global _msg_proj
+    if _msg_proj is None:
+        with _msg_lock:
+            if _msg_proj is None:
+                proj = None
+                if os.path.exists(_projection_path()):
+                    from .reduced import Projection
+                    proj = Projection.load(_projection_path())
+                _msg_proj = proj or False
+    return _msg_proj or None
+
+def _cold_store():
+    global _msg_cold
+    if _msg_cold is None:
+        from .reduced import ColdStore
+        _msg_cold = ColdStore(os.path.join(PERSIST_DIR, f"{MSG_COLLECTION}.cold"), get_model().get_sentence_embedding_dimension())
+    return _msg_cold
+
+def _reset_msg_collection() -> None:
+    global _msg_coll, _msg_proj
+    with _msg_lock:
+        _msg_coll = _msg_proj = None
 
 def _msg_collection():
-    global _client
-    client = _client or chromadb.Client(Settings(
-        is_persistent=True, persist_directory=PERSIST_DIR, anonymized_telemetry=False
-    ))
-    return client.get_or_create_collection(MSG_COLLECTION, metadata={"hnsw:space":"cosine"})
+    global _msg_coll
+    with _msg_lock:
+        if _msg_coll is None:
+            proj = _projection()
+            name = f"{MSG_COLLECTION}__r{proj.dim}" if proj is not None else MSG_COLLECTION
+            _msg_coll = get_client().get_or_create_collection(name, metadata={"hnsw:space":"cosine"})
+        return _msg_coll
+
+def _index_vectors(embs: list) -> list:
+    """Vectors as the messages index stores them (projected in reduced mode)."""
+    proj = _projection()
+    return embs if proj is None else proj.transform(embs).tolist()
+
+def upsert_messages(ids: list, embs: list, documents: list, metadatas: list) -> None:
+    """Write turns with their full embeddings; in reduced mode these go to the cold store."""
+    with _msg_lock:
+        if _refit_dirty is not None:
+            _refit_dirty.update(ids)
+        if _projection() is not None:
+            _cold_store().put(ids, embs)
+        _msg_collection().upsert(ids=ids, documents=documents, embeddings=_index_vectors(embs), metadatas=metadatas)
+
+def delete_messages(ids: list) -> None:
+    with _msg_lock:
+        if _refit_dirty is not None:
+            _refit_dirty.update(ids)
+        _msg_collection().delete(ids=ids)
+        if _projection() is not None:
+            _cold_store().delete(ids)
+
+def compact_cold_store(min_dead: float = COLD_COMPACT_RATIO) -> int:
+    """Drop deleted rows from the cold store once they are min_dead of it; returns rows dropped."""
+    with _msg_lock:
+        # not while a refit reads the cold store
+        if _refit_dirty is not None or _projection() is None or _cold_store().dead_fraction() < min_dead:
+            return 0
+        return _cold_store().compact()
+
+def full_vectors(ids: list, stored: list) -> list:
+    """Full-precision vectors of ids; `stored` are the index vectors returned by the collection."""
+    if _projection() is None:
+        return stored
+    cold = _cold_store().get(ids)
+    return [cold[i].tolist() if i in cold else v for i, v in zip(ids, stored)]
 
 def embed_text(text: str) -> list[float]:
     model = get_model()  # or _model_instance()
     return model.encode([text])[0].tolist()
 
-def add_message_embedding(msg_id: str, text: str, metadata: dict) -> None:
+def is_trivial_message(text: str) -> bool:
+    norm = " ".join(_RE_NON_WORD.sub(" ", (text or "").lower()).split())
+    # a stop-phrase list, not a length cutoff: "Q7" or "2PN" are real answers
+    return not norm or norm in TRIVIAL_MESSAGES
+
+def add_message_embedding(msg_id: str, text: str, metadata: dict) -> str:
+    """
+    Store one turn. Returns "skipped" for trivial turns, "merged" when the turn is a
+    near-duplicate of an earlier one in the same conversation (that turn's
+    repeat_count/ts are bumped instead), otherwise "stored".
+    """
+    if is_trivial_message(text):
+        return "skipped"
     coll = _msg_collection()
     emb = embed_text(text)
-    coll.upsert(ids=[msg_id], documents=[text], embeddings=[emb], metadatas=[metadata])
+    metadata = {**metadata, "ts": metadata.get("ts") or int(time.time() * 1000)}
+    conv = metadata.get("conversation_id")
+    if conv and MSG_DEDUP_THRESHOLD < 1.0:
+        where = {"$and": [{"conversation_id": conv}, {"role": metadata.get("role") or "user"}]}
+        try:
+            res = coll.query(query_embeddings=_index_vectors([emb]), n_results=1, where=where,
+                             include=["metadatas", "distances"])
+        except Exception:
+            res = {}
+        ids = (res.get("ids") or [[]])[0]
+        sim = 1.0 - float(res["distances"][0][0]) if ids else 0.0
+        if ids and _projection() is not None:
+            from .reduced import rescore
+            sim = rescore(emb, ids, _cold_store()).get(ids[0], sim)
+        if ids and sim >= MSG_DEDUP_THRESHOLD:
+            prev = dict(res["metadatas"][0][0] or {})
+            prev["repeat_count"] = int(prev.get("repeat_count") or 1) + 1
+            prev["ts"] = metadata["ts"]
+            with _msg_lock:
+                if _refit_dirty is not None:
+                    _refit_dirty.add(ids[0])
+                coll.update(ids=[ids[0]], metadatas=[prev])
+            return "merged"
+    upsert_messages([msg_id], [emb], [text], [metadata])
+    return "stored"
 
+@prioritized
 def search_messages(query: str, top_k: int = 5, filters: dict | None = None):
     coll = _msg_collection()
     q_emb = embed_text(query)
-    res = coll.query(query_embeddings=[q_emb], n_results=top_k*2, include=["ids","metadatas","distances"])
+    proj = _projection()
+    n = top_k * 2 * (1 if proj is None else RESCORE_FACTOR)
+    res = coll.query(query_embeddings=_index_vectors([q_emb]), n_results=n, include=["metadatas","distances"])
     items = []
     ids = res.get("ids", [[]])[0]; metas = res.get("metadatas", [[]])[0]; dists = res.get("distances", [[]])[0]
+    if proj is not None:
+        # candidates from the reduced index, ranked by the full vectors from the cold store
+        from .reduced import rescore
+        full = rescore(q_emb, ids, _cold_store())
+        sims = [full.get(mid, 1.0 - float(d)) for mid, d in zip(ids, dists)]
+        order = sorted(range(len(ids)), key=lambda i: sims[i], reverse=True)
+        ids = [ids[i] for i in order]; metas = [metas[i] for i in order]; dists = [1.0 - sims[i] for i in order]
     for i, mid in enumerate(ids):
         meta = metas[i] or {}
         if filters:
@@ -52,17 +182,25 @@ def search_messages(query: str, top_k: int = 5, filters: dict | None = None):
     return items
 
 def get_model():
-    global _model
-    if _model is None:
-        _model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-    return _model
+    # shared with every other user of the model (encoders.py), loaded once
+    return encoders.sentence_model(encoders.MESSAGE_MODEL)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        import chromadb
+        from chromadb.config import Settings
+        _client = chromadb.Client(Settings(
+            is_persistent=True, persist_directory=PERSIST_DIR, anonymized_telemetry=False
+        ))
+    return _client
 
 
 def get_collection():
-    global _client, _collection
+    global _collection
     if _collection is None:
-        _client = chromadb.Client(Settings(is_persistent=True, persist_directory=PERSIST_DIR))
-        _collection = _client.get_or_create_collection(COLLECTION, metadata={"hnsw:space":"cosine"})
+        _collection = get_client().get_or_create_collection(COLLECTION, metadata={"hnsw:space":"cosine"})
     return _collection
 
 
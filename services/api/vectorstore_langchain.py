@@ -1,44 +1,527 @@
 from __future__ import annotations
+import heapq
+import json
+import math
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
 from typing import List, Dict, Any, Tuple
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.schema import Document
 
+from . import cursors, encoders, facets, geo, preferences, shards, shared_chunks, similar, tombstones
+from .chunker import SHARED_SECTIONS
+from .scheduler import gate, prioritized
+from .wal import FlushPolicy, WriteAheadLog
+
 PERSIST_DIR = os.getenv("PERSIST_DIR", r"C:\REA\vectorstore_data")
 COLL_PROPERTIES = "properties"
-_embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-
-def _chroma() -> Chroma:
-    os.makedirs(PERSIST_DIR, exist_ok=True)
-    return Chroma(
-        collection_name=COLL_PROPERTIES,
-        embedding_function=_embeddings,
-        persist_directory=PERSIST_DIR,
-    )
-
-def inspect_collection(collection_name="real_estate_embeddings"):
-    vs = Chroma(
-        collection_name=collection_name,
-        persist_directory="C:/REA/vectorstore_data"  # đường dẫn bạn đang dùng
-    )
-
-    data = vs.get()
-    print(f"📦 Tổng số vectors: {len(data['ids'])}")
-    for i, (doc, meta) in enumerate(zip(data["documents"], data["metadatas"])):
-        print("="*80)
-        print(f"🧩 Chunk {i+1}: {meta.get('property_id')}::{meta.get('section')}::{meta.get('chunk_index')}")
-        print(f"📄 Nội dung:\n{doc}\n")
-        print(f"🧾 Metadata:\n{meta}\n")
-def upsert_property_docs(chunks: List[Document]) -> Tuple[int, int]:
-    vs = _chroma()
-    ids, texts, metas = [], [], []
-    pids = list({d.metadata.get("property_id") for d in chunks if d.metadata.get("property_id")})
+# coarse index: one pooled vector per property_id (two-stage search, see _shortlist)
+COLL_CENTROIDS = "property_centroids"
+COLL_SHARED = "property_shared_chunks"   # deduplicated boilerplate chunks, see shared_chunks.py
+TWO_STAGE_SEARCH = os.getenv("TWO_STAGE_SEARCH", "0") == "1"
+TWO_STAGE_SHORTLIST = int(os.getenv("TWO_STAGE_SHORTLIST", "50"))
+# radius filters matching more properties than this are not pushed down as a property_id list
+RADIUS_MAX_IN = int(os.getenv("RADIUS_MAX_IN", "500"))
+# SHARD_BY_LOCATION=1: one collection per normalized district/city (see shards.py).
+# Switching it on for an existing store requires re-ingesting the catalog.
+SHARD_BY_LOCATION = os.getenv("SHARD_BY_LOCATION", "0") == "1"
+_fanout = ThreadPoolExecutor(max_workers=int(os.getenv("SHARD_FANOUT_WORKERS", "8")), thread_name_prefix="shard-query")
+# serializes writers (upsert, tombstone, compaction, rebuild); readers never take it
+_write_lock = threading.RLock()
+# Chroma (>= 0.4) commits every write to its own sqlite log before returning, so the
+# store needs no flush of ours (Chroma.persist() is a no-op). properties.wal is a change
+# feed: snapshot export and rebuild_index() replay the writes made while they copy.
+# PERSIST_POLICY = always | every_n | interval | shutdown only sets how often it is
+# truncated; WAL_FSYNC / WAL_RECOVER=1 turn it into a redo log for stores without one.
+PERSIST_POLICY = os.getenv("PERSIST_POLICY", "every_n")
+PERSIST_EVERY_N = int(os.getenv("PERSIST_EVERY_N", "1000"))
+PERSIST_INTERVAL_MS = int(os.getenv("PERSIST_INTERVAL_MS", "200"))
+WAL_FSYNC = os.getenv("WAL_FSYNC", "0") == "1"
+WAL_RECOVER = os.getenv("WAL_RECOVER", "0") == "1"
+_wal: WriteAheadLog | None = None
+_flush_policy: FlushPolicy | None = None
+# held only while the collection is created/looked up or swapped by rebuild_index()
+_swap_lock = threading.Lock()
+# collections swapped out by rebuild_index() -> when; in-flight searches may still read them
+_retired: Dict[str, float] = {}
+REBUILD_RETIRE_GRACE_S = float(os.getenv("REBUILD_RETIRE_GRACE_S", "60"))
+# chunks per encoder call for background ingest (see scheduler.py)
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "16"))
+EMBED_MODEL = encoders.PROPERTY_MODEL
+# loaded on first use / by the startup warm-up, not at import (see encoders.py)
+_embeddings = encoders.LazyEmbeddings(EMBED_MODEL)
+_stores: Dict[str, Chroma] = {}
+
+def chunk_budget() -> Tuple[Any, int]:
+    """Tokenizer of EMBED_MODEL and how many tokens of an input it actually encodes."""
+    st = _embeddings.client
+    return st.tokenizer, int(st.max_seq_length) - 2  # [CLS] + [SEP]
+
+def _chroma(collection_name: str = COLL_PROPERTIES) -> Chroma:
+    with _swap_lock:
+        store = _stores.get(collection_name)
+        if store is None:
+            os.makedirs(PERSIST_DIR, exist_ok=True)
+            store = _stores[collection_name] = Chroma(
+                collection_name=collection_name,
+                embedding_function=_embeddings,
+                persist_directory=PERSIST_DIR,
+            )
+        return store
+
+def _forget_stores() -> None:
+    """Drop cached wrappers after collections were deleted/recreated (rebuild, snapshot import)."""
+    with _swap_lock:
+        _stores.clear()
+
+def inspect_collection(collection_name="real_estate_embeddings", batch: int = 200):
+    # in pages of `batch` chunks, so large collections are not loaded at once
+    coll = _chroma(collection_name)._collection
+    print(f"📦 Tổng số vectors: {coll.count()}")
+    offset = 0
+    while True:
+        data = coll.get(limit=batch, offset=offset, include=["documents", "metadatas"])
+        for i, (doc, meta) in enumerate(zip(data["documents"], data["metadatas"]), start=offset):
+            print("="*80)
+            print(f"🧩 Chunk {i+1}: {meta.get('property_id')}::{meta.get('section')}::{meta.get('chunk_index')}")
+            print(f"📄 Nội dung:\n{doc}\n")
+            print(f"🧾 Metadata:\n{meta}\n")
+        if len(data["ids"]) < batch:
+            break
+        offset += batch
+def _shard_place(location: Any) -> str | None:
+    ids = geo.hierarchy(geo.resolve(location))
+    return ids.get("district_id") or ids.get("city_id")
+
+def _collection_for(location: Any) -> str:
+    if not SHARD_BY_LOCATION:
+        return COLL_PROPERTIES
+    place = _shard_place(location)
+    return shards.collection_name(COLL_PROPERTIES, shards.place_key(place) if place else location)
+
+def _all_collections() -> List[str]:
+    if not SHARD_BY_LOCATION:
+        return [COLL_PROPERTIES]
+    return shards.known(_chroma()._client, COLL_PROPERTIES)
+
+def _collections_holding(property_id: str) -> List[str]:
+    """Collections that may contain chunks of property_id."""
+    if not SHARD_BY_LOCATION:
+        return [COLL_PROPERTIES]
+    row = facets.get(property_id)
+    if row is not None:
+        # plus the text-keyed partition it may have been written to before gazetteer ids
+        legacy = shards.collection_name(COLL_PROPERTIES, row["location"])
+        current = _collection_for(row["location"])
+        return [current] + ([legacy] if legacy != current and legacy in _all_collections() else [])
+    # deleted (not compacted yet) or never seen: only a full sweep is safe
+    return _all_collections() if tombstones.is_dead(property_id) else []
+
+def _route(filters: Dict[str, Any]) -> List[str]:
+    names = _all_collections()
+    place = geo.PLACES.get(filters.get("location_id") or "")
+    # unresolved text or a radius: only the post-filter can tell, query every partition
+    if not SHARD_BY_LOCATION or place is None or filters.get("radius_km") is not None:
+        return names
+    if place["level"] == "ward":
+        places = [place["parent"]]
+    elif place["level"] == "city":
+        # city-only listings live in the city partition, the rest in their district's
+        places = [place["id"]] + [p["id"] for p in geo.PLACES.values() if p.get("parent") == place["id"]]
+    else:
+        places = [place["id"]]
+    return shards.route(names, COLL_PROPERTIES, {shards.place_key(p) for p in places if p})
+
+def _query(embedding: List[float], k: int, filters: Dict[str, Any],
+           pids: List[str] | None = None) -> List[Tuple[Document, float]]:
+    """Top-k (doc, distance) over the partitions relevant to filters, in ascending distance."""
+    where = _hard_where(filters) or None
+    if pids is not None:
+        # stage 2 of a two-stage search: only chunks of the shortlisted properties
+        only = {"property_id": pids[0]} if len(pids) == 1 else {"property_id": {"$in": pids}}
+        where = {"$and": [where, only]} if where else only
+
+    def one(name: str) -> List[Tuple[Document, float]]:
+        return _chroma(name).similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=where)
+
+    names = _route(filters)
+    shared = _query_shared([embedding], [filters], k, pids)[0]
+    if len(names) == 1 and not shared:
+        return one(names[0])
+    parts = list(_fanout.map(one, names)) + [shared]
+    # each partition is already sorted by distance: k-way merge
+    return list(islice(heapq.merge(*parts, key=lambda t: t[1]), k))
+
+_FILTER_KEYS = ("location", "location_id", "property_type", "bedrooms", "budget_min", "budget_max", "radius_km")
+
+def _shared_hashes(filters: Dict[str, Any], pids: List[str] | None) -> List[str] | None:
+    """Hashes owned by units that pass the filters (and are in pids); None = no restriction."""
+    if not any(filters.get(key) is not None for key in _FILTER_KEYS):
+        return None if pids is None else shared_chunks.hashes_of(pids)
+    within = None if pids is None else set(pids)
+    return sorted({h for h, meta in shared_chunks.all_owners()
+                   if (within is None or meta.get("property_id") in within) and _match(meta, filters)})
+
+def _query_shared(embeddings: List[List[float]], filters_list: List[Dict[str, Any]], k: int,
+                  pids: List[str] | None = None) -> List[List[Tuple[Document, float]]]:
+    """
+    Top-k shared chunks per query embedding, expanded to one (doc, distance) per
+    owning unit with that unit's metadata, so _match/_hit treat them like its own chunks.
+    The shared chunks carry no unit metadata for the store to filter on: the query is
+    restricted to the hashes of filter-matching owners instead (see _shared_hashes),
+    so other projects' boilerplate cannot take the k slots, and non-matching owners of
+    a returned chunk are dropped before the merge.
+    """
+    out: List[List[Tuple[Document, float]]] = [[] for _ in embeddings]
+    coll = _chroma(COLL_SHARED)._collection
+    if not coll.count():
+        return out
+    by_where: Dict[str, List[int]] = {}
+    wheres: Dict[str, Dict[str, Any] | None] = {}
+    for i, filters in enumerate(filters_list):
+        hashes = _shared_hashes(filters, pids)
+        if hashes == []:
+            continue
+        where = None if hashes is None else \
+            {"content_hash": hashes[0]} if len(hashes) == 1 else {"content_hash": {"$in": hashes}}
+        key = json.dumps(where, sort_keys=True)
+        wheres[key] = where
+        by_where.setdefault(key, []).append(i)
+    for key, idx in by_where.items():
+        res = coll.query(query_embeddings=[embeddings[i] for i in idx], n_results=k, where=wheres[key],
+                         include=["documents", "metadatas", "distances"])
+        owners = shared_chunks.owners({m["content_hash"] for ms in res["metadatas"] for m in ms if m}, pids)
+        for i, docs, metas, dists in zip(idx, res["documents"], res["metadatas"], res["distances"]):
+            out[i] = [(Document(page_content=doc or "", metadata=meta), dist)
+                      for doc, m, dist in zip(docs, metas, dists) if m
+                      for meta in owners.get(m["content_hash"], ()) if _match(meta, filters_list[i])][:k]
+    return out
+
+def get_property_chunks(property_id: str, limit: int | None = None, offset: int = 0) -> Dict[str, List[Any]]:
+    out: Dict[str, List[Any]] = {"ids": [], "documents": [], "metadatas": []}
+    for name in _collections_holding(property_id):
+        if limit is not None and len(out["ids"]) >= limit:
+            break
+        coll = _chroma(name)._collection
+        where = {"property_id": property_id}
+        if offset:
+            # skip whole collections without loading their chunks
+            n = len(coll.get(where=where, include=[])["ids"])
+            if n <= offset:
+                offset -= n
+                continue
+        want = None if limit is None else limit - len(out["ids"])
+        data = coll.get(where=where, limit=want, offset=offset or None, include=["documents", "metadatas"])
+        offset = 0
+        for key in out:
+            out[key].extend(data[key])
+    if limit is None or len(out["ids"]) < limit:
+        hashes = shared_chunks.hashes_of([property_id])[offset:]
+        if limit is not None:
+            hashes = hashes[:limit - len(out["ids"])]
+        if hashes:
+            metas = shared_chunks.owners(hashes, [property_id])
+            data = _chroma(COLL_SHARED)._collection.get(ids=[shared_chunks.chunk_id(h) for h in hashes],
+                                                        include=["documents", "metadatas"])
+            for id_, doc, m in zip(data["ids"], data["documents"], data["metadatas"]):
+                for meta in metas.get((m or {}).get("content_hash"), ()):
+                    out["ids"].append(id_); out["documents"].append(doc); out["metadatas"].append(meta)
+    return out
+
+def _centroids():
+    return _chroma()._client.get_or_create_collection(COLL_CENTROIDS, metadata={"hnsw:space": "cosine"})
+
+def _pool(vectors: List[List[float]]) -> List[float]:
+    """Mean of the L2-normalized vectors, normalized again."""
+    acc = [0.0] * len(vectors[0])
+    for v in vectors:
+        norm = math.sqrt(sum(x * x for x in v)) or 1.0
+        for i, x in enumerate(v):
+            acc[i] += x / norm
+    norm = math.sqrt(sum(x * x for x in acc)) or 1.0
+    return [x / norm for x in acc]
+
+_CENTROID_META = ("property_id", "unitId", "location", "property_type", "bedrooms", "price",
+                  "city_id", "district_id", "ward_id", "lat", "lon")
+
+def _centroid_rows(groups: Dict[str, Tuple[Dict[str, Any], List[List[float]]]]):
+    ids, vecs, metas = [], [], []
+    for pid, (meta, vectors) in groups.items():
+        ids.append(pid)
+        vecs.append(_pool(vectors))
+        metas.append({**{k: meta[k] for k in _CENTROID_META if meta.get(k) is not None}, "n_chunks": len(vectors)})
+    return ids, vecs, metas
+
+def _update_centroids(metas: List[Dict[str, Any]], embeddings: List[List[float]]) -> None:
+    # an upsert carries every chunk of its properties, so the centroid is recomputed from scratch
+    groups: Dict[str, Tuple[Dict[str, Any], List[List[float]]]] = {}
+    for m, e in zip(metas, embeddings):
+        if m.get("property_id"):
+            groups.setdefault(m["property_id"], (m, []))[1].append(e)
+    if groups:
+        ids, vecs, cmetas = _centroid_rows(groups)
+        _centroids().upsert(ids=ids, embeddings=vecs, metadatas=cmetas)
+
+def rebuild_centroids(batch_size: int = 1000) -> int:
+    """Recompute the centroid index from the chunk collections (backfill, after snapshot import)."""
+    with _write_lock:
+        client = _chroma()._client
+        try: client.delete_collection(COLL_CENTROIDS)
+        except: pass
+        groups: Dict[str, Tuple[Dict[str, Any], List[List[float]]]] = {}
+        for name in _all_collections():
+            coll = _chroma(name)._collection
+            offset = 0
+            while True:
+                page = coll.get(limit=batch_size, offset=offset, include=["embeddings", "metadatas"])
+                if not page["ids"]:
+                    break
+                for m, e in zip(page["metadatas"], page["embeddings"]):
+                    pid = (m or {}).get("property_id")
+                    if pid and not tombstones.is_dead(pid):
+                        groups.setdefault(pid, (m, []))[1].append(list(e))
+                offset += len(page["ids"])
+        # a shared chunk is part of every owner's centroid
+        coll = _chroma(COLL_SHARED)._collection
+        offset = 0
+        while True:
+            page = coll.get(limit=batch_size, offset=offset, include=["embeddings", "metadatas"])
+            if not page["ids"]:
+                break
+            owners = shared_chunks.owners(m["content_hash"] for m in page["metadatas"])
+            for m, e in zip(page["metadatas"], page["embeddings"]):
+                for meta in owners.get(m["content_hash"], ()):
+                    if not tombstones.is_dead(meta["property_id"]):
+                        groups.setdefault(meta["property_id"], (meta, []))[1].append(list(e))
+            offset += len(page["ids"])
+        ids, vecs, metas = _centroid_rows(groups)
+        coll = _centroids()
+        for i in range(0, len(ids), batch_size):
+            coll.upsert(ids=ids[i:i + batch_size], embeddings=vecs[i:i + batch_size], metadatas=metas[i:i + batch_size])
+    similar.enqueue(ids)
+    return len(ids)
+
+def _shortlist(embedding: List[float], filters: Dict[str, Any], n: int,
+               within: List[str] | None = None) -> List[str] | None:
+    """Stage 1: nearest property centroids passing the filters; None when there is no centroid index."""
+    coll = _centroids()
+    if not coll.count():
+        return None
+    where = _hard_where(filters) or None
+    if within is not None:
+        only = {"property_id": within[0]} if len(within) == 1 else {"property_id": {"$in": within}}
+        where = {"$and": [where, only]} if where else only
+    res = coll.query(query_embeddings=[embedding], n_results=n, where=where, include=["metadatas"])
+    return [m["property_id"] for m in res["metadatas"][0] if _match(m, filters)]
+
+def _resolve_location(filters: Dict[str, Any]) -> Dict[str, Any]:
+    """Free-text location -> gazetteer id, so "Q7" and "District 7" filter like "Quận 7"."""
+    if filters.get("location") and not filters.get("location_id"):
+        place_id = geo.resolve(filters["location"])
+        if place_id:
+            return {**filters, "location_id": place_id}
+    return filters
+
+def _candidates(embedding: List[float], filters: Dict[str, Any], n: int, two_stage: bool) -> List[str] | None:
+    """
+    Property ids the chunk query is restricted to, resolved before it runs: the
+    radius filter (geohash grid) and/or the two-stage centroid shortlist.
+    None = unrestricted, [] = nothing can match.
+    """
+    pids = geo.radius_candidates(filters)
+    if pids == []:
+        return []
+    if pids is not None and len(pids) > RADIUS_MAX_IN:
+        # too many ids for a `$in` (SQLite variable limit, slow metadata scan): _match post-filters by distance
+        pids = None
+    if two_stage:
+        short = _shortlist(embedding, filters, max(TWO_STAGE_SHORTLIST, n), pids)
+        if short is not None:
+            return short
+    return pids
+
+_LOCATIONS_MARKER = os.path.join(PERSIST_DIR, "locations_backfilled")
+_locations_ready: bool | None = None
+
+def locations_ready() -> bool:
+    """True once every stored chunk carries gazetteer ids (backfill done), so location ids can go into `where`."""
+    global _locations_ready
+    if _locations_ready is None:
+        _locations_ready = os.path.exists(_LOCATIONS_MARKER)
+    return _locations_ready
+
+def backfill_locations(batch_size: int = 500) -> int:
+    """
+    Add gazetteer ids/coordinates to chunks (and centroids) ingested before they
+    existed; returns chunks updated. Run at startup until it has completed once.
+    """
+    global _locations_ready
+    updated = 0
+    located: Dict[str, Dict[str, Any]] = {}
+    with _write_lock:
+        for name in _all_collections():
+            coll = _chroma(name)._collection
+            offset = 0
+            while True:
+                page = coll.get(limit=batch_size, offset=offset, include=["metadatas"])
+                if not page["ids"]:
+                    break
+                ids, metas = [], []
+                for id_, m in zip(page["ids"], page["metadatas"]):
+                    m = m or {}
+                    if "city_id" in m or not m.get("location"):
+                        continue
+                    loc = geo.locate({}, m["location"])
+                    if loc:
+                        ids.append(id_); metas.append({**m, **loc})
+                if ids:
+                    coll.update(ids=ids, metadatas=metas)
+                    for pid, m in {m["property_id"]: m for m in metas}.items():
+                        geo.record(pid, m)
+                        located[pid] = m
+                    updated += len(ids)
+                offset += len(page["ids"])
+        pids = list(located)
+        cents = _centroids()
+        for i in range(0, len(pids), batch_size):
+            got = cents.get(ids=pids[i:i + batch_size], include=["metadatas"])
+            if got["ids"]:
+                cents.update(ids=got["ids"], metadatas=[
+                    {**(m or {}), **{k: located[id_][k] for k in _CENTROID_META if located[id_].get(k) is not None}}
+                    for id_, m in zip(got["ids"], got["metadatas"])])
+        os.makedirs(PERSIST_DIR, exist_ok=True)
+        with open(_LOCATIONS_MARKER, "w", encoding="utf-8") as f:
+            f.write(str(updated))
+        _locations_ready = True
+    return updated
+
+_FACETS_MARKER = os.path.join(PERSIST_DIR, "facets_backfilled")
+
+def facets_ready() -> bool:
+    return os.path.exists(_FACETS_MARKER)
+
+def backfill_facets(batch_size: int = 1000) -> int:
+    """
+    Facet rows for properties stored before facets.py recorded them on upsert;
+    returns properties added. Run at startup until it has completed once.
+    """
+    added = 0
+    with _write_lock:
+        have = facets.known()
+        for name in _all_collections():
+            coll = _chroma(name)._collection
+            offset = 0
+            while True:
+                page = coll.get(limit=batch_size, offset=offset, include=["metadatas"])
+                if not page["ids"]:
+                    break
+                for m in page["metadatas"]:
+                    pid = (m or {}).get("property_id")
+                    if pid and pid not in have and not tombstones.is_dead(pid):
+                        facets.record(pid, m)
+                        have.add(pid); added += 1
+                offset += len(page["ids"])
+        os.makedirs(PERSIST_DIR, exist_ok=True)
+        with open(_FACETS_MARKER, "w", encoding="utf-8") as f:
+            f.write(str(added))
+    return added
+
+def _durability() -> Tuple[WriteAheadLog, FlushPolicy]:
+    global _wal, _flush_policy
+    with _write_lock:
+        if _wal is None:
+            os.makedirs(PERSIST_DIR, exist_ok=True)
+            _wal = WriteAheadLog(os.path.join(PERSIST_DIR, "properties.wal"), fsync=WAL_FSYNC)
+            _flush_policy = FlushPolicy(_flush_store, PERSIST_POLICY, PERSIST_EVERY_N, PERSIST_INTERVAL_MS)
+        return _wal, _flush_policy
+
+def _flush_store() -> None:
+    # the store is already durable (see PERSIST_POLICY): only drop the applied log
+    with _write_lock:
+        _wal.checkpoint()
+
+def _apply_upsert(ids: List[str], texts: List[str], metas: List[Dict[str, Any]],
+                  embeddings: List[List[float]], pids: List[str]) -> None:
     # xóa cũ theo property_id để "update"
-    if pids:
-        for pid in pids:
-            try: vs._collection.delete(where={"property_id": pid})
+    for pid in pids:
+        for name in _collections_holding(pid):
+            try: _chroma(name)._collection.delete(where={"property_id": pid})
             except: pass
+    by_coll: Dict[str, List[int]] = {}
+    for i, m in enumerate(metas):
+        if not m.get("content_hash"):
+            by_coll.setdefault(_collection_for(m.get("location")), []).append(i)
+    _apply_shared(texts, metas, embeddings, pids)
+    for name, idx in by_coll.items():
+        _chroma(name)._collection.upsert(
+            ids=[ids[i] for i in idx], embeddings=[embeddings[i] for i in idx],
+            metadatas=[metas[i] for i in idx], documents=[texts[i] for i in idx])
+        shards.register(name)
+    # metadata is property-level, so any chunk of the property carries it
+    first_meta = {}
+    for m in metas:
+        first_meta.setdefault(m.get("property_id"), m)
+    for pid in pids:
+        tombstones.discard(pid)
+        if pid in first_meta:
+            facets.record(pid, first_meta[pid])
+            geo.record(pid, first_meta[pid])
+    _update_centroids(metas, embeddings)
+    similar.mark_changed(pids)
+
+def _apply_shared(texts: List[str], metas: List[Dict[str, Any]],
+                  embeddings: List[List[float]], pids: List[str]) -> None:
+    # store each new hash once, point its owners at it, drop hashes nobody owns any more
+    first: Dict[str, int] = {}
+    for i, m in enumerate(metas):
+        if m.get("content_hash"):
+            first.setdefault(m["content_hash"], i)
+    coll = _chroma(COLL_SHARED)._collection
+    if first:
+        have = set(coll.get(ids=[shared_chunks.chunk_id(h) for h in first], include=[])["ids"])
+        new = [(h, i) for h, i in first.items() if shared_chunks.chunk_id(h) not in have]
+        if new:
+            coll.upsert(ids=[shared_chunks.chunk_id(h) for h, _ in new],
+                        embeddings=[embeddings[i] for _, i in new],
+                        documents=[texts[i] for _, i in new],
+                        metadatas=[{"content_hash": h, "section": metas[i].get("section") or "misc"} for h, i in new])
+    orphans = shared_chunks.replace(pids, [(m["content_hash"], m) for m in metas if m.get("content_hash")])
+    if orphans:
+        coll.delete(ids=[shared_chunks.chunk_id(h) for h in orphans])
+
+def _apply_delete(property_id: str) -> None:
+    tombstones.add(property_id)
+    facets.remove(property_id)
+    geo.remove(property_id)
+    # the centroid is tiny: drop it right away instead of waiting for the compactor
+    try: _centroids().delete(ids=[property_id])
+    except: pass
+    similar.mark_deleted(property_id)
+
+def _embed_background(texts: List[str]) -> List[List[float]]:
+    # one small batch per gate section so searches overtake a large ingest quickly
+    out: List[List[float]] = []
+    for i in range(0, len(texts), INGEST_EMBED_BATCH):
+        with gate.background():
+            out.extend(_embeddings.embed_documents(texts[i:i + INGEST_EMBED_BATCH]))
+    return out
+
+def _shared_vectors(hashes: set) -> Dict[str, List[float]]:
+    if not hashes:
+        return {}
+    got = _chroma(COLL_SHARED)._collection.get(ids=[shared_chunks.chunk_id(h) for h in hashes],
+                                               include=["embeddings", "metadatas"])
+    return {m["content_hash"]: list(e) for m, e in zip(got["metadatas"], got["embeddings"])}
+
+def upsert_property_docs(chunks: List[Document], background: bool = False) -> Tuple[int, int]:
+    """background=True: yield the encoder and the store to interactive work (ingest jobs)."""
+    wal, policy = _durability()
+    ids, texts, metas = [], [], []
+    pids = list({d.metadata.get("property_id") for d in chunks if d.metadata.get("property_id")})
     for d in chunks:
         pid = d.metadata.get("property_id") or "UNKNOWN"
         sec = d.metadata.get("section") or "misc"
@@ -46,57 +529,461 @@ def upsert_property_docs(chunks: List[Document]) -> Tuple[int, int]:
         ids.append(f"{pid}::{sec}::{idx}")
         texts.append(d.page_content)
         metas.append(d.metadata)
-    vs.add_texts(texts=texts, metadatas=metas, ids=ids)
-    vs.persist()
+    # boilerplate sections: one vector per distinct text, reused if already stored
+    shared_at: Dict[int, str] = {}
+    if shared_chunks.DEDUP_SHARED_CHUNKS:
+        for i, m in enumerate(metas):
+            if m.get("section") in SHARED_SECTIONS:
+                m["content_hash"] = shared_at[i] = shared_chunks.content_hash(m["section"], texts[i])
+    known = _shared_vectors(set(shared_at.values()))
+    todo: List[int] = []
+    first: Dict[str, int] = {}
+    for i in range(len(texts)):
+        h = shared_at.get(i)
+        if h is None or (h not in known and first.setdefault(h, i) == i):
+            todo.append(i)
+    # encode outside the write lock so concurrent upserts only serialize on the store writes
+    todo_texts = [texts[i] for i in todo]
+    if background:
+        encoded = _embed_background(todo_texts)
+    else:
+        encoded = _embeddings.embed_documents(todo_texts) if todo_texts else []
+    embeddings: List[List[float]] = [[] for _ in texts]
+    for i, vec in zip(todo, encoded):
+        embeddings[i] = vec
+    for i, h in shared_at.items():
+        embeddings[i] = known[h] if h in known else embeddings[first[h]]
+    with (gate.background() if background else nullcontext()), _write_lock:
+        seq = wal.append({"op": "upsert", "ids": ids, "texts": texts, "metas": metas, "pids": pids})
+        _apply_upsert(ids, texts, metas, embeddings, pids)
+    wal.sync(seq)  # fsync only with WAL_FSYNC=1
+    policy.note_write()
     return len(ids), len(pids)
 
 def delete_property(property_id: str) -> int:
-    vs = _chroma()
+    # Logical delete: searches drop the property immediately, compactor.py removes its chunks later
     try:
-        vs._collection.delete(where={"id": property_id})
-        vs.persist()
+        wal, policy = _durability()
+        with _write_lock:
+            seq = wal.append({"op": "delete", "property_id": property_id})
+            _apply_delete(property_id)
+        wal.sync(seq)
+        policy.note_write()
         return 1
     except:
         return 0
 
-def search_properties(query: str, filters: Dict[str, Any], top_k: int = 5):
-    vs = _chroma()
-    hard_where: Dict[str, Any] = {}
-    if filters.get("property_type"):
-        hard_where["property_type"] = str(filters["property_type"]).lower()
+def recover() -> int:
+    """
+    WAL_RECOVER=1: re-apply WAL records that may not have reached the store; returns
+    records replayed. Otherwise the records are already in Chroma and are just dropped.
+    """
+    wal, policy = _durability()
+    n = 0
+    with _write_lock:
+        if not WAL_RECOVER:
+            _flush_store()
+            return 0
+        for rec in wal.records():
+            if rec.get("op") == "upsert":
+                embeddings = _embeddings.embed_documents(rec["texts"]) if rec["texts"] else []
+                _apply_upsert(rec["ids"], rec["texts"], rec["metas"], embeddings, rec["pids"])
+            elif rec.get("op") == "delete":
+                _apply_delete(rec["property_id"])
+            n += 1
+        if n:
+            _flush_store()
+    return n
 
-    docs_scores = vs.similarity_search_with_score(query, k=top_k * 5, filter=hard_where or None)
+def close_store() -> None:
+    """Flush according to the "shutdown" point of every policy and close the WAL."""
+    if _wal is not None:
+        _flush_policy.close()
+        _wal.close()
 
-    print(f"search_properties: query={query}, filters={filters}, found={len(docs_scores)}")
-    print(f"  hard_where={hard_where}")
-    print(f"  docs_scores[0:3]={docs_scores[0:3]}")
-    out = []
+def compact_batch(batch_size: int) -> Tuple[int, Dict[str, int]]:
+    """
+    Physically remove the chunks of up to batch_size tombstoned properties.
+    Returns (properties, {collection: chunks removed}).
+    """
+    removed: Dict[str, int] = {}
+    with _write_lock:
+        pids = tombstones.pending(batch_size)
+        if not pids:
+            return 0, removed
+        where = {"property_id": pids[0]} if len(pids) == 1 else {"property_id": {"$in": pids}}
+        for name in _all_collections():
+            coll = _chroma(name)._collection
+            ids = coll.get(where=where, include=[])["ids"]
+            if ids:
+                coll.delete(ids=ids)
+                removed[name] = len(ids)
+        orphans = shared_chunks.drop(pids)
+        if orphans:
+            _chroma(COLL_SHARED)._collection.delete(ids=[shared_chunks.chunk_id(h) for h in orphans])
+            removed[COLL_SHARED] = len(orphans)
+        tombstones.forget(pids)
+    return len(pids), removed
+
+def rebuild_index(collection_name: str = COLL_PROPERTIES, batch_size: int = 1000) -> int:
+    """
+    Copy the live chunks of one collection (or partition) into a fresh collection
+    and swap it in, which drops the deleted-but-still-linked nodes the HNSW index
+    accumulates. Writers are not blocked by the copy: the WAL is pinned, and the
+    properties written meanwhile are copied again under the write lock right before
+    the swap. The old collection is renamed aside, not deleted, until the new one
+    has its name (see drop_retired). Returns chunks copied.
+    """
+    drop_retired()
+    wal, _ = _durability()
+    vs = _chroma(collection_name)
+    client = vs._client
+    old = vs._collection
+    tmp_name, retired_name = f"{collection_name}-rebuild", f"{collection_name}-retired"
+    for name in (tmp_name, retired_name):
+        try: client.delete_collection(name)
+        except: pass
+    new = client.create_collection(tmp_name, metadata=old.metadata)
+
+    def copy(page: Dict[str, Any]) -> int:
+        if page["ids"]:
+            new.upsert(ids=page["ids"], embeddings=page["embeddings"],
+                       documents=page["documents"], metadatas=page["metadatas"])
+        return len(page["ids"])
+
+    include = ["embeddings", "documents", "metadatas"]
+    with _write_lock:
+        start = wal.pin()
+        ids = old.get(include=[])["ids"]
+    try:
+        for i in range(0, len(ids), batch_size):
+            copy(old.get(ids=ids[i:i + batch_size], include=include))
+        with _write_lock:
+            # chunks added or removed meanwhile (shared chunks are content-addressed: ids suffice) ...
+            live, have = set(old.get(include=[])["ids"]), set(new.get(include=[])["ids"])
+            if have - live:
+                new.delete(ids=sorted(have - live))
+            added = sorted(live - have)
+            for i in range(0, len(added), batch_size):
+                copy(old.get(ids=added[i:i + batch_size], include=include))
+            # ... and every property re-written meanwhile, whose chunks keep their ids
+            touched = set()
+            for rec in wal.records(start, wal.tell()):
+                touched.update(rec.get("pids") or ())
+            touched = sorted(touched) if collection_name != COLL_SHARED else []
+            for i in range(0, len(touched), batch_size):
+                chunk = touched[i:i + batch_size]
+                where = {"property_id": chunk[0]} if len(chunk) == 1 else {"property_id": {"$in": chunk}}
+                stale = new.get(where=where, include=[])["ids"]
+                if stale:
+                    new.delete(ids=stale)
+                copy(old.get(where=where, include=include))
+            copied = new.count()
+            with _swap_lock:
+                old.modify(name=retired_name)
+                try:
+                    new.modify(name=collection_name)
+                except Exception:
+                    old.modify(name=collection_name)
+                    raise
+                _stores.pop(collection_name, None)
+                _retired[retired_name] = time.time()
+    finally:
+        wal.unpin()
+    return copied
+
+def drop_retired() -> List[str]:
+    """Delete collections swapped out by rebuild_index() REBUILD_RETIRE_GRACE_S ago; searches that still held them are done."""
+    now = time.time()
+    with _swap_lock:
+        due = [name for name, ts in _retired.items() if now - ts >= REBUILD_RETIRE_GRACE_S]
+        for name in due:
+            _retired.pop(name, None)
+    client = _chroma()._client
+    for name in due:
+        try: client.delete_collection(name)
+        except: pass
+    return due
+
+def partition_stats() -> Dict[str, int]:
+    out = {name: _chroma(name)._collection.count() for name in _all_collections()}
+    shared = _chroma(COLL_SHARED)._collection.count()
+    if shared:
+        out[COLL_SHARED] = shared
+    return out
+
+# Per-section weights for group_score="weighted" (sections not listed do not count)
+SECTION_WEIGHTS: Dict[str, float] = {
+    "description": 1.0,
+    "design_and_layout": 1.0,
+    "physical_features": 0.8,
+    "living_experience": 0.6,
+    "equipment_and_handover_materials": 0.5,
+    "legal_and_product_status": 0.5,
+    "property_groups": 0.4,
+    "misc": 0.2,
+}
+GROUP_MAX_FETCH = int(os.getenv("GROUP_MAX_FETCH", "400"))
+
+def _hard_where(filters: Dict[str, Any]) -> Dict[str, Any]:
+    """Chroma `where` for the filters the store can evaluate; _match() still re-checks every hit."""
+    conds: List[Dict[str, Any]] = []
+    key = geo.level_key(filters.get("location_id") or "")
+    # before the backfill, chunks without ids would be dropped by the store: leave it to _match
+    if key and filters.get("radius_km") is None and locations_ready():
+        # hierarchical: a city id matches every district/ward under it
+        conds.append({key: filters["location_id"]})
+    if filters.get("property_type"):
+        conds.append({"property_type": str(filters["property_type"]).lower()})
+    try:
+        if filters.get("bedrooms") is not None and float(filters["bedrooms"]) > 0:
+            conds.append({"bedrooms": {"$gte": float(filters["bedrooms"]) - 1e-6}})
+        if filters.get("budget_max") is not None:
+            conds.append({"price": {"$lte": float(filters["budget_max"]) + 1e-6}})
+        if filters.get("budget_min") is not None:
+            conds.append({"price": {"$gte": float(filters["budget_min"]) - 1e-6}})
+    except (TypeError, ValueError):
+        pass
+    if not conds:
+        return {}
+    return conds[0] if len(conds) == 1 else {"$and": conds}
+
+def _match(m: Dict[str, Any], filters: Dict[str, Any]) -> bool:
     q_loc = str(filters.get("location") or "").lower()
     q_type = str(filters.get("property_type") or "").lower()
     q_bed = filters.get("bedrooms")
     q_budget = filters.get("budget_max")
+    q_budget_min = filters.get("budget_min")
+    if tombstones.is_dead(m.get("property_id")):
+        return False
+    ok = True
+    if q_type:
+        ok &= str(m.get("property_type","")).lower() == q_type
+    loc_key = geo.level_key(filters.get("location_id") or "")
+    # a radius without a resolvable centre falls back to the place match below
+    radius = geo.radius_center(filters)
+    if radius is not None:
+        ok &= geo.near(m.get("property_id"), *radius)
+    elif loc_key and any(k in m for k in ("city_id", "district_id", "ward_id")):
+        ok &= m.get(loc_key) == filters["location_id"]
+    elif q_loc:
+        ok &= q_loc in str(m.get("location","")).lower()
+    if q_bed is not None:
+        try: ok &= float(m.get("bedrooms") or 0) >= float(q_bed) - 1e-6
+        except: pass
+    if q_budget is not None:
+        try: ok &= float(m.get("price") or 1e12) <= float(q_budget) + 1e-6
+        except: pass
+    if q_budget_min is not None:
+        try: ok &= m.get("price") is not None and float(m["price"]) >= float(q_budget_min) - 1e-6
+        except: pass
+    return ok
 
-    for doc, score in docs_scores:
-        m = doc.metadata or {}
-        ok = True
-        if q_type:
-            ok &= str(m.get("property_type","")).lower() == q_type
-        if q_loc:
-            ok &= q_loc in str(m.get("location","")).lower()
-        if q_bed is not None:
-            try: ok &= float(m.get("bedrooms") or 0) >= float(q_bed) - 1e-6
-            except: pass
-        if q_budget is not None:
-            try: ok &= float(m.get("price") or 1e12) <= float(q_budget) + 1e-6
-            except: pass
+def _hit(doc: Document, score: float) -> Dict[str, Any]:
+    m = doc.metadata or {}
+    return {
+        "id": f'{m.get("property_id")}::{m.get("section")}::{m.get("chunk_index")}',
+        "score": float(score),
+        "metadata": m,
+        "page_content": doc.page_content
+    }
+
+def _relevance(distance: float) -> float:
+    # Chroma returns distances (lower = closer); grouping needs a positive, higher-is-better
+    # score. Only reported as "relevance": "score" is a distance everywhere.
+    return 1.0 / (1.0 + max(float(distance), 0.0))
+
+@prioritized
+def search_properties(query: str, filters: Dict[str, Any], top_k: int = 5,
+                      group_by_property: bool = False, group_score: str = "max",
+                      section_weights: Dict[str, float] | None = None, two_stage: bool | None = None,
+                      user_id: str | None = None, personalize: float | None = None):
+    """user_id: blend the user's preference vector into the query (weight personalize, default PREF_BLEND)."""
+    two_stage = TWO_STAGE_SEARCH if two_stage is None else two_stage
+    filters = _resolve_location(filters)
+    emb = preferences.blend(_embeddings.embed_query(query), user_id, personalize)
+    if group_by_property:
+        return _search_grouped(emb, filters, top_k, group_score, section_weights or SECTION_WEIGHTS, two_stage)
+
+    pids = _candidates(emb, filters, top_k, two_stage)
+    if pids == []:
+        return []
+    docs_scores = _query(emb, top_k * 5, filters, pids)
 
-        if ok:
-            out.append({
-                "id": f'{m.get("property_id")}::{m.get("section")}::{m.get("chunk_index")}',
-                "score": float(score),
-                "metadata": m,
-                "page_content": doc.page_content
-            })
+    print(f"search_properties: query={query}, filters={filters}, found={len(docs_scores)}")
+    print(f"  docs_scores[0:3]={docs_scores[0:3]}")
+    out = []
+    for doc, score in docs_scores:
+        if _match(doc.metadata or {}, filters):
+            out.append(_hit(doc, score))
             if len(out) >= top_k:
                 break
     return out
+
+@prioritized
+def search_batch(searches: List[Tuple[str, Dict[str, Any]]], top_k: int = 5,
+                 two_stage: bool | None = None, user_id: str | None = None,
+                 personalize: float | None = None) -> List[List[Dict[str, Any]]]:
+    """
+    Flat search for many (query, filters) pairs at once: one encoder pass for all
+    queries, then one multi-embedding query per (collection, where clause), and
+    the per-query post-filter. Results come back in input order.
+    """
+    if not searches:
+        return []
+    two_stage = TWO_STAGE_SEARCH if two_stage is None else two_stage
+    filters_list = [_resolve_location(f or {}) for _, f in searches]
+    embs = [preferences.blend(e, user_id, personalize) for e in _embeddings.embed_documents([q for q, _ in searches])]
+    k = top_k * 5
+    # queries sharing a where clause (and candidate set) share one store call
+    groups: Dict[Tuple[str, Tuple[str, ...]], List[int]] = {}
+    wheres: Dict[str, Dict[str, Any] | None] = {}
+    allowed: Dict[str, List[str] | None] = {}
+    results: List[List[Dict[str, Any]]] = [[] for _ in searches]
+    for i, (emb, filters) in enumerate(zip(embs, filters_list)):
+        pids = _candidates(emb, filters, top_k, two_stage)
+        if pids == []:
+            continue
+        where = _hard_where(filters) or None
+        if pids is not None:
+            only = {"property_id": pids[0]} if len(pids) == 1 else {"property_id": {"$in": pids}}
+            where = {"$and": [where, only]} if where else only
+        key = json.dumps(where, sort_keys=True, default=str)
+        wheres[key], allowed[key] = where, pids
+        groups.setdefault((key, tuple(_route(filters))), []).append(i)
+
+    def run(group: Tuple[Tuple[str, Tuple[str, ...]], List[int]]):
+        (key, names), idx = group
+        per_query: List[List[Tuple[Document, float]]] = [[] for _ in idx]
+        parts = []
+        for name in names:
+            res = _chroma(name)._collection.query(
+                query_embeddings=[embs[i] for i in idx], n_results=k, where=wheres[key],
+                include=["documents", "metadatas", "distances"])
+            parts.append(res)
+        shared = _query_shared([embs[i] for i in idx], [filters_list[i] for i in idx], k, allowed[key])
+        for j in range(len(idx)):
+            lists = [
+                [(Document(page_content=doc or "", metadata=meta or {}), dist)
+                 for doc, meta, dist in zip(res["documents"][j], res["metadatas"][j], res["distances"][j])]
+                for res in parts
+            ] + [shared[j]]
+            per_query[j] = list(islice(heapq.merge(*lists, key=lambda t: t[1]), k))
+        return idx, per_query
+
+    for idx, per_query in _fanout.map(run, list(groups.items())):
+        for i, docs_scores in zip(idx, per_query):
+            out = results[i]
+            for doc, score in docs_scores:
+                if _match(doc.metadata or {}, filters_list[i]):
+                    out.append(_hit(doc, score))
+                    if len(out) >= top_k:
+                        break
+    return results
+
+@prioritized
+def search_page(query: str, filters: Dict[str, Any], page_size: int = 5,
+                cursor: str | None = None, two_stage: bool | None = None,
+                user_id: str | None = None, personalize: float | None = None) -> Tuple[List[Dict[str, Any]], str | None]:
+    """
+    Flat search served from a cached candidate list. Without a cursor a new list
+    is opened for (query, filters); with one, query/filters come from the list and
+    the page is a slice of it. The store is only queried again (with a doubled k)
+    when the list runs out.
+    """
+    if cursor:
+        token, offset = cursors.decode(cursor)
+        entry = cursors.get_list(token)
+    else:
+        emb = preferences.blend(_embeddings.embed_query(query), user_id, personalize)
+        filters = _resolve_location(filters)
+        token, entry = cursors.open_list(query, filters, emb)
+        # the candidate ids are part of the cached list: later pages stay within them
+        entry["pids"] = _candidates(emb, filters, page_size, TWO_STAGE_SEARCH if two_stage is None else two_stage)
+        offset = 0
+
+    with entry["lock"]:
+        want = offset + page_size
+        while len(entry["items"]) < want and not entry["exhausted"]:
+            _extend_candidates(entry, max(entry["fetched"] * 2, want * 5))
+        # the list may predate a delete
+        items = [it for it in entry["items"][offset:want] if not tombstones.is_dead(it["metadata"].get("property_id"))]
+        more = len(entry["items"]) > want or not entry["exhausted"]
+    return items, (cursors.encode(token, want) if more and items else None)
+
+def _extend_candidates(entry: Dict[str, Any], n: int) -> None:
+    filters = entry["filters"]
+    if entry.get("pids") == []:
+        entry["exhausted"] = True
+        return
+    page = _query(entry["embedding"], n, filters, entry.get("pids"))
+    # HNSW does not promise the same prefix for a larger k: skip hits already listed, not an offset
+    for doc, score in page:
+        if not _match(doc.metadata or {}, filters):
+            continue
+        hit = _hit(doc, score)
+        if hit["id"] not in entry["seen"]:
+            entry["seen"].add(hit["id"])
+            entry["items"].append(hit)
+    entry["fetched"] = len(page)
+    entry["exhausted"] = len(page) < n
+
+def _search_grouped(emb: List[float], filters: Dict[str, Any], top_k: int, group_score: str,
+                    weights: Dict[str, float], two_stage: bool = False):
+    """
+    One result per property_id. Chunks are consumed in score order and fetched in
+    growing pages; fetching stops once the top_k properties can no longer change
+    (threshold algorithm: every unseen chunk scores <= the last one seen).
+    Each result is its best chunk ("score" = that chunk's distance, as in flat
+    results) plus "relevance", the group score it is ranked by (higher = better).
+    """
+    weighted = group_score == "weighted"
+    w_total = sum(weights.values())
+    pids = _candidates(emb, filters, top_k, two_stage)
+    if pids == []:
+        return []
+    groups: Dict[str, Dict[str, Any]] = {}   # pid -> {"best": hit, "rel": its relevance, "sections": {section: relevance}, "hits": n}
+    seen, n, last = 0, top_k * 5, 1.0
+
+    def score_of(g: Dict[str, Any]) -> float:
+        if not weighted:
+            return g["rel"]
+        return sum(weights.get(sec, 0.0) * rel for sec, rel in g["sections"].items())
+
+    def final() -> bool:
+        if len(groups) < top_k:
+            return False
+        if not weighted:
+            return True  # first top_k distinct properties are the top_k by max
+        ranked = sorted(groups.values(), key=score_of, reverse=True)
+        kth = score_of(ranked[top_k - 1])
+        bound = w_total * last  # best any unseen property could still reach
+        for g in ranked[top_k:]:
+            unseen = sum(w for sec, w in weights.items() if sec not in g["sections"])
+            bound = max(bound, score_of(g) + unseen * last)
+        return kth >= bound
+
+    while True:
+        page = _query(emb, n, filters, pids)
+        for doc, dist in page[seen:]:
+            m = doc.metadata or {}
+            rel = last = _relevance(dist)
+            if not _match(m, filters):
+                continue
+            pid = m.get("property_id")
+            g = groups.get(pid)
+            if g is None:
+                if not weighted and len(groups) >= top_k:
+                    break
+                g = groups[pid] = {"best": _hit(doc, dist), "rel": rel, "sections": {}, "hits": 0}
+            g["hits"] += 1
+            # a packed chunk stands for every section it contains
+            for sec in (m.get("sections") or m.get("section") or "misc").split(","):
+                g["sections"][sec] = max(g["sections"].get(sec, 0.0), rel)
+        seen = len(page)
+        if final() or len(page) < n or n >= GROUP_MAX_FETCH:
+            break
+        n = min(n * 2, GROUP_MAX_FETCH)
+
+    ranked = sorted(groups.values(), key=score_of, reverse=True)[:top_k]
+    return [{**g["best"], "relevance": score_of(g), "hits": g["hits"]} for g in ranked]
@@ -0,0 +1,153 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterator
+
+log = logging.getLogger(__name__)
+
+
+class WriteAheadLog:
+    """
+    Append-only JSONL log of store writes.
+
+    append() only buffers the record; sync(seq) makes it durable. sync() is a
+    group commit: the first caller fsyncs everything appended so far and callers
+    that arrive meanwhile wait for that fsync (or the next one) instead of issuing
+    their own. checkpoint() drops the log once the store itself has been flushed.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self._fsync = fsync
+        self._cond = threading.Condition()
+        self._f = open(path, "ab")
+        self._seq = 0        # last appended
+        self._synced = 0     # last durable
+        self._syncing = False
+        self._pins = 0       # readers of the log tail (snapshots) block truncation
+
+    def append(self, record: Dict[str, Any]) -> int:
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._cond:
+            self._f.write(line)
+            self._f.flush()
+            self._seq += 1
+            return self._seq
+
+    def sync(self, seq: int | None = None) -> None:
+        with self._cond:
+            target = self._seq if seq is None else seq
+            while self._synced < target:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                # become the leader for everything written so far
+                self._syncing = True
+                upto = self._seq
+                self._cond.release()
+                try:
+                    if self._fsync:
+                        os.fsync(self._f.fileno())
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._synced = max(self._synced, upto)
+                    self._cond.notify_all()
+
+    def checkpoint(self) -> None:
+        """Forget every record appended so far; caller guarantees they are applied and flushed."""
+        with self._cond:
+            if self._pins:
+                return  # a snapshot still needs the tail; the next flush truncates
+            self._f.truncate(0)
+            self._f.seek(0)
+            self._synced = self._seq
+
+    def pin(self) -> int:
+        """Keep the log from being truncated; returns the current end offset."""
+        with self._cond:
+            self._pins += 1
+            return self._f.tell()
+
+    def unpin(self) -> None:
+        with self._cond:
+            self._pins -= 1
+
+    def tell(self) -> int:
+        with self._cond:
+            return self._f.tell()
+
+    def records(self, start: int = 0, end: int | None = None) -> Iterator[Dict[str, Any]]:
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                if end is not None and f.tell() > end:
+                    return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # torn tail from a crash mid-append: never acknowledged
+                    log.warning("[wal] ignoring partial record in %s", self.path)
+                    return
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def close(self) -> None:
+        self.sync()
+        with self._cond:
+            self._f.close()
+
+
+class FlushPolicy:
+    """
+    When to flush the store (and checkpoint the WAL):
+      "always"   after every write
+      "every_n"  after every `every_n` writes
+      "interval" at most every `interval_ms`, from a background thread
+      "shutdown" only on close()
+    """
+
+    def __init__(self, flush: Callable[[], None], mode: str = "always",
+                 every_n: int = 100, interval_ms: int = 200):
+        if mode not in ("always", "every_n", "interval", "shutdown"):
+            raise ValueError(f"unknown flush policy {mode!r}")
+        self.mode = mode
+        self._flush = flush
+        self._every_n = max(1, every_n)
+        self._interval = max(1, interval_ms) / 1000.0
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        if mode == "interval":
+            self._thread = threading.Thread(target=self._loop, name="store-flusher", daemon=True)
+            self._thread.start()
+
+    def note_write(self) -> None:
+        with self._lock:
+            self._pending += 1
+            due = self.mode == "always" or (self.mode == "every_n" and self._pending >= self._every_n)
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            self._pending = 0
+        self._flush()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception("[wal] periodic flush failed")
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
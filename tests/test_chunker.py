@@ -0,0 +1,47 @@
+from langchain.schema import Document
+
+from services.api.chunker import PACK_MAX_SECTION_TOKENS, PACKED_SECTION, chunk_documents
+
+
+class _WordTokenizer:
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+
+
+def _doc(pid, section, words):
+    return Document(page_content=" ".join(f"w{i}" for i in range(words)),
+                    metadata={"property_id": pid, "section": section})
+
+
+def test_small_sections_of_a_property_are_packed():
+    docs = [_doc("p1", "description", 10), _doc("p1", "legal_and_product_status", 5), _doc("p2", "description", 8)]
+    out = chunk_documents(docs, chunk_size=126, chunk_overlap=16, tokenizer=_WordTokenizer())
+    packed = [d for d in out if d.metadata["property_id"] == "p1"]
+    assert len(packed) == 1
+    assert packed[0].metadata["section"] == PACKED_SECTION
+    assert packed[0].metadata["sections"] == "description,legal_and_product_status"
+    # a lone small section is left as it is
+    assert [d.metadata["section"] for d in out if d.metadata["property_id"] == "p2"] == ["description"]
+
+
+def test_shared_and_large_sections_are_not_packed():
+    docs = [_doc("p1", "living_experience", 5), _doc("p1", "misc", 5),
+            _doc("p1", "physical_features", PACK_MAX_SECTION_TOKENS + 1), _doc("p1", "description", 5)]
+    out = chunk_documents(docs, chunk_size=126, chunk_overlap=16, tokenizer=_WordTokenizer())
+    sections = [d.metadata["section"] for d in out]
+    assert "living_experience" in sections and "physical_features" in sections
+    assert [d.metadata.get("sections") for d in out if d.metadata["section"] == PACKED_SECTION] == ["misc,description"]
+
+
+def test_long_section_split_within_budget():
+    out = chunk_documents([_doc("p1", "description", 300)], chunk_size=100, chunk_overlap=10,
+                          tokenizer=_WordTokenizer())
+    assert len(out) > 1
+    assert all(len(d.page_content.split()) <= 100 for d in out)
+    assert [d.metadata["chunk_index"] for d in out] == list(range(len(out)))
+
+
+def test_without_tokenizer_nothing_is_packed():
+    docs = [_doc("p1", "description", 10), _doc("p1", "misc", 5)]
+    out = chunk_documents(docs, chunk_size=800, chunk_overlap=120)
+    assert [d.metadata["section"] for d in out] == ["description", "misc"]
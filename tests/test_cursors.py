@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+import pytest
+
+from services.api import cursors
+from services.api.cursors import CursorExpired
+
+
+@pytest.fixture(autouse=True)
+def lists(monkeypatch):
+    monkeypatch.setattr(cursors, "_lists", OrderedDict())
+
+
+def test_open_and_get():
+    token, entry = cursors.open_list("căn hộ q7", {"location": "Q7"}, [0.1, 0.2])
+    assert cursors.get_list(token) is entry
+    assert entry["items"] == [] and entry["seen"] == set() and not entry["exhausted"]
+
+
+def test_cursor_roundtrip():
+    assert cursors.decode(cursors.encode("abc_-1", 15)) == ("abc_-1", 15)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "YWJj"])
+def test_bad_cursor(cursor):
+    with pytest.raises(CursorExpired):
+        cursors.decode(cursor)
+
+
+def test_expired_list(monkeypatch):
+    monkeypatch.setattr(cursors, "CURSOR_TTL_S", -1)
+    token, _ = cursors.open_list("q", {}, [])
+    with pytest.raises(CursorExpired):
+        cursors.get_list(token)
+
+
+def test_get_extends_ttl(monkeypatch):
+    monkeypatch.setattr(cursors, "CURSOR_TTL_S", 60)
+    now = [1000.0]
+    monkeypatch.setattr(cursors.time, "time", lambda: now[0])
+    token, entry = cursors.open_list("q", {}, [])
+    now[0] += 50
+    cursors.get_list(token)
+    now[0] += 50  # past the first deadline, within the extended one
+    assert cursors.get_list(token) is entry
+    now[0] += 61
+    with pytest.raises(CursorExpired):
+        cursors.get_list(token)
+
+
+def test_oldest_list_evicted(monkeypatch):
+    monkeypatch.setattr(cursors, "CURSOR_MAX_LISTS", 2)
+    first, _ = cursors.open_list("a", {}, [])
+    cursors.open_list("b", {}, [])
+    cursors.open_list("c", {}, [])
+    with pytest.raises(CursorExpired):
+        cursors.get_list(first)
@@ -0,0 +1,61 @@
+from collections import Counter
+
+import pytest
+
+from services.api import facets
+
+
+@pytest.fixture(autouse=True)
+def cube(monkeypatch):
+    # in-memory cube only: no property_facets rows are read or written
+    monkeypatch.setattr(facets, "_loaded", True)
+    monkeypatch.setattr(facets, "_cube", Counter())
+    monkeypatch.setattr(facets, "_cells", {})
+    monkeypatch.setattr(facets, "_values", [Counter() for _ in facets.DIMENSIONS])
+    for location, ptype, beds, price in [
+        ("Quận 7", "apartment", 2, 2.5e9),
+        ("Q7", "apartment", 3, 4e9),
+        ("District 1", "villa", 4, 12e9),
+        ("Vũng Tàu", "apartment", 1, 0.8e9),   # not in the gazetteer: stays text
+    ]:
+        facets._apply(facets._cell(location, ptype, beds, price), +1)
+
+
+def test_total_and_location_labels():
+    out = facets.facet_counts()
+    assert out["total"] == 4
+    assert out["facets"]["location"] == {"Quận 7": 2, "Quận 1": 1, "vũng tàu": 1}
+    assert out["approximate"] == {}
+
+
+def test_city_filter_counts_its_districts():
+    out = facets.facet_counts({"location": "HCM"})
+    assert out["total"] == 3
+    # each dimension ignores its own filter
+    assert out["facets"]["location"]["vũng tàu"] == 1
+
+
+def test_bedrooms_means_at_least():
+    assert facets.facet_counts({"bedrooms": 3})["total"] == 2
+    assert facets.facet_counts({"bedrooms": 4, "property_type": "apartment"})["total"] == 0
+
+
+def test_budget_on_band_edges_is_exact():
+    out = facets.facet_counts({"budget_min": 2e9, "budget_max": 5e9})
+    assert out["total"] == 2
+    assert out["approximate"] == {}
+
+
+@pytest.mark.parametrize("filters, key, note", [
+    ({"budget_max": 4.5e9}, "budget_max", {"requested": 4.5e9, "counted_up_to": 3e9}),
+    ({"budget_min": 1.5e9}, "budget_min", {"requested": 1.5e9, "counted_from": 2e9}),
+])
+def test_budget_between_edges_is_approximate(filters, key, note):
+    out = facets.facet_counts(filters)
+    assert out["approximate"][key] == note
+
+
+def test_remove_cell():
+    facets._apply(facets._cell("Quận 7", "apartment", 2, 2.5e9), -1)
+    out = facets.facet_counts({"location_id": "hcm-q7"})
+    assert out["total"] == 1
@@ -0,0 +1,50 @@
+import pytest
+
+from services.api import geo
+
+
+@pytest.fixture(autouse=True)
+def grid(monkeypatch):
+    # in-memory grid only: no property_locations rows are read or written
+    monkeypatch.setattr(geo, "_loaded", True)
+    monkeypatch.setattr(geo, "_points", {})
+    monkeypatch.setattr(geo, "_grid", {p: {} for p in geo.GRID_PRECISIONS})
+    q7 = geo.center("hcm-q7")
+    geo._index("near", q7[0] + 0.005, q7[1])          # ~0.6 km north
+    geo._index("mid", q7[0], q7[1] + 0.02)            # ~2.2 km east
+    geo._index("q1", *geo.center("hcm-q1"))           # ~5 km away
+    geo._index("hanoi", *geo.center("hn"))
+
+
+def test_haversine():
+    assert geo.haversine_km((0.0, 0.0), (0.0, 1.0)) == pytest.approx(111.2, abs=0.1)
+
+
+def test_within_nearest_first():
+    q7 = geo.center("hcm-q7")
+    assert geo.within(q7[0], q7[1], 3) == ["near", "mid"]
+    assert geo.within(q7[0], q7[1], 10) == ["near", "mid", "q1"]
+    assert geo.within(q7[0], q7[1], 0.1) == []
+
+
+def test_unindex():
+    geo._unindex("near")
+    q7 = geo.center("hcm-q7")
+    assert geo.within(q7[0], q7[1], 3) == ["mid"]
+
+
+def test_radius_center():
+    assert geo.radius_center({"location_id": "hcm-q7", "radius_km": 2}) == (*geo.center("hcm-q7"), 2.0)
+    assert geo.radius_center({"lat": 10.0, "lon": 106.0, "radius_km": "1.5"}) == (10.0, 106.0, 1.5)
+    assert geo.radius_center({"location_id": "hcm-q7"}) is None
+    # no centre: callers fall back to the place filter
+    assert geo.radius_center({"location": "Vũng Tàu", "radius_km": 2}) is None
+
+
+def test_near_and_candidates():
+    lat, lon = geo.center("hcm-q7")
+    assert geo.near("near", lat, lon, 1)
+    assert not geo.near("hanoi", lat, lon, 100)
+    assert not geo.near("unknown", lat, lon, 100)
+    assert geo.radius_candidates({"location_id": "hcm-q7", "radius_km": 3}) == ["near", "mid"]
+    assert geo.radius_candidates({"location_id": "hcm-q7"}) is None
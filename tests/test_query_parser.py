@@ -0,0 +1,20 @@
+import pytest
+
+from services.api.query_parser import extract_filters
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("căn hộ 2 phòng ngủ Q7 dưới 3 tỷ",
+     {"property_type": "căn hộ", "location_id": "hcm-q7", "bedrooms": 2.0, "budget_max": 3e9}),
+    ("3 phòng", {"bedrooms": 3.0}),
+    ("2pn", {"bedrooms": 2.0}),
+    ("nhà 3 phòng tắm Quận 1", {"location_id": "hcm-q1", "bedrooms": None}),
+    ("nhà 2 phòng khách", {"bedrooms": None}),
+    ("3 phòng tắm, 2 phòng ngủ", {"bedrooms": 2.0}),
+    ("cách Quận 1 trong vòng 5 km", {"location_id": "hcm-q1", "radius_km": 5.0}),
+    ("District 7", {"location_id": "hcm-q7"}),
+])
+def test_extract_filters(text, expected):
+    got = extract_filters(text)
+    for key, value in expected.items():
+        assert got.get(key) == value, (text, key, got)
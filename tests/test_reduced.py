@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from services.api.reduced import ColdStore, Projection, rescore
+
+
+def test_put_get_delete(tmp_path):
+    cold = ColdStore(str(tmp_path / "cold"), 4)
+    cold.put(["a", "b"], [[1, 0, 0, 0], [0, 1, 0, 0]])
+    cold.put(["a"], [[0, 0, 1, 0]])  # last put wins
+    cold.delete(["b"])
+    got = cold.get(["a", "b", "c"])
+    assert list(got) == ["a"]
+    np.testing.assert_array_equal(got["a"], [0, 0, 1, 0])
+    assert len(cold) == 1
+
+
+def test_reopen_and_compact(tmp_path):
+    cold = ColdStore(str(tmp_path / "cold"), 2)
+    cold.put(["a", "b", "c"], [[1, 0], [0, 1], [1, 1]])
+    cold.delete(["b"])
+    again = ColdStore(str(tmp_path / "cold"), 2)
+    assert set(again.get(["a", "b", "c"])) == {"a", "c"}
+    assert again.dead_fraction() == pytest.approx(1 / 3)
+    assert again.compact() == 1
+    assert again.dead_fraction() == 0.0
+    np.testing.assert_array_equal(again.get(["c"])["c"], [1, 1])
+    ids = [i for batch, _ in again.iter_all() for i in batch]
+    assert ids == ["a", "c"]
+
+
+def test_rescore_orders_by_full_cosine(tmp_path):
+    cold = ColdStore(str(tmp_path / "cold"), 3)
+    cold.put(["x", "y", "z"], [[1, 0, 0], [0.7, 0.7, 0], [0, 0, 1]])
+    sims = rescore([1, 0.1, 0], ["x", "y", "z", "missing"], cold)
+    assert set(sims) == {"x", "y", "z"}
+    assert sorted(sims, key=sims.get, reverse=True) == ["x", "y", "z"]
+    assert sims["x"] == pytest.approx(1 / np.sqrt(1.01), rel=1e-5)
+
+
+def test_projection_roundtrip(tmp_path):
+    rng = np.random.default_rng(1)
+    vecs = rng.normal(size=(50, 16)).astype(np.float32)
+    proj = Projection.fit(vecs, 4)
+    out = proj.transform(vecs[:3])
+    assert out.shape == (3, 4)
+    np.testing.assert_allclose(np.linalg.norm(out, axis=1), 1.0, rtol=1e-5)
+    proj.save(str(tmp_path / "p.npz"))
+    np.testing.assert_allclose(Projection.load(str(tmp_path / "p.npz")).transform(vecs[:3]), out, rtol=1e-5)
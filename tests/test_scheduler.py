@@ -0,0 +1,54 @@
+import threading
+import time
+
+from services.api.scheduler import PriorityGate
+
+
+def _enter_background(gate, entered, hold=0.0):
+    def run():
+        with gate.background():
+            entered.append(time.monotonic())
+            time.sleep(hold)
+    t = threading.Thread(target=run)
+    t.start()
+    return t
+
+
+def test_background_waits_for_interactive():
+    gate = PriorityGate(grace_ms=20, slots=1, max_wait_s=5)
+    entered = []
+    with gate.interactive():
+        t = _enter_background(gate, entered)
+        time.sleep(0.1)
+        assert entered == []
+        released = time.monotonic()
+    t.join(2)
+    # not before the grace period after the last interactive call
+    assert entered and entered[0] - released >= 0.015
+
+
+def test_background_runs_when_idle():
+    gate = PriorityGate(grace_ms=0, slots=1, max_wait_s=5)
+    entered = []
+    _enter_background(gate, entered).join(1)
+    assert len(entered) == 1
+
+
+def test_background_gets_a_turn_after_max_wait():
+    gate = PriorityGate(grace_ms=20, slots=1, max_wait_s=0.1)
+    entered = []
+    with gate.interactive():
+        t = _enter_background(gate, entered)
+        t.join(1)
+        assert len(entered) == 1  # entered while interactive work was still running
+
+
+def test_background_slots():
+    gate = PriorityGate(grace_ms=0, slots=1, max_wait_s=5)
+    entered = []
+    first = _enter_background(gate, entered, hold=0.1)
+    time.sleep(0.02)
+    second = _enter_background(gate, entered)
+    first.join(); second.join()
+    assert len(entered) == 2 and entered[1] - entered[0] >= 0.09
+    assert gate.stats() == {"interactive": 0, "background": 0}
@@ -0,0 +1,46 @@
+import pytest
+
+from services.api import shards
+
+
+@pytest.mark.parametrize("location, key", [
+    ("Quận 7, TP. Hồ Chí Minh", "quan_7"),
+    ("Đà Nẵng", "da_nang"),
+    ("", "unknown"),
+    (None, "unknown"),
+])
+def test_shard_key(location, key):
+    assert shards.shard_key(location) == key
+
+
+def test_place_key():
+    assert shards.place_key("hcm-q7") == "g_hcm_q7"
+    assert shards.collection_name("properties", "Quận 7") == "properties__quan_7"
+
+
+NAMES = ["properties__g_hcm_q7", "properties__g_hcm_q1", "properties__g_hn", "properties__quan_7"]
+
+
+def test_route_keeps_matching_and_text_keyed_shards():
+    assert shards.route(NAMES, "properties", {"g_hcm_q7"}) == ["properties__g_hcm_q7", "properties__quan_7"]
+
+
+def test_route_several_keys():
+    got = shards.route(NAMES, "properties", {"g_hcm_q7", "g_hcm_q1"})
+    assert got == ["properties__g_hcm_q7", "properties__g_hcm_q1", "properties__quan_7"]
+
+
+def test_route_no_key_matches():
+    assert shards.route(NAMES, "properties", {"g_dn"}) == ["properties__quan_7"]
+
+
+class _Client:
+    def list_collections(self):
+        return NAMES + ["properties", "properties__g_hcm_q7-rebuild", "properties__g_hn-retired", "messages"]
+
+
+def test_known_skips_rebuild_and_retired(monkeypatch):
+    monkeypatch.setattr(shards, "_known", None)
+    assert shards.known(_Client(), "properties") == sorted(NAMES)
+    shards.register("properties__g_dn")
+    assert "properties__g_dn" in shards.known(_Client(), "properties")